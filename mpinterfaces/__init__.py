@@ -42,6 +42,11 @@ VDW_KERNEL = MPINT_CONFIG.get('vdw_kernel', None)
 VASP_PSP = MPINT_CONFIG.get('potentials', None)
 QUEUE_SYSTEM = MPINT_CONFIG.get('queue_system', None)
 QUEUE_TEMPLATE = MPINT_CONFIG.get('queue_template', None)
+BLOB_STORE = MPINT_CONFIG.get('blob_store', None) or \
+    os.path.join(os.path.expanduser('~'), '.mpint_blobs')
+RESOURCE_MODEL = MPINT_CONFIG.get('resource_model', None)
+SYMMETRY_CACHE = MPINT_CONFIG.get('symmetry_cache', None) or \
+    os.path.join(os.path.expanduser('~'), '.mpint_symmetry.db')
 
 if not QUEUE_SYSTEM:
     QUEUE_SYSTEM = 'slurm'
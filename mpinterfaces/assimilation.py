@@ -0,0 +1,237 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+incremental assimilation of vasp run directories into a database.
+
+The run directories found by the drone below the root directory are
+compared with a manifest of the directories already assimilated, keyed
+by path with the (name, mtime, size) of their files as signature. Only
+the new or changed directories are parsed, by drone.get_task_doc in a
+process pool, and the task documents are streamed to the sink as they
+are parsed. The sink is any callable taking a document:
+    DroneSink: inserts through the drone, as drone.assimilate does,
+        buffered if the drone has a batch_size
+    CollectionSink: upserts into a pymongo(or mongomock) collection
+    FileSink: appends the documents to a json lines file
+"""
+
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from pymongo import ReturnDocument
+
+from monty.json import MontyEncoder
+
+from mpinterfaces.checkpoint import file_lock
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+MANIFEST_FILE = '.mpint_assimilated.json'
+
+
+def get_dir_signature(path, subdirs=()):
+    """
+    sorted [name, mtime, size] of the files in path and in its
+    subdirectories listed in subdirs(e.g. relax1, relax2)
+    """
+    signature = []
+    for d in ('',) + tuple(subdirs):
+        dirname = os.path.join(path, d)
+        if not os.path.isdir(dirname):
+            continue
+        for fname in os.listdir(dirname):
+            filename = os.path.join(dirname, fname)
+            # the manifest itself, when kept in a run directory
+            if fname.startswith(MANIFEST_FILE) or \
+                    not os.path.isfile(filename):
+                continue
+            st = os.stat(filename)
+            signature.append([os.path.join(d, fname), st.st_mtime,
+                              st.st_size])
+    return sorted(signature)
+
+
+class Manifest(object):
+    """
+    json file of the directories already assimilated, path: signature
+
+    Args:
+        filename: manifest file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+
+    def is_current(self, path, signature):
+        return self.entries.get(path) == signature
+
+    def add(self, path, signature):
+        self.entries[path] = signature
+
+    def save(self):
+        with file_lock(self.filename):
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+            os.rename(tmp, self.filename)
+
+
+class DroneSink(object):
+    """
+    inserts the documents through the drone, with its duplicate and
+    dos handling, as drone.assimilate does
+    """
+
+    def __init__(self, drone):
+        self.drone = drone
+
+    def __call__(self, d):
+        if getattr(self.drone, 'mapi_key', None) is not None and \
+                d.get('state') == 'successful':
+            self.drone.calculate_stability(d)
+        return self.drone._insert_doc(d)
+
+    def flush(self):
+        if hasattr(self.drone, 'flush'):
+            self.drone.flush()
+
+
+class CollectionSink(object):
+    """
+    upserts the documents into the collection by dir_name, so that a
+    changed directory replaces its earlier document
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __call__(self, d):
+        return self.collection.find_one_and_replace(
+            {'dir_name': d['dir_name']}, d, projection=['_id'], upsert=True,
+            return_document=ReturnDocument.AFTER)['_id']
+
+
+class FileSink(object):
+    """
+    appends the documents to a json lines file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, d):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(d, cls=MontyEncoder) + '\n')
+        return d.get('dir_name')
+
+
+def get_valid_paths(root_dir, drone):
+    """
+    the run directories below root_dir, as found by BorgQueen
+    """
+    paths = []
+    for parent, subdirs, files in os.walk(root_dir):
+        paths.extend(drone.get_valid_paths((parent, subdirs, files)))
+    return paths
+
+
+def _get_task_doc(drone, path):
+    return drone.get_task_doc(path)
+
+
+def assimilate(root_dir, drone, sink=None, manifest=None, nprocs=None,
+               save_every=50, as_logger=None):
+    """
+    parse the new or changed run directories below root_dir with the
+    drone and stream their task documents to the sink
+
+    Args:
+        root_dir: directory tree to assimilate
+        drone: drone with get_valid_paths and get_task_doc, e.g.
+            MPINTVaspToDbTaskDrone
+        sink: callable the documents are passed to, defaults to
+            DroneSink(drone)
+        manifest: manifest file, defaults to MANIFEST_FILE in root_dir
+        nprocs: number of parsing processes, defaults to the number of
+            cpus. With 1 the directories are parsed in this process.
+        save_every: number of documents between manifest saves
+        as_logger: logger
+
+    Returns:
+        list of the values returned by the sink
+    """
+    as_logger = as_logger or logger
+    sink = sink or DroneSink(drone)
+    manifest = Manifest(manifest or os.path.join(root_dir, MANIFEST_FILE))
+    subdirs = getattr(drone, 'runs', None) or ()
+    todo = []
+    for path in get_valid_paths(root_dir, drone):
+        path = os.path.abspath(path)
+        signature = get_dir_signature(path, subdirs)
+        if not manifest.is_current(path, signature):
+            todo.append((path, signature))
+    as_logger.info('{0} new or changed run directories in {1}'.format(
+        len(todo), root_dir))
+    results = []
+
+    def consume(path, signature, d):
+        # failed parses are not recorded, retried next time
+        if d is None:
+            as_logger.warn('no task document for {}'.format(path))
+            return
+        results.append(sink(d))
+        manifest.add(path, signature)
+        if len(results) % save_every == 0:
+            save()
+
+    def save():
+        # buffered documents are written before they are recorded
+        if hasattr(sink, 'flush'):
+            sink.flush()
+        manifest.save()
+
+    try:
+        if nprocs == 1 or len(todo) <= 1:
+            for path, signature in todo:
+                consume(path, signature, _get_task_doc(drone, path))
+        else:
+            nprocs = nprocs or multiprocessing.cpu_count()
+            with ProcessPoolExecutor(max_workers=nprocs) as executor:
+                # bounded number of documents in flight
+                pending = {}
+                queue = iter(todo)
+                while True:
+                    while len(pending) < 2 * nprocs:
+                        item = next(queue, None)
+                        if item is None:
+                            break
+                        f = executor.submit(_get_task_doc, drone, item[0])
+                        pending[f] = item
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        path, signature = pending.pop(f)
+                        try:
+                            d = f.result()
+                        except Exception as ex:
+                            as_logger.error('error parsing {0}: {1}'.format(
+                                path, ex))
+                            continue
+                        consume(path, signature, d)
+    finally:
+        if todo:
+            save()
+    return results
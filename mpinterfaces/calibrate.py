@@ -29,6 +29,7 @@ from six.moves import range
 import sys
 import os
 import re
+import time
 import datetime
 from itertools import product
 from collections import OrderedDict
@@ -45,13 +46,20 @@ from pymatgen.symmetry.bandstructure import HighSymmKpath
 
 from custodian.custodian import Custodian
 
-from monty.json import MSONable, MontyEncoder
-from monty.serialization import dumpfn
+from monty.json import MSONable
 
-from mpinterfaces.instrument import MPINTVaspInputSet, MPINTVaspJob
+from mpinterfaces.instrument import MPINTVaspInputSet, MPINTVaspJob, \
+    MPINTLazyVaspInputSet, write_job_inputs, get_incar_diff, get_potcar, \
+    submit_jobs, submit_job_array
 from mpinterfaces.interface import Interface, Ligand
+from mpinterfaces.registry import JobRegistry
+from mpinterfaces.checkpoint import get_checkpoint
+from mpinterfaces.packing import submit_packed_jobs, update_pack_status
+from mpinterfaces.compact import BlobStore, get_potcar_spec, potcar_from_spec, \
+    poscar_to_ref, poscar_from_ref, get_job_delta, job_from_delta
 from mpinterfaces.utils import get_ase_slab, get_magmom_string, get_magmom_afm, \
-    get_magmom_mae, print_exception
+    get_magmom_mae, print_exception, get_converged_value, get_job_state, \
+    get_queue_status
 from mpinterfaces.mat2d.electronic_structure import get_2D_hse_kpoints,\
     get_2D_incar_hse_prep, get_2D_incar_hse
 from mpinterfaces.default_logger import get_default_logger
@@ -85,7 +93,8 @@ class Calibrate(MSONable):
                  reuse_override=None, reuse_incar=None, solvation=None,
                  turn_knobs=OrderedDict([('ENCUT', []),
                                          ('KPOINTS', [])]),
-                 checkpoint_file=None, finer_kpoint=None, cal_logger=None):
+                 checkpoint_file=None, finer_kpoint=None, cal_logger=None,
+                 lazy=False, registry=None):
         """
         Calibrate constructor
 
@@ -137,6 +146,16 @@ class Calibrate(MSONable):
                            'Magntic Anisotropy Energy'
             solvation (bool): whether to activate a solvation job, sets LSOL=True
                            for now
+            lazy (bool): whether to store only the job specs, i.e the
+                           INCAR difference with respect to the input
+                           INCAR and references to the poscar, kpoints and
+                           potcar. The inputsets are materialized when the
+                           jobs are written or serialized. Useful for
+                           is_matrix runs with many knob combinations
+            registry (str): path to the sqlite job registry. Jobs with
+                           inputs identical to a finished or queued job
+                           in the registry are linked to that job's
+                           directory instead of being submitted
 
         Calibrate jobs represent the engine configuration of mpinterfaces,
         where the fuel (input file sources) and driving method (kind of calculation)
@@ -168,8 +187,8 @@ class Calibrate(MSONable):
         self.poscar = poscar
         self.potcar = potcar
         if poscar:
-            self.potcar = Potcar(symbols=poscar.site_symbols,
-                                 functional=functional)
+            self.potcar = get_potcar(poscar.site_symbols,
+                                     functional=functional)
         self.kpoints = kpoints
         if incar:
             self.incar_orig = incar.as_dict()
@@ -208,6 +227,8 @@ class Calibrate(MSONable):
         self.finer_kpoint = finer_kpoint
         self.functional = functional
         self.checkpoint_file = checkpoint_file
+        self.lazy = lazy
+        self.registry = registry
         if cal_logger:
             self.logger = cal_logger
         else:
@@ -448,8 +469,7 @@ class Calibrate(MSONable):
             func = functional
         else:
             func = self.functional
-        self.potcar = Potcar(symbols=mapped_symbols,
-                             functional=func)
+        self.potcar = get_potcar(mapped_symbols, functional=func)
 
     def set_kpoints(self, kpoint=None, poscar=None, ibzkpth=None):
         """
@@ -796,10 +816,13 @@ class Calibrate(MSONable):
         add a single job using the current incar, poscar, potcar and
         kpoints
         """
-        vis = MPINTVaspInputSet(name, self.incar, self.poscar,
-                                self.potcar, self.kpoints,
-                                self.qadapter, vis_logger=self.logger,
-                                reuse_path=self.reuse_paths)
+        if self.lazy:
+            vis = self.get_lazy_inputset(name)
+        else:
+            vis = MPINTVaspInputSet(name, self.incar, self.poscar,
+                                    self.potcar, self.kpoints,
+                                    self.qadapter, vis_logger=self.logger,
+                                    reuse_path=self.reuse_paths)
         # the job command can be overrridden in the run method
         job = MPINTVaspJob(self.job_cmd, name=name, final=True,
                            parent_job_dir=self.parent_job_dir,
@@ -808,36 +831,235 @@ class Calibrate(MSONable):
         self.job_dir_list.append(os.path.abspath(job_dir))
         self.jobs.append(job)
 
-    def run(self, job_cmd=None):
+    def get_lazy_inputset(self, name):
+        """
+        job spec for the current incar, poscar, potcar and kpoints:
+        the difference of the incar with respect to the input incar
+        and references to the other inputs
+        """
+        base = self.incar_orig
+        incar_diff, incar_removed = get_incar_diff(base, self.incar)
+        return MPINTLazyVaspInputSet(name, base, incar_diff, self.poscar,
+                                     self.kpoints, potcar=self.potcar,
+                                     qadapter=self.qadapter,
+                                     vis_logger=self.logger,
+                                     reuse_path=self.reuse_paths,
+                                     incar_removed=incar_removed)
+
+    def write_inputs(self, max_workers=8, jobs=None):
+        """
+        write the input files of all the jobs concurrently
+
+        Args:
+            max_workers: number of threads used for writing
+            jobs: the jobs to write, defaults to all the jobs
+
+        Returns:
+            OrderedDict of job_dir: exception for the failed jobs
+        """
+        if jobs is None:
+            jobs = self.jobs
+        return write_job_inputs(jobs, max_workers=max_workers,
+                                wj_logger=self.logger)
+
+    def run(self, job_cmd=None, write_workers=None, submit_workers=None,
+            job_array=False, max_running=None, pack_groups=None):
         """
         run the vasp jobs through custodian
         if the job list is empty,
         run a single job with the initial input set
+
+        Args:
+            job_cmd: overrides the job command of the jobs
+            write_workers: if set, the inputs of all the jobs are
+                first written concurrently with that many threads and
+                the jobs whose inputs could not be written are skipped
+            submit_workers: if set, the jobs are launched concurrently
+                with that many threads instead of one after the other
+                through custodian, the jobs that could not be launched
+                are not logged
+            job_array: if set and the jobs are submitted to a batch
+                queue, all the jobs are submitted at once as a single
+                job array. The ids of the array tasks are logged as the
+                job ids
+            max_running: maximum number of array tasks running at once
+            pack_groups: if set, all the jobs are run from a single
+                allocation, pack_groups of them at once, see
+                packing.submit_packed_jobs. The status of the packed
+                jobs is collected into the checkpoint with
+                packing.update_pack_status
+
+        If a job registry is set, the jobs identical to registered
+        ones are linked instead of being run and the submitted jobs are
+        registered.
         """
         for j in self.jobs:
             if job_cmd is not None:
                 j.job_cmd = job_cmd
             else:
                 j.job_cmd = self.job_cmd
-        c_params = {'jobs': [j.as_dict() for j in self.jobs],
-                    'handlers': [h.as_dict() for h in self.handlers],
-                    'max_errors': 5}
-        c = Custodian(self.handlers, self.jobs, max_errors=5)
-        c.run()
+        jobs = self.jobs
+        linked = []
+        registry = None
+        if self.registry:
+            registry = JobRegistry(self.registry, reg_logger=self.logger)
+            jobs, linked = registry.dedupe(jobs)
+        if write_workers:
+            errors = self.write_inputs(max_workers=write_workers,
+                                       jobs=jobs)
+            if errors:
+                self.logger.error('skipping the jobs in {}'
+                                  .format(list(errors.keys())))
+                jobs = [j for j in jobs if j.job_dir not in errors]
+        if pack_groups:
+            if jobs:
+                submit_packed_jobs(jobs, qadapter=self.qadapter,
+                                   n_groups=pack_groups,
+                                   launch_dir=self.parent_job_dir,
+                                   pk_logger=self.logger)
+        elif job_array and self.qadapter is not None:
+            if jobs:
+                submit_job_array(jobs, qadapter=self.qadapter,
+                                 launch_dir=self.parent_job_dir,
+                                 max_running=max_running,
+                                 sa_logger=self.logger)
+        elif submit_workers:
+            errors = submit_jobs(jobs, max_workers=submit_workers,
+                                 sj_logger=self.logger)
+            jobs = [j for j in jobs if j.job_dir not in errors]
+        else:
+            c_params = {'jobs': [j.as_dict() for j in jobs],
+                        'handlers': [h.as_dict() for h in self.handlers],
+                        'max_errors': 5}
+            c = Custodian(self.handlers, jobs, max_errors=5)
+            c.run()
+        if registry:
+            registry.register_jobs(jobs)
+        logged = set(id(j) for j in jobs + linked)
         for j in self.jobs:
+            if id(j) not in logged:
+                continue
             self.cal_log.append({"job": j.as_dict(),
                                  'job_id': j.job_id,
                                  "corrections": [],
                                  'final_energy': None})
             self.job_ids.append(j.job_id)
-        if self.checkpoint_file:
-            dumpfn(self.cal_log, self.checkpoint_file,
-                   cls=MontyEncoder, indent=4)
-        else:
-            dumpfn(self.cal_log, Calibrate.LOG_FILE, cls=MontyEncoder,
-                   indent=4)
+        get_checkpoint(self.checkpoint_file or Calibrate.LOG_FILE).write(
+            self.cal_log)
+        if pack_groups and self.qadapter is None:
+            update_pack_status(self.checkpoint_file or Calibrate.LOG_FILE)
+
+    def run_adaptive(self, params=('ENCUT', 'KPOINTS'), ev_per_atom=0.001,
+                     n_converged=2, wave_size=2, interval=60,
+                     job_cmd=None, write_workers=None):
+        """
+        adaptive calibration: instead of running the full turn_knobs
+        grid, the values of each knob are submitted in increasing order
+        in waves of wave_size jobs and the submission stops as soon as
+        the energy per atom changes by less than ev_per_atom for
+        n_converged consecutive values. The knobs are converged one
+        after the other, each one with the optimum of the previous
+        ones, e.g ENCUT first and then KPOINTS at the converged ENCUT.
+        Blocks until the calibration is done.
+
+        Args:
+            params: knobs to converge, in that order
+            ev_per_atom: convergence criterion
+            n_converged: number of consecutive converged differences
+            wave_size: number of jobs submitted at once
+            interval: seconds between the checks of the job states
+            job_cmd, write_workers: passed on to run
 
-    def as_dict(self):
+        Returns:
+            OrderedDict of knob: optimum value, None if the knob did
+            not converge within the given values
+        """
+        is_matrix = self.is_matrix
+        self.is_matrix = False
+        natoms = sum(self.poscar.natoms)
+        optimum = OrderedDict()
+        for param in params:
+            values = self.turn_knobs.get(param)
+            if not values:
+                continue
+            values = sorted(values, key=lambda v: np.prod(v))
+            energies = []
+            opt = None
+            for i in range(0, len(values), wave_size):
+                wave = values[i:i + wave_size]
+                self.jobs = []
+                if param == 'KPOINTS':
+                    self.setup_kpoints_jobs(kpoints_list=wave)
+                else:
+                    self.setup_incar_jobs(param, wave)
+                self.run(job_cmd=job_cmd, write_workers=write_workers)
+                energies += [e if e is None else e / natoms
+                             for e in self.wait_for_energies(self.jobs,
+                                                             interval)]
+                opt = get_converged_value(values[:len(energies)],
+                                          energies, ev_per_atom=ev_per_atom,
+                                          n_converged=n_converged)
+                if opt is not None:
+                    break
+            if opt is None:
+                self.logger.warn('{0} not converged to {1} eV/atom in '
+                                 '{2}'.format(param, ev_per_atom, values))
+            else:
+                self.logger.info('{0} converged at {1}, {2} of {3} jobs '
+                                 'run'.format(param, opt, len(energies),
+                                              len(values)))
+                # the following knobs are calibrated at the optimum
+                if param == 'KPOINTS':
+                    self.set_kpoints(opt)
+                else:
+                    self.set_incar(param, opt)
+            optimum[param] = opt
+        self.is_matrix = is_matrix
+        return optimum
+
+    def wait_for_energies(self, jobs, interval=60):
+        """
+        wait for the jobs to finish
+
+        Returns:
+            list of the final energies of the jobs, None for the jobs
+            that failed
+        """
+        queue_status = get_queue_status()
+        energies = [None] * len(jobs)
+        # jobs skipped by run have no job id
+        pending = [i for i, j in enumerate(jobs) if hasattr(j, 'job_id')]
+        while pending:
+            queue_status.refresh()
+            for i in list(pending):
+                energies[i] = jobs[i].get_final_energy()
+                if energies[i] is not None:
+                    pending.remove(i)
+                    continue
+                state, ofname = get_job_state(jobs[i], queue_status,
+                                              refresh=False)
+                if state in ['00', 'XX', 'C', 'CD', 'CF', 'CA', 'F']:
+                    self.logger.error('job {0} in {1} finished without a '
+                                      'converged energy'.format(
+                                          jobs[i].job_id, jobs[i].job_dir))
+                    pending.remove(i)
+            if pending:
+                self.logger.info('{0} jobs pending, next update in {1} '
+                                 'seconds'.format(len(pending), interval))
+                time.sleep(interval)
+        return energies
+
+    def as_dict(self, compact=False, blob_store=None):
+        """
+        Args:
+            compact (bool): compact serialization, the potcar is
+                stored as symbols, functional and hash, the poscars are
+                stored in the local blob store and referenced by their
+                content hash, and the jobs are stored as deltas with
+                respect to the incar
+            blob_store (str): path to the blob store, defaults to the
+                blob_store in mpint_config.yaml
+        """
         qadapter = None
         system = None
         if self.qadapter:
@@ -857,6 +1079,18 @@ class Calibrate(MSONable):
                  turn_knobs=self.turn_knobs,
                  job_dir_list=self.job_dir_list,
                  job_ids=self.job_ids)
+        if compact:
+            store = BlobStore(blob_store)
+            d['poscar'] = poscar_to_ref(self.poscar, store)
+            d['potcar'] = get_potcar_spec(self.potcar)
+            turn_knobs = OrderedDict(self.turn_knobs)
+            if turn_knobs.get('POSCAR'):
+                turn_knobs['POSCAR'] = [poscar_to_ref(p, store)
+                                        for p in turn_knobs['POSCAR']]
+            d['turn_knobs'] = turn_knobs
+            d['jobs'] = [get_job_delta(j, d['incar'], store)
+                         for j in self.jobs]
+            d['blob_store'] = store.path
         d["@module"] = self.__class__.__module__
         d["@class"] = self.__class__.__name__
         # d['calibrate'] = self.__class__.__name__
@@ -865,18 +1099,35 @@ class Calibrate(MSONable):
     @classmethod
     def from_dict(cls, d):
         incar = Incar.from_dict(d["incar"])
-        poscar = Poscar.from_dict(d["poscar"])
-        potcar = Potcar.from_dict(d["potcar"])
         kpoints = Kpoints.from_dict(d["kpoints"])
+        turn_knobs = d["turn_knobs"]
+        store = None
+        if d.get("blob_store"):
+            store = BlobStore(d["blob_store"])
+            poscar = poscar_from_ref(d["poscar"], store)
+            potcar = potcar_from_spec(d["potcar"])
+            if turn_knobs.get('POSCAR'):
+                turn_knobs = OrderedDict(turn_knobs)
+                turn_knobs['POSCAR'] = [poscar_from_ref(p, store)
+                                        for p in turn_knobs['POSCAR']]
+        else:
+            poscar = Poscar.from_dict(d["poscar"])
+            potcar = Potcar.from_dict(d["potcar"])
         cal = Calibrate(incar, poscar, potcar, kpoints,
                         system=d["system"], is_matrix=d["is_matrix"],
                         Grid_type=d["Grid_type"],
                         parent_job_dir=d["parent_job_dir"],
                         job_dir=d["job_dir"], qadapter=d.get("qadapter"),
                         job_cmd=d["job_cmd"], wait=d["wait"],
-                        turn_knobs=d["turn_knobs"])
+                        turn_knobs=turn_knobs)
         cal.job_dir_list = d["job_dir_list"]
         cal.job_ids = d["job_ids"]
+        if store is not None:
+            cal.jobs = [job_from_delta(jd, d["incar"], store,
+                                       qadapter=d.get("qadapter"),
+                                       parent_job_dir=cal.parent_job_dir,
+                                       vjob_logger=cal.logger)
+                        for jd in d.get("jobs", [])]
         return cal
 
 
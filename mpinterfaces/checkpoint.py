@@ -0,0 +1,275 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+checkpoint stores for the job logs written by Calibrate.run and
+updated by utils.update_checkpoint. Each entry is a dict with the
+keys job, job_id, corrections and final_energy, job being the
+serialized job. Entries are keyed by their job directory.
+
+The backend is chosen from the file extension:
+    .json: the legacy calibrate.json list, rewritten on every update
+    .jsonl: append-only log of entries and row updates, the last
+        record of a job wins
+    .db, .sqlite: sqlite table indexed by job directory and job id
+"""
+
+import os
+import json
+import sqlite3
+import fcntl
+from contextlib import contextmanager
+
+from monty.json import MontyEncoder, MontyDecoder
+
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+
+def get_entry_key(entry):
+    """
+    job directory of the checkpoint entry
+    """
+    job = entry['job']
+    if isinstance(job, dict):
+        return job['job_dir']
+    return job.job_dir
+
+
+def decode_entry(entry):
+    """
+    returns a copy of the entry with the job deserialized
+    """
+    entry = dict(entry)
+    if isinstance(entry['job'], dict):
+        entry['job'] = MontyDecoder().process_decoded(entry['job'])
+    return entry
+
+
+def to_json(obj):
+    return json.dumps(obj, cls=MontyEncoder)
+
+
+@contextmanager
+def file_lock(filename):
+    """
+    exclusive lock on filename.lock, held for the duration of the
+    with block
+    """
+    with open(filename + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class JSONCheckpoint(object):
+    """
+    legacy checkpoint: a json list of all the entries, every write
+    rewrites the whole file
+
+    Args:
+        filename: checkpoint file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        """
+        returns the list of entries, the jobs are left serialized
+        """
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def dump(self, entries):
+        with open(self.filename, 'w') as f:
+            json.dump(entries, f, cls=MontyEncoder, indent=4)
+
+    def write(self, entries):
+        """
+        replace the content of the checkpoint with the entries
+        """
+        with file_lock(self.filename):
+            self.dump(entries)
+
+    def update(self, updates):
+        """
+        row level update of the entries
+
+        Args:
+            updates: dict of job directory: dict of the entry fields to
+                set. Jobs not in the checkpoint are ignored
+        """
+        with file_lock(self.filename):
+            entries = self.load()
+            for entry in entries:
+                fields = updates.get(get_entry_key(entry))
+                if fields:
+                    entry.update(fields)
+            self.dump(entries)
+
+    def get(self, job_id=None, job_dir=None):
+        """
+        returns the entry of the job with the given job id or job
+        directory, None if not found
+        """
+        for entry in self.load():
+            if job_dir is not None and get_entry_key(entry) == job_dir:
+                return entry
+            if job_id is not None and str(entry['job_id']) == str(job_id):
+                return entry
+        return None
+
+
+class JSONLinesCheckpoint(JSONCheckpoint):
+    """
+    append-only checkpoint: one json record per line, either a full
+    entry or a partial update of the entry with the same key. Writers
+    append under a file lock, readers fold the records.
+    """
+
+    def records(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename) as f:
+            for line in f:
+                line = line.strip()
+                # skip a partially written last line
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logger.warn('skipping corrupt record in {}'
+                                    .format(self.filename))
+
+    def load_index(self):
+        """
+        returns the folded entries as an ordered list and the
+        key: entry index
+        """
+        entries = []
+        index = {}
+        for record in self.records():
+            key = record.pop('key')
+            if key in index:
+                index[key].update(record)
+            elif 'job' in record:
+                index[key] = record
+                entries.append(record)
+        return entries, index
+
+    def load(self):
+        return self.load_index()[0]
+
+    def append(self, records, truncate=False):
+        with file_lock(self.filename):
+            with open(self.filename, 'w' if truncate else 'a') as f:
+                f.write(''.join(to_json(r) + '\n' for r in records))
+
+    def write(self, entries):
+        self.append([dict(entry, key=get_entry_key(entry))
+                     for entry in entries], truncate=True)
+
+    def update(self, updates):
+        self.append([dict(fields, key=key)
+                     for key, fields in updates.items()])
+
+    def get(self, job_id=None, job_dir=None):
+        entries, index = self.load_index()
+        if job_dir is not None:
+            return index.get(job_dir)
+        for entry in entries:
+            if str(entry['job_id']) == str(job_id):
+                return entry
+        return None
+
+    def compact(self):
+        """
+        rewrite the log with one record per job
+        """
+        self.write(self.load())
+
+
+class SQLiteCheckpoint(object):
+    """
+    sqlite checkpoint, one row per job indexed by job directory and
+    job id
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                     'position INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'job_dir TEXT UNIQUE, job_id TEXT, entry TEXT)')
+        self.execute('CREATE INDEX IF NOT EXISTS job_id_index '
+                     'ON jobs (job_id)')
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.filename, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def execute(self, sql, params=()):
+        with self.connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def load(self):
+        return [json.loads(row[0]) for row in
+                self.execute('SELECT entry FROM jobs ORDER BY position')]
+
+    def write(self, entries):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM jobs')
+            conn.executemany(
+                'INSERT INTO jobs (job_dir, job_id, entry) '
+                'VALUES (?, ?, ?)',
+                [(get_entry_key(e), str(e['job_id']), to_json(e))
+                 for e in entries])
+
+    def update(self, updates):
+        with self.connect() as conn:
+            for key, fields in updates.items():
+                row = conn.execute('SELECT entry FROM jobs WHERE '
+                                   'job_dir = ?', (key,)).fetchone()
+                if row is None:
+                    continue
+                entry = json.loads(row[0])
+                entry.update(json.loads(to_json(fields)))
+                conn.execute('UPDATE jobs SET job_id = ?, entry = ? '
+                             'WHERE job_dir = ?',
+                             (str(entry['job_id']), to_json(entry), key))
+
+    def get(self, job_id=None, job_dir=None):
+        if job_dir is not None:
+            rows = self.execute('SELECT entry FROM jobs WHERE job_dir = ?',
+                                (job_dir,))
+        else:
+            rows = self.execute('SELECT entry FROM jobs WHERE job_id = ?',
+                                (str(job_id),))
+        return json.loads(rows[0][0]) if rows else None
+
+
+def get_checkpoint(filename):
+    """
+    returns the checkpoint store for the file, chosen from the
+    file extension. Defaults to the legacy json checkpoint.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.jsonl':
+        return JSONLinesCheckpoint(filename)
+    elif ext in ['.db', '.sqlite']:
+        return SQLiteCheckpoint(filename)
+    return JSONCheckpoint(filename)
@@ -0,0 +1,190 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+compact serialization of the calibration objects and their jobs,
+used to keep the fireworks specs small:
+    POTCARs are stored as their symbols, functional and the hash of
+    the POTCAR data and are rebuilt from the local potentials on load
+    poscars are stored once in a local content addressed blob store
+    and referenced by their hash
+    jobs are stored as deltas with respect to the calibration inputs
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+from pymatgen.io.vasp.inputs import Poscar, Kpoints
+
+from monty.json import MontyEncoder
+
+from fireworks.user_objects.queue_adapters.common_adapter import CommonAdapter
+
+from mpinterfaces import BLOB_STORE
+from mpinterfaces.instrument import MPINTLazyVaspInputSet, MPINTVaspJob, \
+    get_incar_diff, get_potcar
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+
+def get_hash(s):
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+
+class BlobStore(object):
+    """
+    content addressed store of json documents in a local directory,
+    each document is written once to <path>/<hash[:2]>/<hash>.json
+
+    Args:
+        path: store directory, defaults to the blob_store in
+            mpint_config.yaml
+    """
+
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path or BLOB_STORE)
+
+    def get_file(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def put(self, d):
+        """
+        store the document and return its key
+        """
+        data = json.dumps(d, sort_keys=True, cls=MontyEncoder)
+        key = get_hash(data)
+        fname = self.get_file(key)
+        if not os.path.exists(fname):
+            dirname = os.path.dirname(fname)
+            if not os.path.exists(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    if not os.path.isdir(dirname):
+                        raise
+            # write and rename so that readers never see partial files
+            fd, tmp = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.rename(tmp, fname)
+        return key
+
+    def get(self, key):
+        with open(self.get_file(key)) as f:
+            return json.load(f)
+
+
+def get_potcar_spec(potcar):
+    """
+    symbols, functional and data hash of the potcar
+    """
+    if potcar is None:
+        return None
+    return {'symbols': list(potcar.symbols),
+            'functional': potcar.functional,
+            'hash': get_hash(str(potcar))}
+
+
+def potcar_from_spec(spec):
+    """
+    rebuild the potcar from the local potentials, warns if the
+    potentials differ from the serialized ones
+    """
+    if spec is None:
+        return None
+    potcar = get_potcar(spec['symbols'], functional=spec['functional'])
+    if spec.get('hash') and get_hash(str(potcar)) != spec['hash']:
+        logger.warn('POTCAR {0} {1} differs from the serialized one'
+                    .format(spec['functional'], spec['symbols']))
+    return potcar
+
+
+def poscar_to_ref(poscar, store):
+    """
+    blob reference of the poscar. Anything else, e.g. the directory
+    paths of the POSCAR knob in reuse mode, is returned as is.
+    """
+    if not isinstance(poscar, Poscar):
+        return poscar
+    return {'blob': store.put(poscar.as_dict())}
+
+
+def poscar_from_ref(ref, store):
+    """
+    the poscar of a blob reference, anything else is returned as is
+    """
+    if not (isinstance(ref, dict) and 'blob' in ref):
+        return ref
+    return Poscar.from_dict(store.get(ref['blob']))
+
+
+def get_job_delta(job, incar_base, store):
+    """
+    compact dict of the job: the incar difference with respect to
+    incar_base, a blob reference for the poscar and the potcar spec
+
+    Args:
+        job: MPINTVaspJob with a full or lazy inputset
+        incar_base (dict): INCAR the difference is computed against
+        store: BlobStore
+    """
+    vis = job.vis
+    if isinstance(vis, MPINTLazyVaspInputSet):
+        incar, poscar, kpoints = vis.get_incar(), vis.poscar, vis.kpoints
+        potcar = None if vis.test else vis.potcar
+    else:
+        incar, poscar, kpoints = vis.incar_init, vis.poscar_init, \
+            vis.kpoints_init
+        potcar = None if vis.test else vis.potcar_init
+    incar_diff, incar_removed = get_incar_diff(incar_base, incar)
+    return dict(name=job.name, job_cmd=job.job_cmd, job_dir=job.job_dir,
+                final=job.final, backup=job.backup, wait=job.wait,
+                job_id=getattr(job, 'job_id', None),
+                incar=incar_diff, incar_removed=incar_removed,
+                poscar=poscar_to_ref(poscar, store),
+                kpoints=kpoints if isinstance(kpoints, str)
+                else kpoints.as_dict(),
+                potcar=get_potcar_spec(potcar),
+                script_name=vis.script_name)
+
+
+def job_from_delta(d, incar_base, store, qadapter=None, parent_job_dir='.',
+                   vjob_logger=None):
+    """
+    rebuild the job from its compact dict, the job gets a lazy
+    inputset
+
+    Args:
+        d: compact dict of the job
+        incar_base (dict): INCAR the difference was computed against
+        store: BlobStore
+        qadapter: queue adapter or its dict, shared by the jobs
+    """
+    if isinstance(qadapter, dict):
+        qadapter = CommonAdapter.from_dict(qadapter)
+    kpoints = d['kpoints']
+    if not isinstance(kpoints, str):
+        kpoints = Kpoints.from_dict(kpoints)
+    vis = MPINTLazyVaspInputSet(d['name'], incar_base, d['incar'],
+                                poscar_from_ref(d['poscar'], store),
+                                kpoints,
+                                potcar=potcar_from_spec(d['potcar']),
+                                qadapter=qadapter,
+                                script_name=d['script_name'],
+                                vis_logger=vjob_logger,
+                                test=d['potcar'] is None,
+                                incar_removed=d['incar_removed'])
+    job = MPINTVaspJob(d['job_cmd'], name=d['name'], final=d['final'],
+                       parent_job_dir=parent_job_dir, job_dir=d['job_dir'],
+                       vis=vis, wait=d['wait'], backup=d['backup'],
+                       vjob_logger=vjob_logger)
+    if d.get('job_id') is not None:
+        job.job_id = d['job_id']
+    return job
@@ -13,6 +13,13 @@ in the parent directory
 import os
 import glob
 import re
+import mmap
+from collections import OrderedDict
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 from monty.json import MontyDecoder
 
@@ -210,3 +217,316 @@ class MPINTVaspDrone(VaspToComputedEntryDrone):
     @classmethod
     def from_dict(cls, d):
         return cls(**d["init_args"])
+
+
+_PROBE_CACHE = OrderedDict()
+_PROBE_CACHE_SIZE = 4096
+
+_VASPRUN_PARAM = r'<i[^>]*name="{}"[^>]*>\s*([^<\s]+)'
+_VASPRUN_E_WO_ENTRP = re.compile(br'<i\s+name="e_wo_entrp"\s*>\s*([^<\s]+)')
+_VASPRUN_NAME = re.compile(br'<i\s+name="([^"]+)"')
+_OUTCAR_PARAM = r'\b{}\s*=\s*(-?\d+)'
+_OUTCAR_ITERATION = re.compile(br'Iteration\s+(\d+)\s*\(\s*(\d+)\s*\)')
+_OUTCAR_E_WO_ENTRP = re.compile(br'without entropy\s*=\s*(-?[\d.]+)')
+
+
+def _get_param(pattern, name, mm, start=0, end=None, default=None):
+    regex = re.compile(pattern.format(name).encode())
+    match = regex.search(mm, start, len(mm) if end is None else end)
+    if match is None:
+        return default
+    return int(float(match.group(1)))
+
+
+def _probe_result(complete, nelm, nsw, n_ionic, n_electronic, energy,
+                  source):
+    converged_electronic = bool(complete and nelm is not None and
+                                n_electronic < nelm)
+    converged_ionic = bool(complete and (nsw <= 1 or n_ionic < nsw))
+    return {"converged_electronic": converged_electronic,
+            "converged_ionic": converged_ionic,
+            "converged": converged_electronic and converged_ionic,
+            "final_energy": energy,
+            "source": source}
+
+
+def _probe_vasprun(filename):
+    """
+    reads the head and the tail of the memory mapped vasprun.xml for
+    the markers needed to decide convergence the way Vasprun does:
+    LEPSILON from the incar and NELM and NSW from the parameters, which
+    precede the first ionic step, and the energies of the electronic
+    steps and the energy of the last ionic step, which are found by
+    searching backwards from the end of the file. The xml is not parsed
+    and the ionic steps in between are not read.
+
+    The number of ionic steps only matters for relaxations(NSW > 1),
+    it is then read from the last iteration in the tail of the OUTCAR
+    next to the vasprun.xml. Without an OUTCAR the ionic steps are
+    counted backwards from the last one, up to NSW.
+    """
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return _probe_result(False, None, 0, 0, 0, None, filename)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            complete = mm.rfind(b'</modeling>', max(0, size - 4096)) != -1
+            first_calc = mm.find(b'<calculation>')
+            if first_calc == -1:
+                return _probe_result(False, None, 0, 0, 0, None, filename)
+            incar = {}
+            start = mm.find(b'<incar>', 0, first_calc)
+            if start != -1:
+                end = mm.find(b'</incar>', start, first_calc)
+                match = re.compile(_VASPRUN_PARAM.format('LEPSILON').encode()
+                                   ).search(mm, start, end)
+                if match is not None:
+                    incar['LEPSILON'] = match.group(1).upper() in \
+                        (b'T', b'TRUE', b'.TRUE.')
+            params = max(mm.find(b'<parameters>', 0, first_calc), 0)
+            # the first match is the root value, the duplicate in the
+            # response functions separator is ignored as in Vasprun
+            params = {'NELM': _get_param(_VASPRUN_PARAM, 'NELM', mm, params,
+                                         first_calc),
+                      'NSW': _get_param(_VASPRUN_PARAM, 'NSW', mm, params,
+                                        first_calc, default=0)}
+            if params['NELM'] is None:
+                params.pop('NELM')
+            last_calc = mm.rfind(b'<calculation>', first_calc)
+            # the electronic steps precede the structure of the step
+            scf_end = mm.find(b'<structure', last_calc)
+            if scf_end == -1:
+                scf_end = size
+            esteps = []
+            pos = mm.find(b'<scstep>', last_calc, scf_end)
+            while pos != -1:
+                end = mm.find(b'<scstep>', pos + 1, scf_end)
+                # only the names of the energies are needed
+                stop = mm.find(b'</energy>', pos,
+                               scf_end if end == -1 else end)
+                names = _VASPRUN_NAME.findall(mm, pos, max(stop, pos))
+                esteps.append(dict.fromkeys(n.decode() for n in names))
+                pos = end
+            ionic_energy = {}
+            match = _VASPRUN_E_WO_ENTRP.search(mm, scf_end)
+            if match is not None:
+                ionic_energy['e_wo_entrp'] = float(match.group(1))
+            n_ionic = _count_ionic_steps(mm, filename, first_calc, last_calc,
+                                         params['NSW'])
+        finally:
+            mm.close()
+    result = _extract_result(incar, params, n_ionic, esteps, ionic_energy,
+                             filename)
+    if not complete:
+        # unlike extract_final_energy, truncated files are not an error
+        for key in ('converged_electronic', 'converged_ionic', 'converged'):
+            result[key] = False
+    return result
+
+
+def _count_ionic_steps(mm, filename, first_calc, last_calc, nsw):
+    if nsw <= 1:
+        return 1
+    outcar = os.path.join(os.path.dirname(filename), 'OUTCAR')
+    if os.path.isfile(outcar):
+        with open(outcar, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                outcar_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    pos = outcar_mm.rfind(b'Iteration')
+                    match = None if pos == -1 else \
+                        _OUTCAR_ITERATION.match(outcar_mm, pos)
+                    if match is not None:
+                        return int(match.group(1))
+                finally:
+                    outcar_mm.close()
+    # only whether there are fewer than nsw steps matters
+    n_ionic = 1
+    pos = last_calc
+    while pos != first_calc and n_ionic < nsw:
+        pos = mm.rfind(b'<calculation>', first_calc, pos)
+        n_ionic += 1
+    return n_ionic
+
+
+def _probe_outcar(filename):
+    """
+    OUTCAR counterpart of _probe_vasprun
+    """
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return _probe_result(False, None, 0, 0, 0, None, filename)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            complete = mm.rfind(b'General timing and accounting',
+                                max(0, size - 65536)) != -1
+            nelm = _get_param(_OUTCAR_PARAM, 'NELM', mm)
+            nsw = _get_param(_OUTCAR_PARAM, 'NSW', mm, default=0)
+            n_ionic, n_electronic = 0, 0
+            pos = mm.rfind(b'Iteration')
+            if pos != -1:
+                match = _OUTCAR_ITERATION.match(mm, pos)
+                if match is not None:
+                    n_ionic = int(match.group(1))
+                    n_electronic = int(match.group(2))
+            energy = None
+            pos = mm.rfind(b'without entropy')
+            if pos != -1:
+                match = _OUTCAR_E_WO_ENTRP.match(mm, pos)
+                if match is not None:
+                    energy = float(match.group(1))
+        finally:
+            mm.close()
+    return _probe_result(complete, nelm, nsw, n_ionic, n_electronic,
+                         energy, filename)
+
+
+def _cached_probe(filename, probe):
+    st = os.stat(filename)
+    signature = (st.st_mtime, st.st_size)
+    cached = _PROBE_CACHE.get(filename)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    result = probe(filename)
+    _PROBE_CACHE[filename] = (signature, result)
+    if len(_PROBE_CACHE) > _PROBE_CACHE_SIZE:
+        _PROBE_CACHE.popitem(last=False)
+    return result
+
+
+def probe_vasp_run(directory):
+    """
+    lightweight alternative to Vasprun(...).converged: determines the
+    electronic and ionic convergence and the final energy(e_wo_entrp
+    of the last ionic step) of the vasp run in the directory by
+    scanning vasprun.xml, or OUTCAR if there is no vasprun.xml,
+    without parsing the whole file. The results are cached per file
+    and reused as long as the file's (mtime, size) doesnt change.
+
+    Args:
+        directory: vasp run directory
+
+    Returns:
+        dict with the keys converged_electronic, converged_ionic,
+        converged, final_energy and source(the file probed), None if
+        the directory has neither a vasprun.xml nor an OUTCAR
+    """
+    for fname, probe in (('vasprun.xml', _probe_vasprun),
+                         ('OUTCAR', _probe_outcar)):
+        filename = os.path.abspath(os.path.join(directory, fname))
+        if os.path.isfile(filename):
+            return _cached_probe(filename, probe)
+    return None
+
+
+def _vasprun_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        # overflowed fortran fields
+        if '*' in text:
+            return float('nan')
+        raise
+
+
+def _vasprun_value(elem):
+    text = (elem.text or '').strip()
+    vtype = elem.attrib.get('type')
+    if vtype == 'logical':
+        return text.upper() in ('T', 'TRUE', '.TRUE.')
+    if vtype == 'int':
+        return int(float(text))
+    if vtype == 'string':
+        return text
+    return _vasprun_float(text)
+
+
+_LEPSILON_KEYS = set(['e_wo_entrp', 'e_fr_energy', 'e_0_energy'])
+
+
+def extract_final_energy(filename):
+    """
+    streaming counterpart of Vasprun(...).final_energy and
+    Vasprun(...).converged: the vasprun.xml is parsed incrementally
+    and every element is discarded once read, so that the memory used
+    doesnt grow with the size of the eigenvalues, dos and projected
+    blocks. Only the LEPSILON flag from the incar, NELM and NSW from
+    the parameters and the energies of the electronic steps in the
+    last ionic step are kept.
+
+    Args:
+        filename: vasprun.xml
+
+    Returns:
+        dict with the keys converged_electronic, converged_ionic,
+        converged, final_energy and source(the file), as
+        probe_vasp_run. Raises ET.ParseError if the xml is incomplete,
+        like Vasprun.
+    """
+    incar, params = {}, {}
+    n_ionic = 0
+    esteps = []
+    ionic_energy = {}
+    path = []
+    root = None
+    for event, elem in ET.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            path.append(elem.tag)
+            if elem.tag == 'calculation' and len(path) == 2:
+                n_ionic += 1
+                esteps = []
+                ionic_energy = {}
+            elif elem.tag == 'scstep' and path[-2] == 'calculation':
+                esteps.append({})
+            continue
+        path.pop()
+        if elem.tag == 'i' and len(path) >= 2:
+            name = elem.attrib.get('name')
+            if path[1] == 'incar' and len(path) == 2:
+                incar[name] = _vasprun_value(elem)
+            elif path[1] == 'parameters':
+                # the first value is the root one, the duplicate in the
+                # response functions separator is ignored as in Vasprun
+                if name not in params:
+                    params[name] = _vasprun_value(elem)
+            elif path[1] == 'calculation' and path[-1] == 'energy':
+                if len(path) == 3:
+                    ionic_energy[name] = _vasprun_float(elem.text)
+                elif len(path) == 4 and path[2] == 'scstep':
+                    esteps[-1][name] = _vasprun_float(elem.text)
+        # the element has been read, free it along with its children
+        elem.clear()
+        if len(path) == 1:
+            root.clear()
+    return _extract_result(incar, params, n_ionic, esteps, ionic_energy,
+                           filename)
+
+
+def _extract_result(incar, params, n_ionic, esteps, ionic_energy,
+                    source):
+    nelm = params.get('NELM')
+    nsw = params.get('NSW', 0)
+    converged_electronic = False
+    if n_ionic and esteps and nelm is not None:
+        if incar.get('LEPSILON'):
+            # the linear response steps only have the three energies
+            i = 1
+            while i < len(esteps) and set(esteps[i].keys()) == \
+                    _LEPSILON_KEYS:
+                i += 1
+            converged_electronic = i + 1 != nelm
+        else:
+            converged_electronic = len(esteps) < nelm
+    converged_ionic = bool(n_ionic) and (nsw <= 1 or n_ionic < nsw)
+    final_energy = None
+    if n_ionic:
+        final_energy = ionic_energy.get('e_wo_entrp', float('inf'))
+    return {"converged_electronic": converged_electronic,
+            "converged_ionic": converged_ionic,
+            "converged": converged_electronic and converged_ionic,
+            "final_energy": final_energy,
+            "source": source}
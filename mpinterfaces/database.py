@@ -14,20 +14,30 @@ from six.moves import range
 import sys
 import os
 import json
+import zlib
+import time
 import logging
 import socket
 import string
 import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
+import gridfs
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+
+from monty.json import MontyEncoder
+
 from pymatgen.core.structure import Structure
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 from pymatgen.analysis.bond_valence import BVAnalyzer
 
 from matgendb.creator import VaspToDbTaskDrone
 from matgendb.creator import logger as mgdb_logger
 
+from mpinterfaces.symmetry_cache import SymmetryCache, get_spacegroup_info
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 formatter = logging.Formatter('%(levelname)s:%(name)s:%(message)s')
@@ -37,9 +47,160 @@ logger.addHandler(sh)
 mgdb_logger.addHandler(sh)
 
 
+class BulkTaskWriter(object):
+    """
+    buffered writer of task documents: the documents are written in
+    batches, new ones with one insert_many and duplicates with one
+    bulk_write of upserts, and their dos are uploaded to GridFS
+    concurrently while the batch fills up. Duplicates are found by
+    dir_name and the task ids of the new documents are reserved with
+    a single counter update per batch, as VaspToDbTaskDrone does per
+    document.
+
+    Args:
+        db: database
+        collection: name of the tasks collection
+        batch_size: number of documents per batch
+        flush_interval: the buffer is flushed when the oldest document
+            in it is older than this many seconds
+        parse_dos: whether the dos of the calculations are stored
+        compress_dos: zlib compression level of the dos, False for none
+        update_duplicates: whether duplicates are updated or skipped
+        dos_workers: number of concurrent GridFS uploads
+    """
+
+    def __init__(self, db, collection="nanoparticles", batch_size=100,
+                 flush_interval=10, parse_dos=False, compress_dos=False,
+                 update_duplicates=True, dos_workers=4):
+        self.db = db
+        self.collection = db[collection]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.parse_dos = parse_dos
+        self.compress_dos = compress_dos
+        self.update_duplicates = update_duplicates
+        self.executor = ThreadPoolExecutor(max_workers=dos_workers)
+        self.fs = gridfs.GridFS(db, "dos_fs")
+        self.buffer = []
+        self.first_added = None
+
+    def put_dos(self, dos):
+        dos = json.dumps(dos, cls=MontyEncoder).encode()
+        if self.compress_dos:
+            dos = zlib.compress(dos, self.compress_dos)
+        return self.fs.put(dos)
+
+    def add(self, d):
+        """
+        buffer the document, its dos upload is started right away.
+        Duplicates that are skipped are not buffered, so that their dos
+        is not uploaded.
+        """
+        uploads = []
+        if not self.update_duplicates and self.collection.find_one(
+                {"dir_name": d["dir_name"]}, ["_id"]):
+            logger.info("Skipping duplicate {}".format(d["dir_name"]))
+            return
+        if self.parse_dos and "calculations" in d:
+            for calc in d["calculations"]:
+                if "dos" in calc:
+                    uploads.append(
+                        (calc, self.executor.submit(self.put_dos,
+                                                    calc.pop("dos"))))
+                    if self.compress_dos:
+                        calc["dos_compression"] = "zlib"
+        self.buffer.append((d, uploads))
+        if self.first_added is None:
+            self.first_added = time.time()
+        if len(self.buffer) >= self.batch_size or \
+                time.time() - self.first_added >= self.flush_interval:
+            self.flush()
+
+    def delete_dos(self, d):
+        for calc in d.get("calculations", []):
+            if "dos_fs_id" in calc:
+                self.fs.delete(calc["dos_fs_id"])
+
+    def flush(self):
+        """
+        write the buffered documents. The buffer is only cleared once
+        they are written, so a failed flush can be retried.
+
+        Returns:
+            list of the task ids of the documents written
+        """
+        if not self.buffer:
+            return []
+        # the last document of a directory wins, as with one by one
+        # upserts, the dos of the ones it replaces is dropped
+        docs = OrderedDict()
+        orphans = []
+        for d, uploads in self.buffer:
+            for calc, future in uploads:
+                calc["dos_fs_id"] = future.result()
+            if d["dir_name"] in docs:
+                orphans.append(docs.pop(d["dir_name"]))
+            docs[d["dir_name"]] = d
+        docs = list(docs.values())
+        existing = dict(
+            (r["dir_name"], r["task_id"]) for r in self.collection.find(
+                {"dir_name": {"$in": [d["dir_name"] for d in docs]}},
+                ["dir_name", "task_id"]))
+        new, updates, written = [], [], []
+        for d in docs:
+            if d["dir_name"] in existing:
+                if not self.update_duplicates:
+                    if existing[d["dir_name"]] == d.get("task_id"):
+                        # inserted by a flush that failed afterwards
+                        written.append(d)
+                        continue
+                    logger.info("Skipping duplicate {}".format(d["dir_name"]))
+                    orphans.append(d)
+                    continue
+                d["task_id"] = existing[d["dir_name"]]
+                updates.append(d)
+            else:
+                new.append(d)
+        need_ids = [d for d in new if not d.get("task_id")]
+        if need_ids:
+            last = self.db.counter.find_one_and_update(
+                {"_id": "taskid"}, {"$inc": {"c": len(need_ids)}},
+                upsert=True, return_document=ReturnDocument.AFTER)["c"]
+            for i, d in enumerate(need_ids):
+                d["task_id"] = last - len(need_ids) + 1 + i
+        now = datetime.datetime.today()
+        for d in new + updates:
+            d["last_updated"] = now
+        if new:
+            self.collection.insert_many(new, ordered=False)
+        if updates:
+            self.collection.bulk_write(
+                [UpdateOne({"dir_name": d["dir_name"]}, {"$set": d},
+                           upsert=True) for d in updates], ordered=False)
+        for d in orphans:
+            self.delete_dos(d)
+        self.buffer, self.first_added = [], None
+        logger.info("Inserted {0} and updated {1} tasks".format(len(new),
+                                                              len(updates)))
+        return [d["task_id"] for d in written + new + updates]
+
+    def close(self):
+        task_ids = self.flush()
+        self.executor.shutdown()
+        return task_ids
+
+
 class MPINTVaspToDbTaskDrone(VaspToDbTaskDrone):
     """
     subclassing VaspToDbTaskDrone
+
+    with batch_size set, the documents are written through a
+    BulkTaskWriter and flush must be called once all the documents are
+    assimilated
+
+    the spacegroup analysis of the final structures is cached in the
+    symmetry_cache file, see symmetry_cache.SymmetryCache. False
+    disables the cache.
     """
 
     def __init__(self, host="127.0.0.1", port=27017, database="vasp",
@@ -47,7 +208,9 @@ class MPINTVaspToDbTaskDrone(VaspToDbTaskDrone):
                  parse_dos=False, compress_dos=False,
                  simulate_mode=False,
                  additional_fields=None, update_duplicates=True,
-                 mapi_key=None, use_full_uri=True, runs=None):
+                 mapi_key=None, use_full_uri=True, runs=None,
+                 batch_size=None, flush_interval=10, dos_workers=4,
+                 symmetry_cache=None):
         VaspToDbTaskDrone.__init__(self, host=host, port=port,
                                    database=database, user=user,
                                    password=password,
@@ -60,6 +223,50 @@ class MPINTVaspToDbTaskDrone(VaspToDbTaskDrone):
                                    mapi_key=mapi_key,
                                    use_full_uri=use_full_uri,
                                    runs=runs)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dos_workers = dos_workers
+        self._writer = None
+        self.symmetry_cache = None
+        if symmetry_cache is not False:
+            self.symmetry_cache = SymmetryCache(symmetry_cache)
+
+    def __getstate__(self):
+        # the writer and its connection stay in the inserting process
+        d = dict(self.__dict__)
+        d["_writer"] = None
+        return d
+
+    def get_writer(self):
+        if self._writer is None:
+            conn = MongoClient(self.host, self.port)
+            db = conn[self.database]
+            if self.user:
+                db.authenticate(self.user, self.password)
+            self._writer = BulkTaskWriter(
+                db, self.collection, batch_size=self.batch_size,
+                flush_interval=self.flush_interval,
+                parse_dos=self.parse_dos, compress_dos=self.compress_dos,
+                update_duplicates=self.update_duplicates,
+                dos_workers=self.dos_workers)
+        return self._writer
+
+    def _insert_doc(self, d):
+        """
+        Overridden: buffered when batch_size is set. The task id is
+        only known after the flush, None is returned.
+        """
+        if not self.batch_size or self.simulate:
+            return VaspToDbTaskDrone._insert_doc(self, d)
+        self.get_writer().add(d)
+
+    def flush(self):
+        """
+        write the buffered documents, returns their task ids
+        """
+        if self._writer is None:
+            return []
+        return self._writer.flush()
 
     def generate_doc(self, dir_name, vasprun_files):
         """
@@ -114,14 +321,12 @@ class MPINTVaspToDbTaskDrone(VaspToDbTaskDrone):
             else:
                 d["state"] = "stopped"
             d["analysis"] = analysis_and_error_checks(d)
-            sg = SpacegroupAnalyzer(
-                Structure.from_dict(d["output"]["crystal"]), 0.1)
-            d["spacegroup"] = {"symbol": sg.get_space_group_symbol(),
-                               "number": sg.get_space_group_number(),
-                               "point_group": sg.get_point_group(),
-                               "source": "spglib",
-                               "crystal_system": sg.get_crystal_system(),
-                               "hall": sg.get_hall()}
+            structure = Structure.from_dict(d["output"]["crystal"])
+            if self.symmetry_cache:
+                d["spacegroup"] = self.symmetry_cache.get_spacegroup_info(
+                    structure, 0.1)
+            else:
+                d["spacegroup"] = get_spacegroup_info(structure, 0.1)
             d["last_updated"] = datetime.datetime.today()
             return d
         except Exception as ex:
@@ -0,0 +1,201 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+incremental scanning of the OUTCAR and stdout files of running and
+finished jobs for known VASP error messages.
+
+The scanner remembers, for each file, how far it has been read and
+the errors already reported, so that each scan only reads what was
+appended since the previous one. All the error messages are matched in
+a single pass by one compiled alternation. A file that is truncated or
+replaced(e.g. by a rerun) is read again from the start.
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+# error messages of the custodian VaspErrorHandler, plus the walltime
+# kill messages of the batch systems written to the stdout file
+VASP_ERROR_SIGNATURES = OrderedDict([
+    ("tet", ["Tetrahedron method fails for NKPT<4.",
+             "Fatal error detecting k-mesh",
+             "Fatal error: unable to match k-point",
+             "Routine TETIRR needs special values",
+             "Tetrahedron method fails (number of k-points < 4)"]),
+    ("inv_rot_mat", ["inverse of rotation matrix was not found "
+                     "(increase SYMPREC)"]),
+    ("brmix", ["BRMIX: very serious problems"]),
+    ("subspacematrix", ["WARNING: Sub-Space-Matrix is not hermitian in "
+                        "DAV"]),
+    ("tetirr", ["Routine TETIRR needs special values"]),
+    ("incorrect_shift", ["Could not get correct shifts"]),
+    ("real_optlay", ["REAL_OPTLAY: internal error",
+                     "REAL_OPT: internal ERROR"]),
+    ("rspher", ["ERROR RSPHER"]),
+    ("dentet", ["DENTET"]),
+    ("too_few_bands", ["TOO FEW BANDS"]),
+    ("triple_product", ["ERROR: the triple product of the basis vectors"]),
+    ("rot_matrix", ["Found some non-integer element in rotation matrix"]),
+    ("brions", ["BRIONS problems: POTIM should be increased"]),
+    ("pricel", ["internal error in subroutine PRICEL"]),
+    ("zpotrf", ["LAPACK: Routine ZPOTRF failed"]),
+    ("amin", ["One of the lattice vectors is very long (>50 A), but AMIN"]),
+    ("zbrent", ["ZBRENT: fatal internal in",
+                "ZBRENT: fatal error in bracketing"]),
+    ("pssyevx", ["ERROR in subspace rotation PSSYEVX"]),
+    ("eddrmm", ["WARNING in EDDRMM: call to ZHEGV failed"]),
+    ("edddav", ["Error EDDDAV: Call to ZHEGV failed"]),
+    ("grad_not_orth", ["EDWAV: internal error, the gradient is not "
+                       "orthogonal"]),
+    ("nicht_konv", ["ERROR: SBESSELITER : nicht konvergent"]),
+    ("zheev", ["ERROR EDDIAG: Call to routine ZHEEV failed!"]),
+    ("elf_kpar", ["ELF: KPAR>1 not implemented"]),
+    ("elf_ncl", ["WARNING: ELF not implemented for non collinear case"]),
+    ("rhosyg", ["RHOSYG internal error"]),
+    ("posmap", ["POSMAP internal error: symmetry equivalent atom not "
+                "found"]),
+    ("point_group", ["Error: point group operation missing"]),
+    ("walltime", ["DUE TO TIME LIMIT",
+                  "job killed: walltime"])
+])
+
+# errors after which the job can be restarted from its CONTCAR as is
+RESTARTABLE_ERRORS = ('walltime',)
+
+
+class ErrorScanner(object):
+    """
+    follows log files from the offsets saved by the previous scans
+    and reports each error found in a file once.
+
+    Args:
+        signatures: dict of error name: list of error messages,
+            defaults to VASP_ERROR_SIGNATURES
+        chunk_size: number of bytes read at a time
+    """
+
+    def __init__(self, signatures=None, chunk_size=1 << 20):
+        self.signatures = signatures or VASP_ERROR_SIGNATURES
+        self.chunk_size = chunk_size
+        self.names = {}
+        for name, messages in self.signatures.items():
+            for msg in messages:
+                self.names.setdefault(msg.encode(), []).append(name)
+        # longest first, so that a message is never cut short by one
+        # of its prefixes
+        self.regex = re.compile(b'|'.join(
+            re.escape(m) for m in sorted(self.names, key=len,
+                                         reverse=True)))
+        # file name: {'id': [inode, device], 'offset': .., 'errors': [..]}
+        self.state = {}
+
+    def scan_file(self, filename, job_dir=None):
+        """
+        read the part of the file appended since the last scan
+
+        Returns:
+            list of error events, dicts with the keys job_dir, file,
+            error, message and offset(of the line with the message), for
+            the errors not reported before. Empty if the file doesnt
+            exist.
+        """
+        filename = os.path.abspath(filename)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return []
+        file_id = [st.st_ino, st.st_dev]
+        state = self.state.get(filename)
+        if state is None or state['id'] != file_id or \
+                st.st_size < state['offset']:
+            state = {'id': file_id, 'offset': 0, 'errors': []}
+            self.state[filename] = state
+        if st.st_size == state['offset']:
+            return []
+        events = []
+        with open(filename, 'rb') as f:
+            f.seek(state['offset'])
+            start = state['offset']
+            carry = b''
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                data = carry + chunk
+                # only whole lines are scanned, the last partial line
+                # is kept for the next chunk or the next scan
+                end = data.rfind(b'\n') + 1
+                carry = data[end:]
+                for match in self.regex.finditer(data, 0, end):
+                    for name in self.names[match.group(0)]:
+                        if name in state['errors']:
+                            continue
+                        state['errors'].append(name)
+                        line = data.rfind(b'\n', 0, match.start()) + 1
+                        events.append(
+                            {'job_dir': job_dir or os.path.dirname(filename),
+                             'file': filename, 'error': name,
+                             'message': match.group(0).decode(),
+                             'offset': start + line})
+                start += end
+            state['offset'] = start
+        return events
+
+    def scan(self, job_dir, filenames=('OUTCAR',)):
+        """
+        scan the files in job_dir, see scan_file
+        """
+        events = []
+        for fname in filenames:
+            events.extend(self.scan_file(os.path.join(job_dir, fname),
+                                         job_dir=job_dir))
+        for e in events:
+            logger.info('{0} error in {1}: {2}'.format(e['error'], e['file'],
+                                                      e['message']))
+        return events
+
+    def get_errors(self, job_dir, filenames=('OUTCAR',)):
+        """
+        all the errors found so far in the files in job_dir, including
+        the ones reported by earlier scans
+        """
+        errors = set()
+        for fname in filenames:
+            state = self.state.get(os.path.abspath(
+                os.path.join(job_dir, fname)))
+            if state is not None:
+                errors.update(state['errors'])
+        return errors
+
+    def reset(self, job_dir=None):
+        """
+        forget the offsets and errors of the files in job_dir, all the
+        files if job_dir is None
+        """
+        if job_dir is None:
+            self.state = {}
+            return
+        job_dir = os.path.abspath(job_dir)
+        for filename in list(self.state.keys()):
+            if os.path.dirname(filename) == job_dir:
+                self.state.pop(filename)
+
+    def as_dict(self):
+        return {'signatures': self.signatures, 'chunk_size': self.chunk_size,
+                'state': self.state}
+
+    @classmethod
+    def from_dict(cls, d):
+        scanner = cls(d.get('signatures'), d.get('chunk_size', 1 << 20))
+        scanner.state = d.get('state', {})
+        return scanner
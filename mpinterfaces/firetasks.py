@@ -9,8 +9,6 @@ from __future__ import division, print_function, unicode_literals, \
 Defines various firetasks
 """
 
-from pymatgen.apps.borg.queen import BorgQueen
-
 from monty.json import MontyDecoder
 
 from fireworks.core.firework import FireTaskBase, FWAction
@@ -18,6 +16,7 @@ from fireworks.utilities.fw_serializers import FWSerializable
 from fireworks.utilities.fw_utilities import explicit_serialize
 
 from mpinterfaces.database import MPINTVaspToDbTaskDrone
+from mpinterfaces.assimilation import assimilate
 from mpinterfaces.default_logger import get_default_logger
 
 logger = get_default_logger(__name__)
@@ -53,16 +52,18 @@ class MPINTCalibrateTask(FireTaskBase):
     Calibration Task
     """
 
-    optional_params = ["que_params"]
+    optional_params = ["que_params", "compact"]
 
     def run_task(self, fw_spec):
         """
         launch jobs to the queue
+        with compact set, the calibration object is pushed to the spec
+        in its compact form, see Calibrate.as_dict
         """
         cal = get_cal_obj(self)
         cal.setup()
         cal.run()
-        d = cal.as_dict()
+        d = cal.as_dict(compact=self.get('compact', False))
         d.update({'que_params': self.get('que_params')})
         return FWAction(mod_spec=[{'_push': {'cal_objs': d}}])
 
@@ -73,7 +74,8 @@ class MPINTMeasurementTask(FireTaskBase, FWSerializable):
     Measurement Task
     """
     required_params = ["measurement"]
-    optional_params = ["que_params", "job_cmd", "other_params", "fw_id"]
+    optional_params = ["que_params", "job_cmd", "other_params", "fw_id",
+                       "compact"]
 
     def run_task(self, fw_spec):
         """
@@ -121,7 +123,7 @@ class MPINTMeasurementTask(FireTaskBase, FWSerializable):
             measure.run(job_cmd=job_cmd)
             cal_list = []
             for cal in measure.cal_objs:
-                d = cal.as_dict()
+                d = cal.as_dict(compact=self.get('compact', False))
                 d.update({'que_params': self.get('que_params')})
                 cal_list.append(d)
             return FWAction(update_spec={'cal_objs': cal_list})
@@ -131,9 +133,12 @@ class MPINTMeasurementTask(FireTaskBase, FWSerializable):
 class MPINTDatabaseTask(FireTaskBase, FWSerializable):
     """
     submit data to the database firetask
+
+    only the job dirs that are new or changed since the previous run,
+    according to the manifest file, are parsed, by nprocs processes
     """
     required_params = ["measure_dir"]
-    optional_params = ["dbase_params"]
+    optional_params = ["dbase_params", "manifest", "nprocs"]
 
     def run_task(self, fw_spec):
         """
@@ -141,6 +146,6 @@ class MPINTDatabaseTask(FireTaskBase, FWSerializable):
         put the measurement jobs in the database
         """
         drone = MPINTVaspToDbTaskDrone(**self.get("dbase_params", {}))
-        queen = BorgQueen(drone)  # , number_of_drones=ncpus)
-        queen.serial_assimilate(self["measure_dir"])
+        assimilate(self["measure_dir"], drone, manifest=self.get("manifest"),
+                   nprocs=self.get("nprocs"))
         return FWAction()
@@ -11,9 +11,13 @@ defines the inputset and the job
 
 """
 import os
-import shutil
+import copy
+import hashlib
+import threading
 import subprocess
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from pymatgen.io.vasp.inputs import Incar, Poscar, Potcar, Kpoints
 from pymatgen.io.vasp.sets import DictSet
@@ -30,7 +34,9 @@ from monty.json import MontyDecoder
 
 from fireworks.user_objects.queue_adapters.common_adapter import CommonAdapter
 
-from mpinterfaces.data_processor import MPINTVasprun
+from mpinterfaces.data_processor import extract_final_energy
+from mpinterfaces.staging import stage_file, is_link_safe
+from mpinterfaces.error_scanner import ErrorScanner, RESTARTABLE_ERRORS
 from mpinterfaces.default_logger import get_default_logger
 
 __author__ = "Kiran Mathew, Joshua J. Gabriel"
@@ -42,6 +48,57 @@ __date__ = "March 3, 2017"
 
 logger = get_default_logger(__name__)
 
+# process wide POTCAR cache, least recently used entries are dropped
+_POTCAR_CACHE = OrderedDict()
+_POTCAR_CACHE_SIZE = 256
+_POTCAR_CACHE_LOCK = threading.Lock()
+
+
+def _cached_potcar(key, factory):
+    with _POTCAR_CACHE_LOCK:
+        potcar = _POTCAR_CACHE.pop(key, None)
+        if potcar is not None:
+            _POTCAR_CACHE[key] = potcar
+            return potcar
+    potcar = factory()
+    with _POTCAR_CACHE_LOCK:
+        _POTCAR_CACHE[key] = potcar
+        while len(_POTCAR_CACHE) > _POTCAR_CACHE_SIZE:
+            _POTCAR_CACHE.popitem(last=False)
+    return potcar
+
+
+def get_potcar(symbols, functional='PBE', mapping=None):
+    """
+    returns the Potcar for the symbols and functional from the
+    process wide cache, the pseudopotential files are read only on
+    the first request. The returned Potcar is shared and must not be
+    modified.
+
+    Args:
+        symbols: list of element symbols
+        functional: POTCAR functional
+        mapping (dict): symbol to POTCAR symbol mapping,
+            eg: {'S':'S_sv'}, symbols not in the mapping are used as is
+    """
+    mapping = mapping or {}
+    key = ('symbols', tuple(symbols), functional,
+           tuple(sorted(mapping.items())))
+    return _cached_potcar(key, lambda: Potcar(
+        symbols=[mapping.get(s, s) for s in symbols],
+        functional=functional))
+
+
+def get_potcar_from_file(filename):
+    """
+    returns the Potcar read from the file, cached by the content
+    hash of the file. The returned Potcar is shared and must not be
+    modified.
+    """
+    with open(filename, 'rb') as f:
+        key = ('file', hashlib.sha256(f.read()).hexdigest())
+    return _cached_potcar(key, lambda: Potcar.from_file(filename))
+
 
 class MPINTVaspInputSet(DictSet):
     """
@@ -56,24 +113,31 @@ class MPINTVaspInputSet(DictSet):
         """
         default INCAR from config_dict
 
+        The poscar, kpoints, potcar and queue adapter are shared with
+        the caller and the other input sets built from them, they are
+        never modified in place: setting a different one replaces the
+        reference. Only the INCAR, which the calibration updates in
+        place, is copied. The DictSet is initialized on the first use
+        of one of its attributes: structure, config_dict, incar,
+        poscar, potcar or kpoints.
         """
         self.name = name
         self.test = test
-        self.incar_init = Incar.from_dict(incar.as_dict())
-        self.poscar_init = Poscar.from_dict(poscar.as_dict())
+        self.incar_init = Incar(incar)
+        self.poscar_init = poscar
         if not self.test:
-            self.potcar_init = Potcar.from_dict(potcar.as_dict())
-        if not isinstance(kpoints, str):
-            self.kpoints_init = Kpoints.from_dict(kpoints.as_dict())
-        else:
-            self.kpoints_init = kpoints
+            self.potcar_init = get_potcar(potcar.symbols, potcar.functional)
+        self.kpoints_init = kpoints
         self.reuse_path = reuse_path  # complete reuse paths
         self.extra = kwargs
-        if qadapter is not None:
-            self.qadapter = qadapter.from_dict(qadapter.to_dict())
-        else:
-            self.qadapter = None
+        self.qadapter = qadapter
         self.script_name = script_name
+        if vis_logger:
+            self.logger = vis_logger
+        else:
+            self.logger = logger
+
+    def get_config_dict(self):
         config_dict = {}
         config_dict['INCAR'] = self.incar_init.as_dict()
         config_dict['POSCAR'] = self.poscar_init.as_dict()
@@ -82,19 +146,64 @@ class MPINTVaspInputSet(DictSet):
             config_dict['POTCAR'] = self.potcar_init.as_dict()
         # dict(zip(self.potcar.as_dict()['symbols'],
         # self.potcar.as_dict()['symbols']))
-        if not isinstance(kpoints, str):
+        if not isinstance(self.kpoints_init, str):
             config_dict['KPOINTS'] = self.kpoints_init.as_dict()
         else:
             # need to find a way to dictify this kpoints string more
             # appropriately
-            config_dict['KPOINTS'] = {'kpts_hse':self.kpoints_init}
-        # self.user_incar_settings = self.incar.as_dict()
-        DictSet.__init__(self, poscar.structure, config_dict)
-                         #**kwargs)
-        if vis_logger:
-            self.logger = vis_logger
-        else:
-            self.logger = logger
+            config_dict['KPOINTS'] = {'kpts_hse': self.kpoints_init}
+        return config_dict
+
+    def init_dictset(self):
+        """
+        initialize the DictSet the first time one of its attributes
+        is needed
+        """
+        if not self.__dict__.get('_dictset_init'):
+            self._dictset_init = True
+            # self.user_incar_settings = self.incar.as_dict()
+            DictSet.__init__(self, self.poscar_init.structure,
+                             self.get_config_dict())
+
+    # the DictSet attributes, set by DictSet.__init__
+    @property
+    def structure(self):
+        self.init_dictset()
+        return self._structure
+
+    @structure.setter
+    def structure(self, structure):
+        self._structure = structure
+
+    @property
+    def config_dict(self):
+        self.init_dictset()
+        return self._config_dict
+
+    @config_dict.setter
+    def config_dict(self, config_dict):
+        self._config_dict = config_dict
+
+    # the DictSet inputs
+    @property
+    def incar(self):
+        self.init_dictset()
+        return super(MPINTVaspInputSet, self).incar
+
+    @property
+    def poscar(self):
+        self.init_dictset()
+        return super(MPINTVaspInputSet, self).poscar
+
+    @property
+    def potcar(self):
+        self.init_dictset()
+        return super(MPINTVaspInputSet, self).potcar
+
+    @property
+    def kpoints(self):
+        self.init_dictset()
+        return super(MPINTVaspInputSet, self).kpoints
 
     def write_input(self, job_dir, make_dir_if_not_present=True,
                     write_cif=False):
@@ -127,7 +236,8 @@ class MPINTVaspInputSet(DictSet):
         if self.reuse_path:
             for reuse in self.reuse_path:
                 self.logger.info("copied over {0} ".format(reuse))
-                shutil.copy(reuse, d)
+                stage_file(reuse, d, link=is_link_safe(reuse,
+                                                       self.incar_init))
 
         if self.qadapter is not None:
             with open(os.path.join(d, self.script_name), 'w') as f:
@@ -172,6 +282,95 @@ class MPINTVaspInputSet(DictSet):
                                  **d["kwargs"])
 
 
+def get_incar_diff(incar_base, incar):
+    """
+    difference of the incar with respect to the base incar
+
+    Args:
+        incar_base (dict): base INCAR as dict
+        incar (Incar): INCAR
+
+    Returns:
+        dict of the changed or added parameters and the list of
+        the parameters of the base that are not in the incar
+    """
+    diff = dict((k, copy.deepcopy(v)) for k, v in incar.items()
+                if k not in incar_base or incar_base[k] != v)
+    removed = [k for k in incar_base
+               if not k.startswith('@') and k not in incar]
+    return diff, removed
+
+
+class MPINTLazyVaspInputSet(object):
+    """
+    lightweight job spec for the MPINTVaspInputSet. Only the
+    difference of the INCAR with respect to the shared base INCAR
+    and references to the poscar, kpoints and potcar objects are
+    stored, the actual inputset is materialized when the input files
+    are written or the inputset is serialized.
+
+    Args:
+        name: name of the inputset
+        incar_base (dict): base INCAR as dict, shared by the jobs
+        incar_diff (dict): INCAR parameters that differ from the base
+        poscar, kpoints, potcar: as in MPINTVaspInputSet, not copied
+        incar_removed (list): INCAR parameters of the base that are
+            not in the job's INCAR
+    """
+
+    def __init__(self, name, incar_base, incar_diff, poscar, kpoints,
+                 potcar=None, qadapter=None, script_name='submit_script',
+                 vis_logger=None, reuse_path=None, test=False,
+                 incar_removed=None, **kwargs):
+        self.name = name
+        self.incar_base = incar_base
+        self.incar_diff = incar_diff
+        self.incar_removed = incar_removed or []
+        self.poscar = poscar
+        self.kpoints = kpoints
+        self.potcar = potcar
+        self.qadapter = qadapter
+        self.script_name = script_name
+        self.reuse_path = reuse_path
+        self.test = test
+        self.extra = kwargs
+        if vis_logger:
+            self.logger = vis_logger
+        else:
+            self.logger = logger
+
+    def get_incar(self):
+        """
+        the INCAR of the job: base updated with the diff
+        """
+        incar = Incar.from_dict(self.incar_base)
+        incar.update(self.incar_diff)
+        for k in self.incar_removed:
+            incar.pop(k, None)
+        return incar
+
+    def materialize(self):
+        """
+        build the full MPINTVaspInputSet for the job
+        """
+        return MPINTVaspInputSet(self.name, self.get_incar(), self.poscar,
+                                 self.kpoints, potcar=self.potcar,
+                                 qadapter=self.qadapter,
+                                 script_name=self.script_name,
+                                 vis_logger=self.logger,
+                                 reuse_path=self.reuse_path,
+                                 test=self.test, **self.extra)
+
+    def write_input(self, job_dir, make_dir_if_not_present=True,
+                    write_cif=False):
+        self.materialize().write_input(
+            job_dir, make_dir_if_not_present=make_dir_if_not_present,
+            write_cif=write_cif)
+
+    def as_dict(self):
+        return self.materialize().as_dict()
+
+
 class MPINTJob(Job):
     """
     defines a job i.e setup the required input files and
@@ -201,6 +400,8 @@ class MPINTJob(Job):
         self.settings_override = settings_override
         self.auto_npar = auto_npar
         self.wait = wait
+        # set when the inputs were already written by write_job_inputs
+        self.inputs_written = False
         if vjob_logger:
             self.logger = vjob_logger
         else:
@@ -208,21 +409,36 @@ class MPINTJob(Job):
 
     def setup(self):
         """
-        write the input files to the job_dir
+        write the input files to the job_dir, skipped if the inputs
+        were already written by write_job_inputs
+        """
+        if self.inputs_written:
+            self.logger.info('inputs already written to : ' + self.job_dir)
+            return
+        self.write_inputs()
+
+    def write_inputs(self):
+        """
+        write the input files and the backups, does not change the
+        current working directory
         """
         self.vis.write_input(self.job_dir)
         if self.backup:
-            os.chdir(os.path.abspath(self.job_dir))
-            for f in os.listdir('.'):
-                shutil.copy(f, "{}.orig".format(f))
-            os.chdir(self.parent_job_dir)
+            job_dir = os.path.abspath(self.job_dir)
+            # the inputs may be rewritten by the error handlers, the
+            # backups are never hardlinked
+            for f in os.listdir(job_dir):
+                stage_file(os.path.join(job_dir, f),
+                           os.path.join(job_dir, "{}.orig".format(f)))
 
     def run(self):
         """
-        move to the job_dir, launch the job and back to the
-        parent job directory
+        launch the job from the job_dir, the command is run with the
+        job_dir as its working directory so that the current working
+        directory of the caller is never changed
         """
-        os.chdir(os.path.abspath(self.job_dir))
+        job_dir = os.path.abspath(self.job_dir)
+        output_file = os.path.join(job_dir, self.output_file)
         self.logger.info('running in : ' + self.job_dir)
         p = None
         # if launching jobs via batch system
@@ -231,18 +447,18 @@ class MPINTJob(Job):
                 self.vis.qadapter.q_commands[self.vis.qadapter.q_type][
                     "submit_cmd"]
             cmd = [submit_cmd, self.vis.script_name]
-            with open(self.output_file, 'w') as f:
+            with open(output_file, 'w') as f:
                 p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
+                                     stderr=subprocess.PIPE, cwd=job_dir,
+                                     universal_newlines=True)
                 stdout, stderr = p.communicate()
                 self.job_id = stdout.rstrip('\n').split()[-1]
                 f.write(self.job_id)
         else:
             cmd = list(self.job_cmd)
-            with open(self.output_file, 'w') as f:
-                p = subprocess.Popen(cmd, stdout=f, stderr=f)
+            with open(output_file, 'w') as f:
+                p = subprocess.Popen(cmd, stdout=f, stderr=f, cwd=job_dir)
             self.job_id = 0  # None
-        os.chdir(self.parent_job_dir)
         if self.wait:
             return p
         else:
@@ -313,12 +529,12 @@ class MPINTVaspJob(MPINTJob):
     def get_final_energy(self):
         vasprun_file_path = self.job_dir + os.sep + 'vasprun.xml'
         try:
-            vasprun = MPINTVasprun(vasprun_file_path,
-                                   parse_potcar_file=False)
-            if vasprun.converged:
+            # streamed, the full Vasprun parse holds the whole tree
+            vasprun = extract_final_energy(vasprun_file_path)
+            if vasprun['converged']:
                 self.logger.info("job {0} in {1} converged".format(self.job_id,
                                                                    self.job_dir))
-                return vasprun.final_energy
+                return vasprun['final_energy']
             else:
                 self.logger.info(
                     "job {0} in {1} NOT converged".format(self.job_id,
@@ -336,5 +552,248 @@ class MPINTVaspErrors(ErrorHandler):
     """
     handles restarting of jobs that exceed the walltime
     employs the check + correct method of custodian ErrorHandler
+
+    The stdout file and the OUTCAR are scanned incrementally by an
+    ErrorScanner, each check only reads what was written since the
+    previous one. Only the walltime kill is acted upon, the other VASP
+    errors and warnings found are only reported(logged and kept in
+    events), the check doesnt fail on them.
+
+    Args:
+        output_filename: stdout redirect file of the job
+        scanner: ErrorScanner, shared by the checks
+    """
+    is_monitor = True
+
+    def __init__(self, output_filename='job.out', scanner=None):
+        self.output_filename = output_filename
+        self.scanner = scanner or ErrorScanner()
+        self.errors = set()
+        self.events = []
+
+    def check(self):
+        self.events = self.scanner.scan(
+            os.path.dirname(os.path.abspath(self.output_filename)),
+            [os.path.basename(self.output_filename), 'OUTCAR'])
+        self.errors = set(e['error'] for e in self.events
+                          if e['error'] in RESTARTABLE_ERRORS)
+        return bool(self.errors)
+
+    def correct(self):
+        actions = []
+        if self.errors:
+            job_dir = os.path.dirname(os.path.abspath(self.output_filename))
+            contcar = os.path.join(job_dir, 'CONTCAR')
+            if os.path.isfile(contcar) and os.path.getsize(contcar):
+                stage_file(contcar, os.path.join(job_dir, 'POSCAR'))
+                actions.append({'file': 'CONTCAR',
+                                'action': {'_file_copy': {'dest': 'POSCAR'}}})
+        return {'errors': sorted(self.errors), 'actions': actions}
+
+
+def write_job_inputs(jobs, max_workers=8, wj_logger=None):
+    """
+    create the job directories and write the input files of all the
+    jobs concurrently. The jobs whose inputs were written are marked
+    so that their setup does not write them again.
+
+    Args:
+        jobs: list of MPINTJob objects
+        max_workers: number of threads used for writing
+        wj_logger: logger
+
+    Returns:
+        OrderedDict of job_dir: exception for the jobs whose inputs
+        could not be written
+    """
+    wj_logger = wj_logger or logger
+
+    def write(job):
+        job.write_inputs()
+        job.inputs_written = True
+
+    errors = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(j, executor.submit(write, j)) for j in jobs]
+        for j, future in futures:
+            ex = future.exception()
+            if ex is not None:
+                wj_logger.error('writing inputs to {0} failed: {1}'
+                                .format(j.job_dir, ex))
+                errors[j.job_dir] = ex
+    wj_logger.info('inputs written for {0} of {1} jobs'
+                   .format(len(jobs) - len(errors), len(jobs)))
+    return errors
+
+
+def submit_jobs(jobs, max_workers=8, sj_logger=None):
+    """
+    setup and launch the jobs concurrently, at most max_workers jobs
+    are being submitted (or, for jobs run without a queue adapter,
+    running) at any time. The jobs do not change the current working
+    directory so they can be launched from several threads.
+
+    Args:
+        jobs: list of MPINTJob objects
+        max_workers: number of jobs submitted at once
+        sj_logger: logger
+
+    Returns:
+        OrderedDict of job_dir: exception for the jobs that could not
+        be launched
+    """
+    sj_logger = sj_logger or logger
+
+    def submit(job):
+        job.setup()
+        p = job.run()
+        # local runs: keep the worker busy until the job is done so
+        # that max_workers also bounds the number of running jobs
+        if p:
+            p.wait()
+        job.postprocess()
+
+    errors = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(j, executor.submit(submit, j)) for j in jobs]
+        for j, future in futures:
+            ex = future.exception()
+            if ex is not None:
+                sj_logger.error('launching the job in {0} failed: {1}'
+                                .format(j.job_dir, ex))
+                errors[j.job_dir] = ex
+    sj_logger.info('{0} of {1} jobs launched'
+                   .format(len(jobs) - len(errors), len(jobs)))
+    return errors
+
+
+# array directive, task index variable and stdout redirect file of the
+# array tasks. The redirect file names are the ones looked up by
+# utils.get_job_state
+ARRAY_PARAMS = {
+    'SLURM': {'directive': '#SBATCH --array={}',
+              'task_index': 'SLURM_ARRAY_TASK_ID',
+              'output_file':
+                  'vasp_job-${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}.out'},
+    'PBS': {'directive': '#PBS -t {}',
+            'task_index': 'PBS_ARRAYID',
+            'output_file': 'FW_job.out'}
+}
+
+
+def split_queue_script(qadapter):
+    """
+    split the queue adapter script into its header, the shebang and
+    directives block, and its commands. The change to the launch
+    directory is left out of the commands.
+
+    Returns:
+        header and commands, lists of lines
+    """
+    lines = qadapter.get_script_str('"$MPINT_JOB_DIR"').splitlines()
+    lines = [l for l in lines if not (l.strip().startswith('cd ') and
+                                      '$MPINT_JOB_DIR' in l)]
+    # end of the shebang, directives and comments block
+    n = 0
+    while n < len(lines) and (not lines[n].strip() or
+                              lines[n].startswith('#')):
+        n += 1
+    header = lines[:n]
+    while header and not header[-1].strip():
+        header.pop()
+    return header, lines[n:]
+
+
+def get_array_script_str(qadapter, job_dirs, max_running=None):
+    """
+    job array script that runs the job in job_dirs[i] in array task i.
+    The queue parameters and the commands are taken from the queue
+    adapter script, the array directive and the selection of the job
+    directory are inserted after the directives of the script.
+
+    Args:
+        qadapter: queue adapter, SLURM or PBS
+        job_dirs: list of job directories
+        max_running: maximum number of array tasks running at once
+
+    Returns:
+        the script as a string
+    """
+    params = ARRAY_PARAMS[qadapter.q_type]
+    task_range = '0-{}'.format(len(job_dirs) - 1)
+    if max_running:
+        task_range += '%{}'.format(max_running)
+    header, commands = split_queue_script(qadapter)
+    # the array directive must be part of the directives block
+    array_lines = [params['directive'].format(task_range), '',
+                   'JOB_DIRS=(']
+    array_lines += ['"{}"'.format(os.path.abspath(d)) for d in job_dirs]
+    array_lines += [')',
+                    'MPINT_JOB_DIR="${{JOB_DIRS[${}]}}"'.format(
+                        params['task_index']),
+                    'cd "$MPINT_JOB_DIR"',
+                    'exec > "{}" 2>&1'.format(params['output_file']), '']
+    return '\n'.join(header + array_lines + commands) + '\n'
+
+
+def get_array_task_ids(q_type, array_id, n_tasks):
+    """
+    the job ids of the tasks of the job array array_id, as listed
+    by squeue -r or qstat -t
+    """
+    array_id = str(array_id).strip().split('.')[0]
+    if q_type == 'PBS':
+        array_id = array_id.split('[')[0]
+        return ['{0}[{1}]'.format(array_id, i) for i in range(n_tasks)]
+    return ['{0}_{1}'.format(array_id, i) for i in range(n_tasks)]
+
+
+def submit_job_array(jobs, qadapter=None, script_name='array_script',
+                     launch_dir='.', max_running=None, sa_logger=None):
+    """
+    submit the jobs as a single job array instead of one submission
+    per job. The array script is written to launch_dir and each job
+    gets the id of its array task, which is also written to its
+    output_file.
+
+    Args:
+        jobs: list of MPINTJob objects
+        qadapter: queue adapter, SLURM or PBS, defaults to the one of
+            the first job
+        script_name: name of the array script
+        launch_dir: directory the array is submitted from
+        max_running: maximum number of array tasks running at once
+        sa_logger: logger
+
+    Returns:
+        the job id of the array
     """
-    pass
+    sa_logger = sa_logger or logger
+    qadapter = qadapter or jobs[0].vis.qadapter
+    if qadapter.q_type not in ARRAY_PARAMS:
+        raise ValueError('job arrays are not supported for {}'
+                         .format(qadapter.q_type))
+    for j in jobs:
+        j.setup()
+    launch_dir = os.path.abspath(launch_dir)
+    with open(os.path.join(launch_dir, script_name), 'w') as f:
+        f.write(get_array_script_str(qadapter, [j.job_dir for j in jobs],
+                                     max_running=max_running))
+    submit_cmd = qadapter.q_commands[qadapter.q_type]["submit_cmd"]
+    p = subprocess.Popen([submit_cmd, script_name], stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, cwd=launch_dir,
+                         universal_newlines=True)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0 or not stdout.split():
+        raise RuntimeError('submission of the job array {0} failed: {1}'
+                           .format(script_name, stderr))
+    array_id = stdout.rstrip('\n').split()[-1]
+    task_ids = get_array_task_ids(qadapter.q_type, array_id, len(jobs))
+    for j, task_id in zip(jobs, task_ids):
+        j.job_id = task_id
+        with open(os.path.join(os.path.abspath(j.job_dir), j.output_file),
+                  'w') as f:
+            f.write(task_id)
+    sa_logger.info('submitted {0} jobs as the job array {1}'
+                   .format(len(jobs), array_id))
+    return array_id
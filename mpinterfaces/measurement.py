@@ -12,7 +12,6 @@ Defines measurement jobs
 from six.moves import zip
 
 import sys
-import shutil
 import os
 import json
 import itertools
@@ -24,6 +23,8 @@ from mpinterfaces.calibrate import CalibrateMolecule
 from mpinterfaces.calibrate import CalibrateSlab
 from mpinterfaces.calibrate import CalibrateInterface
 from mpinterfaces.interface import Interface
+from mpinterfaces.instrument import get_potcar_from_file
+from mpinterfaces.staging import stage_file, is_link_safe
 from mpinterfaces.default_logger import get_default_logger
 
 __author__ = "Kiran Mathew, Joshua J. Gabriel"
@@ -81,7 +82,7 @@ class Measurement(object):
                 cal.incar = Incar.from_file(jdir + os.sep + 'INCAR')
                 cal.incar['EDIFF'] = '1E-6'
                 cal.incar['NSW'] = 0
-                cal.potcar = Potcar.from_file(jdir + os.sep + 'POTCAR')
+                cal.potcar = get_potcar_from_file(jdir + os.sep + 'POTCAR')
                 cal.kpoints = Kpoints.from_file(jdir + os.sep + 'KPOINTS')
                 contcar_file = jdir + os.sep + 'CONTCAR'
                 if os.path.isfile(contcar_file):
@@ -164,7 +165,7 @@ class MeasurementSolvation(Measurement):
         for cal in self.cal_objs:
             jdir = cal.old_job_dir_list[0]
             cal.poscar = Poscar.from_file(jdir + os.sep + 'POSCAR')
-            cal.potcar = Potcar.from_file(jdir + os.sep + 'POTCAR')
+            cal.potcar = get_potcar_from_file(jdir + os.sep + 'POTCAR')
             cal.kpoints = Kpoints.from_file(jdir + os.sep + 'KPOINTS')
             cal.incar = Incar.from_file(jdir + os.sep + 'INCAR')
             cal.incar['LSOL'] = '.TRUE.'
@@ -194,7 +195,8 @@ class MeasurementSolvation(Measurement):
                     json.dump(dict(list(zip(keys, params))), f)
                 wavecar_file = cal.old_job_dir_list[0] + os.sep + 'WAVECAR'
                 if os.path.isfile(wavecar_file):
-                    shutil.copy(wavecar_file, job_dir + os.sep + 'WAVECAR')
+                    stage_file(wavecar_file, job_dir + os.sep + 'WAVECAR',
+                               link=is_link_safe('WAVECAR', cal.incar))
                     cal.add_job(job_dir=job_dir)
                 else:
                     logger.critical('WAVECAR doesnt exist. Aborting ...')
@@ -251,7 +253,7 @@ class MeasurementInterface(Measurement):
                 cal.incar = Incar.from_file(jdir + os.sep + 'INCAR')
                 cal.incar['EDIFF'] = '1E-6'
                 cal.incar['NSW'] = 0
-                cal.potcar = Potcar.from_file(jdir + os.sep + 'POTCAR')
+                cal.potcar = get_potcar_from_file(jdir + os.sep + 'POTCAR')
                 cal.kpoints = Kpoints.from_file(jdir + os.sep + 'KPOINTS')
                 contcar_file = jdir + os.sep + 'CONTCAR'
                 if os.path.isfile(contcar_file):
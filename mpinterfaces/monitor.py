@@ -0,0 +1,204 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+asyncio based monitor for running many independent workflow step
+chains concurrently. Each chain is a list of steps as used by
+utils.launch_daemon: a step is a callable that sets up and submits
+jobs and returns the list of checkpoint files to watch.
+
+Note: steps and queue queries are run in a thread pool, the steps
+must therefore not change the current working directory. The error
+handlers are run in child processes, see utils.check_job_errors.
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from mpinterfaces.utils import QueueStatus, get_job_state, \
+    check_job_errors, update_checkpoint, jobs_from_file, get_rerun_key
+from mpinterfaces.packing import update_pack_status
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+
+class WorkflowMonitor(object):
+    """
+    Watches several step chains concurrently. The batch queue is
+    queried with one squeue/qstat call per interval, run in the thread
+    pool and shared by all the chains, and each chain moves on to its next
+    step as soon as all of its jobs are done, independently of the
+    other chains.
+
+    Args:
+        chains: list of step chains, each a list of steps
+        interval: seconds between two status checks of a chain
+        handlers: custodian error handlers that are checked for the
+            failed jobs
+        max_workers: size of the thread pool used for the steps,
+            checkpoint updates and error handlers
+        queue_status: QueueStatus holding the queue snapshot
+        mon_logger: logger
+    """
+
+    def __init__(self, chains, interval=60, handlers=None, max_workers=4,
+                 queue_status=None, mon_logger=None):
+        self.chains = chains
+        self.interval = interval
+        self.handlers = handlers
+        self.max_workers = max_workers
+        self.queue_status = queue_status or QueueStatus(ttl=interval)
+        self.reruns = {}
+        self.executor = None
+        self.queue_lock = None
+        if mon_logger:
+            self.logger = mon_logger
+        else:
+            self.logger = logger
+
+    def run(self):
+        """
+        watch all the chains until they are finished
+
+        Returns:
+            list of the last checkpoint files of each chain, or the
+            exception raised by the chain
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            return loop.run_until_complete(self.watch_all())
+        finally:
+            self.executor.shutdown(wait=True)
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    async def watch_all(self):
+        self.queue_lock = asyncio.Lock()
+        return await asyncio.gather(
+            *[self.watch_chain(i, chain)
+              for i, chain in enumerate(self.chains)],
+            return_exceptions=True)
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """
+        run the blocking function in the thread pool
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor,
+                                          partial(func, *args, **kwargs))
+
+    async def refresh_queue(self):
+        """
+        query the batch system in the thread pool if the queue snapshot
+        is stale. Concurrent requests from the chains are coalesced
+        into a single query.
+        """
+        async with self.queue_lock:
+            if not self.queue_status.is_stale():
+                return
+            await self.run_blocking(self.queue_status.refresh)
+
+    async def watch_chain(self, index, chain):
+        """
+        run the steps of the chain one after the other, moving to
+        the next step once all the jobs of the current step are done
+        """
+        chkpt_files = None
+        for step in chain:
+            name = getattr(step, '__name__', str(step))
+            chkpt_files = await self.run_blocking(
+                step, checkpoint_files=chkpt_files)
+            if not chkpt_files:
+                self.logger.info('chain {0}: step {1} returned no '
+                                 'checkpoint files, stopping'
+                                 .format(index, name))
+                return None
+            while True:
+                await self.refresh_queue()
+                done = await self.check_step(chkpt_files)
+                if done:
+                    self.logger.info(
+                        'chain {0}: all jobs in {1} done. Proceeding to '
+                        'the next one'.format(index, name))
+                    break
+                self.logger.info(
+                    'chain {0}: all jobs in {1} NOT done. Next update in '
+                    '{2} seconds'.format(index, name, self.interval))
+                await asyncio.sleep(self.interval)
+        return chkpt_files
+
+    async def check_step(self, chkpt_files):
+        """
+        update the checkpoint files of a step and check the states
+        of their jobs
+
+        Returns:
+            True if all the jobs are done
+        """
+        done = []
+        for cf in chkpt_files:
+            reruns = self.reruns.pop(cf, [])
+            await self.run_blocking(update_checkpoint, job_ids=reruns,
+                                    jfile=cf)
+            await self.run_blocking(update_pack_status, cf)
+            all_jobs = await self.run_blocking(jobs_from_file, cf)
+            for j in all_jobs:
+                state, ofname = get_job_state(j, self.queue_status,
+                                              refresh=False)
+                if j.final_energy:
+                    done.append(True)
+                elif state == 'R':
+                    self.logger.info('job {} running'.format(j.job_id))
+                    done.append(False)
+                elif state in ['C', 'CF', 'F', '00']:
+                    self.logger.error(
+                        'Job {0} in {1} cancelled or failed. State = {2}'.
+                        format(j.job_id, j.job_dir, state))
+                    done.append(False)
+                    if self.handlers and ofname:
+                        self.logger.info('Investigating ... ')
+                        job_dir = os.path.join(j.parent_job_dir, j.job_dir)
+                        errors = await self.run_blocking(
+                            check_job_errors, job_dir, ofname, self.handlers)
+                        if errors is None:
+                            self.logger.error(
+                                'stdout redirect file not generated, job {} '
+                                'will be rerun'.format(j.job_id))
+                            self.reruns.setdefault(cf, []).append(
+                                get_rerun_key(j))
+                        elif errors:
+                            self.logger.error(
+                                'Detected vasp errors {}'.format(errors))
+                else:
+                    self.logger.info(
+                        'Job {0} pending. State = {1}'.format(j.job_id,
+                                                              state))
+                    done.append(False)
+        return all(done)
+
+
+def monitor_chains(chains, interval, handlers=None, max_workers=4,
+                   mon_logger=None):
+    """
+    run all the step chains concurrently in daemon mode, the
+    concurrent counterpart of utils.launch_daemon
+
+    Args:
+        chains: list of step chains, each a list of steps
+        interval: seconds between the job status checks
+        handlers: error handlers checked for the failed jobs
+        max_workers: size of the thread pool for the blocking work
+    """
+    monitor = WorkflowMonitor(chains, interval=interval, handlers=handlers,
+                              max_workers=max_workers,
+                              mon_logger=mon_logger)
+    return monitor.run()
@@ -0,0 +1,277 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+packing of many small jobs into a single allocation. The jobs are run
+by a bash worker from one batch script, either one after the other or
+in n_groups concurrent groups, each group running its jobs in series
+on its own part of the allocation.
+
+Every job directory gets a status file, mpint_pack_status, with the
+state of the job (Q: queued in the pack, R: running, D: done, F:
+failed), the exit code of the job command and its run time in seconds.
+The statuses are collected into the checkpoint with update_pack_status
+and give the state of each packed job, see get_packed_job_state, since
+all the jobs of a pack share the job id of the allocation.
+"""
+
+import os
+import subprocess
+from collections import OrderedDict
+
+from fireworks.user_objects.queue_adapters.common_adapter import CommonAdapter
+
+from mpinterfaces.instrument import split_queue_script
+from mpinterfaces.checkpoint import get_checkpoint, get_entry_key
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+PACK_STATUS_FILE = 'mpint_pack_status'
+
+# stdout redirect file of the packed jobs, the ones looked up by
+# utils.get_job_state
+PACK_OUTPUT_FILES = {'SLURM': 'vasp_job-${SLURM_JOB_ID}.out',
+                     'PBS': 'FW_job.out'}
+
+WORKER = """\
+N_GROUPS={n_groups}
+JOB_CMD="{job_cmd}"
+run_job() {{
+    cd "$1" || return 1
+    echo "R" > {status_file}
+    start=$(date +%s)
+    $JOB_CMD > "{output_file}" 2>&1
+    rc=$?
+    if [ $rc -eq 0 ]; then state=D; else state=F; fi
+    echo "$state $rc $(( $(date +%s) - start ))" > {status_file}
+}}
+run_group() {{
+    for (( i = $1; i < ${{#JOB_DIRS[@]}}; i += N_GROUPS )); do
+        run_job "${{JOB_DIRS[$i]}}"
+    done
+}}
+for (( g = 0; g < N_GROUPS; g++ )); do
+    run_group $g &
+done
+wait"""
+
+
+def get_pack_commands(job_dirs, job_cmd, n_groups=1, output_file='job.out'):
+    """
+    commands of the bash worker that runs job_cmd in each of the
+    job_dirs. Job i is run by the group i % n_groups.
+
+    Args:
+        job_dirs: list of job directories
+        job_cmd: command run in each job directory, list or string.
+            With several groups the command must only use the share
+            of the allocation of one group,
+            eg: 'srun -N 1 -n 16 vasp' for 4 groups on 4 nodes
+        n_groups: number of jobs running at once
+        output_file: stdout redirect file in the job directories
+
+    Returns:
+        list of lines
+    """
+    if not isinstance(job_cmd, str):
+        job_cmd = ' '.join(job_cmd)
+    lines = ['JOB_DIRS=(']
+    lines += ['"{}"'.format(os.path.abspath(d)) for d in job_dirs]
+    lines += [')']
+    lines += WORKER.format(n_groups=min(n_groups, len(job_dirs)),
+                           job_cmd=job_cmd.replace('"', '\\"'),
+                           status_file=PACK_STATUS_FILE,
+                           output_file=output_file).splitlines()
+    return lines
+
+
+def get_pack_script_str(job_dirs, job_cmd=None, qadapter=None, n_groups=1):
+    """
+    batch script that runs all the jobs in job_dirs from one
+    allocation. The queue parameters and the commands run before and
+    after the jobs are taken from the queue adapter script, the worker
+    replaces the rocket_launch command.
+
+    Args:
+        job_dirs: list of job directories
+        job_cmd: command run in each job directory, defaults to the
+            rocket_launch command of the queue adapter
+        qadapter: queue adapter, SLURM or PBS. Without queue adapter
+            the worker is returned as a plain bash script
+        n_groups: number of jobs running at once
+
+    Returns:
+        the script as a string
+    """
+    if qadapter is None:
+        return '\n'.join(['#!/bin/bash', ''] +
+                         get_pack_commands(job_dirs, job_cmd,
+                                           n_groups=n_groups)) + '\n'
+    worker_qadapter = CommonAdapter.from_dict(qadapter.to_dict())
+    job_cmd = job_cmd or qadapter.get('rocket_launch')
+    worker_qadapter['rocket_launch'] = 'MPINT_PACK_WORKER'
+    header, commands = split_queue_script(worker_qadapter)
+    worker = get_pack_commands(job_dirs, job_cmd, n_groups=n_groups,
+                               output_file=PACK_OUTPUT_FILES.get(
+                                   qadapter.q_type, 'job.out'))
+    lines = []
+    for l in commands:
+        if l.strip() == 'MPINT_PACK_WORKER':
+            lines += worker
+        else:
+            lines.append(l)
+    return '\n'.join(header + [''] + lines) + '\n'
+
+
+def submit_packed_jobs(jobs, job_cmd=None, qadapter=None, n_groups=1,
+                       script_name='pack_script', launch_dir='.',
+                       pk_logger=None):
+    """
+    run the jobs from a single allocation. The inputs of the jobs are
+    written, their status is set to queued and the pack script is
+    written to launch_dir and submitted. Without queue adapter the
+    script is run directly and the call returns when all the jobs are
+    done.
+
+    Args:
+        jobs: list of MPINTJob objects
+        job_cmd: command run in each job directory, defaults to the
+            rocket_launch command of the queue adapter or to the
+            job_cmd of the first job
+        qadapter: queue adapter, SLURM or PBS, defaults to the one of
+            the first job
+        n_groups: number of jobs running at once
+        script_name: name of the pack script
+        launch_dir: directory the pack is submitted from
+        pk_logger: logger
+
+    Returns:
+        the job id of the allocation, also set as the job id of all the
+        jobs, 0 if run without batch queue
+    """
+    pk_logger = pk_logger or logger
+    if qadapter is None and jobs[0].vis is not None:
+        qadapter = jobs[0].vis.qadapter
+    if not job_cmd and (qadapter is None or
+                        not qadapter.get('rocket_launch')):
+        job_cmd = jobs[0].job_cmd
+    for j in jobs:
+        j.setup()
+        with open(os.path.join(os.path.abspath(j.job_dir),
+                               PACK_STATUS_FILE), 'w') as f:
+            f.write('Q\n')
+    launch_dir = os.path.abspath(launch_dir)
+    with open(os.path.join(launch_dir, script_name), 'w') as f:
+        f.write(get_pack_script_str([j.job_dir for j in jobs],
+                                    job_cmd=job_cmd, qadapter=qadapter,
+                                    n_groups=n_groups))
+    if qadapter is None:
+        subprocess.check_call(['bash', script_name], cwd=launch_dir)
+        job_id = 0
+    else:
+        submit_cmd = qadapter.q_commands[qadapter.q_type]["submit_cmd"]
+        p = subprocess.Popen([submit_cmd, script_name],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=launch_dir, universal_newlines=True)
+        stdout, stderr = p.communicate()
+        if p.returncode != 0 or not stdout.split():
+            raise RuntimeError('submission of the pack {0} failed: {1}'
+                               .format(script_name, stderr))
+        job_id = stdout.rstrip('\n').split()[-1]
+    for j in jobs:
+        j.job_id = job_id
+    pk_logger.info('{0} jobs packed in {1} groups, job id {2}'
+                   .format(len(jobs), n_groups, job_id))
+    return job_id
+
+
+def get_pack_status(job_dir):
+    """
+    status of the packed job in job_dir
+
+    Returns:
+        dict with the state, the exit code and the run time of the job,
+        None if the job was not packed
+    """
+    try:
+        with open(os.path.join(job_dir, PACK_STATUS_FILE)) as f:
+            tokens = f.read().split()
+    except IOError:
+        return None
+    if not tokens:
+        return None
+    status = {'state': tokens[0], 'returncode': None, 'elapsed': None}
+    if len(tokens) == 3:
+        status['returncode'] = int(tokens[1])
+        status['elapsed'] = int(tokens[2])
+    return status
+
+
+def update_pack_status(jfile):
+    """
+    collect the status of the packed jobs into the checkpoint file,
+    jfile. Only the entries whose status changed are updated.
+
+    Returns:
+        OrderedDict of job_dir: status for all the packed jobs
+    """
+    store = get_checkpoint(jfile)
+    statuses = OrderedDict()
+    updates = OrderedDict()
+    for entry in store.load():
+        job_dir = get_entry_key(entry)
+        status = get_pack_status(job_dir)
+        if status is None:
+            continue
+        statuses[job_dir] = status
+        if entry.get('pack_status') != status:
+            updates[job_dir] = {'pack_status': status}
+    if updates:
+        store.update(updates)
+    return statuses
+
+
+def clear_pack_status(job_dir):
+    """
+    remove the status file of a packed job that is rerun on its own
+    """
+    try:
+        os.remove(os.path.join(job_dir, PACK_STATUS_FILE))
+    except OSError:
+        pass
+
+
+def get_packed_job_state(pack_status, allocation_state):
+    """
+    queue state of a packed job from its pack status and the queue
+    state of the allocation it is packed in
+
+    Args:
+        pack_status: dict as returned by get_pack_status
+        allocation_state: state of the allocation, see
+            utils.get_job_state
+
+    Returns:
+        'R' while the job runs, 'C' once it is done, 'F' if it failed
+        or if the allocation ended before the job did. The state of
+        the allocation while the job waits in the pack, 'Q' if the
+        allocation is already running.
+    """
+    state = pack_status['state']
+    if state == 'D':
+        return 'C'
+    if state == 'F':
+        return 'F'
+    if allocation_state == '00':
+        # killed with the allocation, eg: at the walltime
+        return 'F'
+    if state == 'R':
+        return 'R'
+    if allocation_state == 'R':
+        return 'Q'
+    return allocation_state
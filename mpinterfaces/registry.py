@@ -0,0 +1,191 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+content addressed registry of the submitted vasp jobs, stored in a
+local sqlite file. Jobs are keyed by a canonical hash of their INCAR,
+POSCAR, KPOINTS and POTCAR symbols so that a job whose inputs are
+identical to an already finished or running job is linked to that
+job's directory instead of being submitted again.
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+
+from mpinterfaces.data_processor import probe_vasp_run
+from mpinterfaces.utils import get_queue_status
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+# queue states of jobs that are gone or will not produce a result
+INACTIVE_STATES = ['00', 'C', 'CD', 'CF', 'CA', 'F', 'TO', 'NF']
+
+
+def get_inputs_hash(incar, poscar, kpoints, potcar=None):
+    """
+    canonical hash of the vasp inputs: INCAR with sorted tags,
+    POSCAR as written to the job directory, KPOINTS and the POTCAR
+    functional and symbols
+
+    Args:
+        incar (Incar), poscar (Poscar), kpoints (Kpoints or str),
+        potcar (Potcar)
+
+    Returns:
+        sha256 hex digest
+    """
+    sha = hashlib.sha256()
+    sha.update(incar.get_string(sort_keys=True).encode('utf-8'))
+    sha.update(poscar.get_string(significant_figures=10).encode('utf-8'))
+    if isinstance(kpoints, str):
+        sha.update(kpoints.encode('utf-8'))
+    else:
+        sha.update(str(kpoints).encode('utf-8'))
+    if potcar is not None:
+        sha.update('{0} {1}'.format(potcar.functional,
+                                    ' '.join(potcar.symbols))
+                   .encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_job_hash(job):
+    """
+    hash of the inputs of an MPINTJob, works with both the full and
+    the lazy inputsets
+    """
+    vis = job.vis
+    if hasattr(vis, 'materialize'):
+        return get_inputs_hash(vis.get_incar(), vis.poscar, vis.kpoints,
+                               None if vis.test else vis.potcar)
+    return get_inputs_hash(vis.incar_init, vis.poscar_init,
+                           vis.kpoints_init,
+                           None if vis.test else vis.potcar_init)
+
+
+class JobRegistry(object):
+    """
+    sqlite backed registry of job input hash: job directory, job id
+
+    Args:
+        db_file: path to the sqlite file, created if not present
+        queue_status: QueueStatus used to check whether a registered
+            job is still in the queue
+    """
+
+    def __init__(self, db_file='mpint_jobs.db', queue_status=None,
+                 reg_logger=None):
+        self.db_file = os.path.abspath(db_file)
+        self.queue_status = queue_status or get_queue_status()
+        if reg_logger:
+            self.logger = reg_logger
+        else:
+            self.logger = logger
+        self.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                     'hash TEXT PRIMARY KEY, job_dir TEXT, '
+                     'job_id TEXT, created REAL)')
+
+    def execute(self, sql, params=()):
+        """
+        execute the statement in its own transaction and return the
+        first row of the result
+        """
+        conn = sqlite3.connect(self.db_file, timeout=60)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def lookup(self, job_hash):
+        """
+        returns (job_dir, job_id) of the registered job, None if the
+        hash is not registered
+        """
+        return self.execute('SELECT job_dir, job_id FROM jobs '
+                            'WHERE hash = ?', (job_hash,))
+
+    def register(self, job_hash, job_dir, job_id):
+        """
+        register the job, replaces any previous job with the same
+        inputs
+        """
+        self.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)',
+                     (job_hash, os.path.abspath(job_dir), str(job_id),
+                      time.time()))
+
+    def find_reusable(self, job_hash):
+        """
+        returns (job_dir, job_id) of a registered job with the same
+        inputs that is either finished with a converged run or still
+        in the queue, None otherwise
+        """
+        record = self.lookup(job_hash)
+        if record is None:
+            return None
+        job_dir, job_id = record
+        if not os.path.isdir(job_dir):
+            return None
+        probe = probe_vasp_run(job_dir)
+        if probe and probe['converged']:
+            return record
+        # a job whose state is unknown is not relied upon
+        state = self.queue_status.get_state(job_id)
+        if state != self.queue_status.UNKNOWN and \
+                state not in INACTIVE_STATES:
+            return record
+        return None
+
+    def dedupe(self, jobs):
+        """
+        link the jobs whose inputs match a reusable registered job to
+        the directory of that job
+
+        Args:
+            jobs: list of MPINTJob objects
+
+        Returns:
+            (jobs to run, linked jobs), the linked jobs get the job_id
+            of the job they are linked to
+        """
+        to_run, linked = [], []
+        for j in jobs:
+            record = self.find_reusable(get_job_hash(j))
+            if record is None:
+                to_run.append(j)
+                continue
+            job_dir, job_id = record
+            new_dir = os.path.abspath(j.job_dir)
+            if new_dir == job_dir:
+                self.logger.info('job in {0} already submitted, job id {1}'
+                                 .format(job_dir, job_id))
+            elif os.path.lexists(new_dir):
+                self.logger.warn('{0} exists, cannot link it to the '
+                                 'identical job in {1}'.format(new_dir,
+                                                              job_dir))
+                to_run.append(j)
+                continue
+            else:
+                parent = os.path.dirname(new_dir)
+                if not os.path.exists(parent):
+                    os.makedirs(parent)
+                os.symlink(job_dir, new_dir)
+                self.logger.info('linked {0} to the identical job in {1}, '
+                                 'job id {2}'.format(new_dir, job_dir,
+                                                     job_id))
+            j.job_id = job_id
+            linked.append(j)
+        return to_run, linked
+
+    def register_jobs(self, jobs):
+        """
+        register the submitted jobs
+        """
+        for j in jobs:
+            self.register(get_job_hash(j), j.job_dir, j.job_id)
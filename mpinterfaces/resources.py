@@ -0,0 +1,332 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+walltime and node count prediction for the generated run scripts.
+
+The run data (number of atoms, ENCUT, number of irreducible k-points,
+NBANDS, elapsed time and number of cores) is harvested from the OUTCARs
+of completed jobs and a log-linear model of the elapsed time,
+
+    log(t) = c0 + c1 log(nions) + c2 log(encut) + c3 log(nkpts)
+             + c4 log(nbands) + c5 log(cores)
+
+is fit by least squares. The model is stored as json, the file set as
+resource_model in mpint_config.yaml is used to suggest the walltime
+and node count by get_run_cmmnd, when given the job features, and by
+write_pbs_runjob and write_slurm_runjob, from the job inputs in the
+directory the runjob is written to.
+"""
+
+import os
+import re
+import json
+import mmap
+import math
+
+import numpy as np
+
+from pymatgen.io.vasp.inputs import Incar, Poscar, Kpoints, Potcar
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from mpinterfaces import RESOURCE_MODEL
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+FEATURES = ('nions', 'encut', 'nkpts', 'nbands')
+
+_OUTCAR_CORES = re.compile(br'running on\s+(\d+)\s+(?:total cores|nodes)')
+_OUTCAR_NIONS = re.compile(br'NIONS\s*=\s*(\d+)')
+_OUTCAR_NKPTS = re.compile(br'NKPTS\s*=\s*(\d+)')
+_OUTCAR_NBANDS = re.compile(br'NBANDS\s*=\s*(\d+)')
+_OUTCAR_ENCUT = re.compile(br'ENCUT\s*=\s*([\d.]+)')
+_OUTCAR_ELAPSED = re.compile(br'Elapsed time \(sec\):\s*([\d.]+)')
+
+
+def parse_outcar_resources(filename):
+    """
+    run data of a completed job from its OUTCAR
+
+    Returns:
+        dict with nions, encut, nkpts, nbands, cores and elapsed (in
+        seconds), None if the OUTCAR is incomplete
+    """
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # the timing is at the end of the OUTCAR of a finished run
+            elapsed = _OUTCAR_ELAPSED.search(mm, max(0, size - 65536))
+            if elapsed is None:
+                return None
+            d = {'elapsed': float(elapsed.group(1))}
+            for k, regex in [('cores', _OUTCAR_CORES),
+                             ('nions', _OUTCAR_NIONS),
+                             ('nkpts', _OUTCAR_NKPTS),
+                             ('nbands', _OUTCAR_NBANDS),
+                             ('encut', _OUTCAR_ENCUT)]:
+                match = regex.search(mm)
+                if match is None:
+                    return None
+                d[k] = float(match.group(1))
+        finally:
+            mm.close()
+    return d
+
+
+def harvest_run_data(root_dirs):
+    """
+    run data of all the completed OUTCARs found below root_dirs
+    """
+    if isinstance(root_dirs, str):
+        root_dirs = [root_dirs]
+    records = []
+    for root_dir in root_dirs:
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            if 'OUTCAR' not in filenames:
+                continue
+            filename = os.path.join(dirpath, 'OUTCAR')
+            try:
+                d = parse_outcar_resources(filename)
+            except (IOError, ValueError) as ex:
+                logger.warn('could not read {0}: {1}'.format(filename, ex))
+                continue
+            if d:
+                records.append(d)
+    logger.info('{} completed runs harvested'.format(len(records)))
+    return records
+
+
+def get_nkpts(kpoints, structure=None):
+    """
+    number of irreducible k-points of the kpoints, estimated from the
+    full mesh if the structure is not given
+    """
+    if kpoints.style.name in ('Gamma', 'Monkhorst'):
+        mesh = kpoints.kpts[0]
+        if structure is not None:
+            shift = (0, 0, 0) if kpoints.style.name == 'Gamma' else \
+                tuple(int(m % 2 == 0) for m in mesh)
+            try:
+                return len(SpacegroupAnalyzer(structure)
+                           .get_ir_reciprocal_mesh(mesh, is_shift=shift))
+            except Exception:
+                pass
+        return int(np.prod(mesh))
+    return max(len(kpoints.kpts), 1)
+
+
+def get_job_features(incar, poscar, kpoints, potcar=None):
+    """
+    features of the job used for the prediction. NBANDS is taken from
+    the INCAR or estimated from the number of valence electrons in the
+    potcar as VASP does, else left to the predictor.
+
+    Returns:
+        dict with nions, encut, nkpts and nbands
+    """
+    structure = poscar.structure
+    nions = len(structure)
+    nbands = incar.get('NBANDS')
+    if nbands is None and potcar is not None:
+        nelect = sum(p.nelectrons * n for p, n in
+                     zip(potcar, poscar.natoms))
+        nbands = max(int(math.ceil(nelect / 2 + nions / 2)),
+                     int(math.ceil(0.6 * nelect)))
+    return {'nions': nions, 'encut': float(incar.get('ENCUT', 400)),
+            'nkpts': get_nkpts(kpoints, structure), 'nbands': nbands}
+
+
+def get_dir_features(job_dir='.'):
+    """
+    features of the job from the input files in job_dir
+    """
+    incar = Incar.from_file(os.path.join(job_dir, 'INCAR'))
+    poscar = Poscar.from_file(os.path.join(job_dir, 'POSCAR'),
+                              check_for_POTCAR=False)
+    kpoints = Kpoints.from_file(os.path.join(job_dir, 'KPOINTS'))
+    potcar = None
+    if os.path.exists(os.path.join(job_dir, 'POTCAR')):
+        potcar = Potcar.from_file(os.path.join(job_dir, 'POTCAR'))
+    return get_job_features(incar, poscar, kpoints, potcar)
+
+
+def seconds_to_walltime(seconds):
+    seconds = int(seconds)
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600,
+                                        seconds % 3600 // 60, seconds % 60)
+
+
+def walltime_to_seconds(walltime):
+    """
+    seconds in the walltime, hh:mm:ss or the slurm d-hh[:mm[:ss]]
+    """
+    days, hms = 0, walltime
+    if '-' in walltime:
+        days, hms = walltime.split('-', 1)
+        # the hours come first after the days
+        hms = ':'.join((hms.split(':') + ['0', '0'])[:3])
+    seconds = 0
+    for t in hms.split(':'):
+        seconds = 60 * seconds + int(t)
+    return 86400 * int(days) + seconds
+
+
+class ResourcePredictor(object):
+    """
+    log-linear model of the elapsed time of a job
+
+    Args:
+        coefficients: coefficients of the model, constant first, then
+            the FEATURES and the number of cores
+        bands_per_ion: NBANDS per atom used when the NBANDS of a job
+            is not known
+    """
+
+    def __init__(self, coefficients=None, bands_per_ion=None):
+        self.coefficients = coefficients
+        self.bands_per_ion = bands_per_ion
+
+    @staticmethod
+    def get_row(features, cores):
+        return [1.0] + [math.log(features[k]) for k in FEATURES] + \
+            [math.log(cores)]
+
+    def fit(self, records):
+        """
+        least squares fit of the model to the run data
+        """
+        if len(records) < len(FEATURES) + 2:
+            raise ValueError('{} runs are not enough to fit the model'
+                             .format(len(records)))
+        a = np.array([self.get_row(r, r['cores']) for r in records])
+        b = np.log([r['elapsed'] for r in records])
+        self.coefficients = np.linalg.lstsq(a, b, rcond=None)[0].tolist()
+        self.bands_per_ion = float(np.median(
+            [r['nbands'] / r['nions'] for r in records]))
+        return self
+
+    def predict(self, features, cores):
+        """
+        predicted elapsed time, in seconds, of the job on cores cores
+        """
+        features = dict(features)
+        if not features.get('nbands'):
+            features['nbands'] = max(self.bands_per_ion *
+                                     features['nions'], 1)
+        return math.exp(np.dot(self.coefficients,
+                               self.get_row(features, cores)))
+
+    def suggest(self, features, cores_per_node=16, max_nodes=4,
+                max_walltime='48:00:00', safety=1.5, min_walltime=900):
+        """
+        fewest nodes for which the predicted elapsed time, increased by
+        the safety factor, fits in max_walltime
+
+        Args:
+            features: job features, see get_job_features
+            cores_per_node: cores used on each node
+            max_nodes: largest node count suggested
+            max_walltime: walltime limit, hh:mm:ss
+            safety: factor applied to the predicted time
+            min_walltime: shortest walltime suggested, in seconds. The
+                walltime is rounded up to a multiple of it
+
+        Returns:
+            dict with nnodes, ntasks and walltime (hh:mm:ss)
+        """
+        limit = walltime_to_seconds(max_walltime)
+        for nnodes in range(1, max_nodes + 1):
+            seconds = safety * self.predict(features,
+                                            nnodes * cores_per_node)
+            if seconds <= limit:
+                break
+        seconds = min(max(math.ceil(seconds / min_walltime), 1) *
+                      min_walltime, limit)
+        return {'nnodes': nnodes, 'ntasks': nnodes * cores_per_node,
+                'walltime': seconds_to_walltime(seconds)}
+
+    def as_dict(self):
+        return {'coefficients': self.coefficients,
+                'bands_per_ion': self.bands_per_ion}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['coefficients'], d['bands_per_ion'])
+
+    def to_file(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f)
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename) as f:
+            return cls.from_dict(json.load(f))
+
+
+def fit_predictor(root_dirs, filename=None):
+    """
+    fit the model on the OUTCARs below root_dirs and store it in
+    filename, defaults to the resource_model in mpint_config.yaml
+    """
+    predictor = ResourcePredictor().fit(harvest_run_data(root_dirs))
+    filename = filename or RESOURCE_MODEL
+    if filename:
+        predictor.to_file(filename)
+    return predictor
+
+
+_DEFAULT_PREDICTOR = {}
+
+
+def get_default_predictor():
+    """
+    the model stored in the resource_model file of mpint_config.yaml,
+    None if there is no model
+    """
+    if not RESOURCE_MODEL or not os.path.exists(RESOURCE_MODEL):
+        return None
+    mtime = os.path.getmtime(RESOURCE_MODEL)
+    if _DEFAULT_PREDICTOR.get('mtime') != mtime:
+        _DEFAULT_PREDICTOR['mtime'] = mtime
+        _DEFAULT_PREDICTOR['predictor'] = \
+            ResourcePredictor.from_file(RESOURCE_MODEL)
+    return _DEFAULT_PREDICTOR['predictor']
+
+
+def suggest_resources(features=None, cores_per_node=16,
+                      max_walltime='48:00:00', predictor=None, job_dir=None,
+                      **kwargs):
+    """
+    resources suggested for the job by the predictor, defaults to the
+    model in mpint_config.yaml. None if there is no model.
+
+    Args:
+        features: job features, see get_job_features. If not given,
+            they are read from the input files in job_dir
+        cores_per_node, max_walltime, kwargs: passed on to
+            ResourcePredictor.suggest
+    """
+    predictor = predictor or get_default_predictor()
+    if predictor is None:
+        return None
+    if features is None:
+        if job_dir is None:
+            return None
+        try:
+            features = get_dir_features(job_dir)
+        except Exception as ex:
+            logger.warn('no job features in {0}: {1}'.format(job_dir, ex))
+            return None
+    suggestion = predictor.suggest(features, cores_per_node=cores_per_node,
+                                   max_walltime=max_walltime, **kwargs)
+    logger.info('suggested resources {0} for {1}'.format(suggestion,
+                                                         features))
+    return suggestion
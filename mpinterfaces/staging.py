@@ -0,0 +1,168 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+staging of large files (WAVECAR, CHGCAR, backups, ...) into the job
+directories without copying their content when possible:
+    reflink: copy-on-write clone of the file, on filesystems that
+        support it (btrfs, xfs, ...). Always safe.
+    hardlink: only for files that neither VASP nor the error handlers
+        rewrite in place, since a rewrite would also change the
+        source and every other job linked to it
+    copy: fallback, e.g. across filesystems
+A link safe file staged more than once into the same filesystem is
+copied at most once, the later stages are cloned or linked from the
+first copy.
+"""
+
+import os
+import errno
+import shutil
+import fcntl
+import threading
+
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+# linux ioctl cloning a whole file, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# files VASP writes back unless the INCAR tag is set to False, the
+# tags default to True
+REWRITTEN_UNLESS = {'WAVECAR': 'LWAVE', 'CHGCAR': 'LCHARG',
+                    'CHG': 'LCHARG'}
+
+# files only read by VASP
+READ_ONLY = ('vdw_kernel.bindat',)
+
+
+def is_link_safe(filename, incar=None):
+    """
+    whether the file can be hardlinked into a job directory, i.e VASP
+    run with the incar does not rewrite it
+    """
+    name = os.path.basename(filename)
+    if name in READ_ONLY:
+        return True
+    if name in REWRITTEN_UNLESS and incar is not None:
+        return incar.get(REWRITTEN_UNLESS[name], True) is False
+    return False
+
+
+def reflink(src, dst):
+    """
+    clone src to dst, raises IOError/OSError if the filesystem
+    doesnt support it
+    """
+    with open(src, 'rb') as fsrc:
+        try:
+            with open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except (IOError, OSError):
+            if os.path.exists(dst):
+                os.remove(dst)
+            raise
+
+
+def get_signature(filename):
+    st = os.stat(filename)
+    return st.st_mtime, st.st_size
+
+
+class FileStager(object):
+    """
+    stages files into the job directories by reflink, hardlink or
+    copy, in that order. The first copy of a link safe file into a
+    filesystem is remembered and the later stages of the file into
+    that filesystem are cloned or linked from it, as long as it is
+    unchanged.
+
+    Args:
+        stager_logger: logger
+    """
+
+    def __init__(self, stager_logger=None):
+        self.staged = {}
+        self.lock = threading.Lock()
+        self.logger = stager_logger or logger
+
+    def get_source(self, src, dst):
+        """
+        the unchanged copy of src already staged to the filesystem of
+        dst, src if there is none
+        """
+        key = (os.path.realpath(src),
+               os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        with self.lock:
+            staged = self.staged.get(key)
+        if staged is not None:
+            fname, signature = staged
+            try:
+                if get_signature(fname) == signature:
+                    return fname
+            except OSError:
+                pass
+            with self.lock:
+                self.staged.pop(key, None)
+        return src
+
+    def remember(self, src, dst):
+        key = (os.path.realpath(src), os.stat(dst).st_dev)
+        with self.lock:
+            self.staged.setdefault(key, (os.path.abspath(dst),
+                                         get_signature(dst)))
+
+    def stage(self, src, dst, link=False):
+        """
+        stage src to dst, dst being the target file name or directory
+
+        Args:
+            src: source file
+            dst: destination file or directory
+            link: whether dst may be a hardlink, see is_link_safe
+
+        Returns:
+            the method used: 'reflink', 'hardlink' or 'copy'
+        """
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        if os.path.lexists(dst):
+            os.remove(dst)
+        # files that may be rewritten by their job are never used as
+        # the source of later stages
+        source = self.get_source(src, dst) if link else src
+        try:
+            reflink(source, dst)
+            method = 'reflink'
+        except (IOError, OSError):
+            method = None
+        if method is None and link:
+            try:
+                os.link(source, dst)
+                method = 'hardlink'
+            except OSError as ex:
+                if ex.errno not in (errno.EXDEV, errno.EPERM,
+                                    errno.EMLINK, errno.ENOTSUP):
+                    raise
+        if method is None:
+            shutil.copy(src, dst)
+            method = 'copy'
+            if link:
+                self.remember(src, dst)
+        self.logger.info('staged {0} to {1} by {2}'.format(src, dst, method))
+        return method
+
+
+_STAGER = FileStager()
+
+
+def stage_file(src, dst, link=False):
+    """
+    stage src to dst with the process wide stager, see FileStager.stage
+    """
+    return _STAGER.stage(src, dst, link=link)
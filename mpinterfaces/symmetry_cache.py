@@ -0,0 +1,114 @@
+# coding: utf-8
+# Copyright (c) Henniggroup.
+# Distributed under the terms of the MIT License.
+
+from __future__ import division, print_function, unicode_literals, \
+    absolute_import
+
+"""
+persistent cache of the spacegroup analysis of structures.
+
+The calibration series have many tasks with the same final structure,
+only ENCUT or the kpoints differ. The spacegroup info of a structure is
+stored in a sqlite key-value file under a fingerprint of the structure:
+its lattice parameters and its species and fractional coordinates,
+sorted and rounded, along with the symmetry tolerance. The file is
+shared by the drone runs and the parsing processes.
+"""
+
+import json
+import hashlib
+import sqlite3
+
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from mpinterfaces import SYMMETRY_CACHE
+from mpinterfaces.default_logger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+
+def get_structure_fingerprint(structure, symprec=0.1, decimals=4):
+    """
+    hash of the rounded lattice parameters and the sorted, rounded
+    (species, fractional coordinates) of the sites. Independent of the
+    site order and of the periodic images of the coordinates.
+    """
+    lattice = [round(x, decimals) for x in
+               structure.lattice.abc + structure.lattice.angles]
+    sites = []
+    for site in structure:
+        # 0.99999 and 0 are the same coordinate
+        coords = [round(x % 1.0, decimals) % 1.0 for x in site.frac_coords]
+        sites.append([site.species_string] + coords)
+    key = json.dumps([symprec, lattice, sorted(sites)])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_spacegroup_info(structure, symprec=0.1):
+    sg = SpacegroupAnalyzer(structure, symprec)
+    return {"symbol": sg.get_space_group_symbol(),
+            "number": sg.get_space_group_number(),
+            "point_group": sg.get_point_group(),
+            "source": "spglib",
+            "crystal_system": sg.get_crystal_system(),
+            "hall": sg.get_hall()}
+
+
+class SymmetryCache(object):
+    """
+    sqlite key-value store of the spacegroup info, keyed by structure
+    fingerprint
+
+    Args:
+        filename: cache file, defaults to symmetry_cache in
+            mpint_config.yaml
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or SYMMETRY_CACHE
+        self.hits = 0
+        self.misses = 0
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS symmetry '
+                             '(key TEXT PRIMARY KEY, value TEXT)')
+        finally:
+            conn.close()
+
+    def connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    def get(self, key):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT value FROM symmetry WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            conn.close()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, value):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO symmetry VALUES (?, ?)',
+                             (key, json.dumps(value)))
+        finally:
+            conn.close()
+
+    def get_spacegroup_info(self, structure, symprec=0.1):
+        """
+        spacegroup info of the structure, analyzed only if it is not
+        in the cache yet
+        """
+        key = get_structure_fingerprint(structure, symprec)
+        info = self.get(key)
+        if info is not None:
+            self.hits += 1
+            return info
+        self.misses += 1
+        info = get_spacegroup_info(structure, symprec)
+        self.put(key, info)
+        return info
@@ -0,0 +1,25 @@
+from pymatgen.io.vasp.inputs import Potcar
+
+from mpinterfaces import instrument
+
+
+def stub_potcar(symbols, functional='PBE'):
+    """
+    no pseudopotentials here: put an empty potcar in the process wide
+    potcar cache of instrument for the symbols.
+
+    Returns:
+        function that puts back what was cached for the symbols, to
+        be called in tearDown
+    """
+    key = ('symbols', tuple(symbols), functional, ())
+    with instrument._POTCAR_CACHE_LOCK:
+        cached = instrument._POTCAR_CACHE.pop(key, None)
+        instrument._POTCAR_CACHE[key] = Potcar(functional=functional)
+
+    def restore():
+        with instrument._POTCAR_CACHE_LOCK:
+            instrument._POTCAR_CACHE.pop(key, None)
+            if cached is not None:
+                instrument._POTCAR_CACHE[key] = cached
+    return restore
@@ -0,0 +1,88 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from mpinterfaces.assimilation import assimilate, FileSink, CollectionSink
+
+
+class FakeDrone(object):
+    """
+    picklable stand-in for MPINTVaspToDbTaskDrone
+    """
+    runs = ['relax1', 'relax2']
+
+    def get_valid_paths(self, path):
+        parent, subdirs, files = path
+        return [parent] if 'vasprun.xml' in files else []
+
+    def get_task_doc(self, path):
+        if os.path.exists(os.path.join(path, 'BAD')):
+            return None
+        with open(os.path.join(path, 'vasprun.xml')) as f:
+            return {'dir_name': path, 'content': f.read()}
+
+
+class AssimilationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'measure')
+        for i in range(4):
+            job_dir = os.path.join(self.root, 'job_{}'.format(i))
+            os.makedirs(job_dir)
+            with open(os.path.join(job_dir, 'vasprun.xml'), 'w') as f:
+                f.write(str(i))
+        open(os.path.join(self.root, 'job_3', 'BAD'), 'w').close()
+        self.docs = os.path.join(self.tmp, 'docs.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read_docs(self):
+        with open(self.docs) as f:
+            return [json.loads(l) for l in f]
+
+    def test_incremental(self):
+        sink = FileSink(self.docs)
+        results = assimilate(self.root, FakeDrone(), sink=sink, nprocs=2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sorted(d['content'] for d in self.read_docs()),
+                         ['0', '1', '2'])
+        # nothing changed, only the failed job is parsed again
+        self.assertEqual(assimilate(self.root, FakeDrone(), sink=sink,
+                                    nprocs=1), [])
+        job_dir = os.path.join(self.root, 'job_1')
+        with open(os.path.join(job_dir, 'vasprun.xml'), 'w') as f:
+            f.write('updated')
+        os.remove(os.path.join(self.root, 'job_3', 'BAD'))
+        results = assimilate(self.root, FakeDrone(), sink=sink, nprocs=2)
+        self.assertEqual(sorted(results),
+                         [job_dir, os.path.join(self.root, 'job_3')])
+        self.assertEqual(len(self.read_docs()), 5)
+
+    @unittest.skipIf(mongomock is None, "mongomock not installed")
+    def test_collection(self):
+        collection = mongomock.MongoClient().db.tasks
+        sink = CollectionSink(collection)
+        self.assertEqual(len(assimilate(self.root, FakeDrone(), sink=sink,
+                                        nprocs=1)), 3)
+        job_dir = os.path.join(self.root, 'job_1')
+        with open(os.path.join(job_dir, 'vasprun.xml'), 'w') as f:
+            f.write('updated')
+        _id = collection.find_one({'dir_name': job_dir})['_id']
+        self.assertEqual(assimilate(self.root, FakeDrone(), sink=sink,
+                                    nprocs=1), [_id])
+        # the changed directory replaces its document
+        self.assertEqual(sorted(d['content'] for d in collection.find()),
+                         ['0', '2', 'updated'])
+
+
+if __name__ == '__main__':
+    unittest.main()
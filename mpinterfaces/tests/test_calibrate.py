@@ -0,0 +1,116 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from pymatgen.io.vasp.inputs import Incar, Kpoints, Poscar
+
+from mpinterfaces import calibrate
+from mpinterfaces.calibrate import Calibrate
+from mpinterfaces.instrument import MPINTVaspJob
+from mpinterfaces.tests import stub_potcar
+
+
+TEST_STEP1 = os.path.join(os.path.dirname(__file__), "..",
+                          "test_files", "Wflow_Step1")
+
+# energies per atom: ENCUT converged from 600 on, the KPOINTS from
+# 6x6x6 on at that ENCUT, the 4x4x4 job fails
+ENCUT_ENERGIES = {400: -1.0, 500: -1.05, 600: -1.1, 700: -1.1002,
+                  800: -1.1004, 900: -1.1005, 1000: -1.1006}
+KPOINTS_ENERGIES = {'2x2x2': -0.5, '4x4x4': None, '6x6x6': 0.0,
+                    '8x8x8': 0.0002, '10x10x10': 0.0004}
+
+
+class AdaptiveCalibrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        incar = Incar.from_file(os.path.join(TEST_STEP1, 'INCAR'))
+        kpoints = Kpoints.from_file(os.path.join(TEST_STEP1, 'KPOINTS'))
+        self.poscar = Poscar.from_file(os.path.join(TEST_STEP1, 'POSCAR'))
+        self.restore_potcar = stub_potcar(self.poscar.site_symbols)
+        self.cal = Calibrate(
+            incar, self.poscar, None, kpoints, lazy=True, Grid_type='M',
+            job_dir=os.path.join(self.tmp, 'Cal'),
+            turn_knobs={'ENCUT': sorted(ENCUT_ENERGIES, reverse=True),
+                        'KPOINTS': [[n, n, n] for n in (2, 4, 6, 8, 10)]})
+        self.submitted = []
+        self.polls = {}
+        self.cal.run = self.submit
+        self.get_final_energy = MPINTVaspJob.get_final_energy
+        MPINTVaspJob.get_final_energy = lambda job: self.final_energy(job)
+        self.get_job_state = calibrate.get_job_state
+        calibrate.get_job_state = self.job_state
+        self.get_queue_status = calibrate.get_queue_status
+        calibrate.get_queue_status = lambda: QueueStatus()
+
+    def tearDown(self):
+        MPINTVaspJob.get_final_energy = self.get_final_energy
+        calibrate.get_job_state = self.get_job_state
+        calibrate.get_queue_status = self.get_queue_status
+        self.restore_potcar()
+        shutil.rmtree(self.tmp)
+
+    def submit(self, job_cmd=None, write_workers=None):
+        for job in self.cal.jobs:
+            job.job_id = str(len(self.submitted))
+            self.submitted.append(
+                (job.vis.get_incar()['ENCUT'],
+                 os.path.basename(job.job_dir)))
+
+    def final_energy(self, job):
+        encut = job.vis.get_incar()['ENCUT']
+        name = os.path.basename(job.job_dir)
+        # each job is still running at the first check
+        self.polls[job.job_id] = self.polls.get(job.job_id, 0) + 1
+        if self.polls[job.job_id] == 1:
+            return None
+        natoms = sum(self.poscar.natoms)
+        if job.job_dir.split(os.sep)[-2] == 'ENCUT':
+            return ENCUT_ENERGIES[encut] * natoms
+        if KPOINTS_ENERGIES[name] is None:
+            return None
+        return (ENCUT_ENERGIES[encut] + KPOINTS_ENERGIES[name]) * natoms
+
+    def job_state(self, job, queue_status, refresh=True):
+        if self.polls[job.job_id] == 1:
+            return 'R', None
+        return 'F', None
+
+    def test_run_adaptive(self):
+        optimum = self.cal.run_adaptive(n_converged=2, wave_size=2,
+                                        interval=0)
+        self.assertEqual(list(optimum.items()),
+                         [('ENCUT', 600), ('KPOINTS', [6, 6, 6])])
+        # ENCUT in increasing order, stopped after the wave where it
+        # converged, then the KPOINTS at the converged ENCUT
+        self.assertEqual([s[1] for s in self.submitted],
+                         ['400', '500', '600', '700', '800', '900',
+                          '2x2x2', '4x4x4', '6x6x6', '8x8x8', '10x10x10'])
+        self.assertEqual(set(s[0] for s in self.submitted[6:]), set([600]))
+        self.assertEqual(self.cal.incar['ENCUT'], 600)
+
+    def test_wait_for_energies(self):
+        self.cal.set_incar('ENCUT', 600)
+        self.cal.setup_kpoints_jobs(kpoints_list=[[2, 2, 2], [4, 4, 4]])
+        self.cal.setup_incar_jobs('ENCUT', [500])
+        self.submit()
+        energies = self.cal.wait_for_energies(self.cal.jobs, interval=0)
+        natoms = sum(self.poscar.natoms)
+        self.assertAlmostEqual(energies[0] / natoms, -1.1 - 0.5)
+        # failed without an energy
+        self.assertIsNone(energies[1])
+        self.assertAlmostEqual(energies[2] / natoms, -1.05)
+        # polled until they finished
+        self.assertEqual(sorted(self.polls.values()), [2, 2, 2])
+
+
+class QueueStatus(object):
+
+    def refresh(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mpinterfaces.checkpoint import get_checkpoint, JSONCheckpoint, \
+    JSONLinesCheckpoint, SQLiteCheckpoint
+
+
+def get_entries(n):
+    return [{'job': {'job_dir': 'Job/ENCUT/{}'.format(400 + 100 * i)},
+             'job_id': 1000 + i, 'corrections': [], 'final_energy': None}
+            for i in range(n)]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_checkpoint(self):
+        self.assertIsInstance(get_checkpoint('calibrate.json'),
+                              JSONCheckpoint)
+        self.assertIsInstance(get_checkpoint('calibrate.jsonl'),
+                              JSONLinesCheckpoint)
+        self.assertIsInstance(
+            get_checkpoint(os.path.join(self.tmp, 'calibrate.db')),
+            SQLiteCheckpoint)
+
+    def test_backends(self):
+        for ext in ['json', 'jsonl', 'db']:
+            store = get_checkpoint(
+                os.path.join(self.tmp, 'calibrate.' + ext))
+            store.write(get_entries(3))
+            store.update({'Job/ENCUT/500': {'final_energy': -5.5,
+                                            'output_stat': [1.0, 10]}})
+            entries = store.load()
+            self.assertEqual([e['job_id'] for e in entries],
+                             [1000, 1001, 1002])
+            self.assertEqual(entries[1]['final_energy'], -5.5)
+            self.assertIsNone(entries[0]['final_energy'])
+            self.assertEqual(store.get(job_id=1002)['job']['job_dir'],
+                             'Job/ENCUT/600')
+            self.assertEqual(
+                store.get(job_dir='Job/ENCUT/500')['output_stat'], [1.0, 10])
+            self.assertIsNone(store.get(job_dir='Job/ENCUT/900'))
+
+
+if __name__ == '__main__':
+    unittest.main()
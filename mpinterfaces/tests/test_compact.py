@@ -0,0 +1,68 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from pymatgen.io.vasp.inputs import Incar, Kpoints, Poscar
+
+from mpinterfaces.compact import BlobStore, get_job_delta, job_from_delta
+from mpinterfaces.instrument import MPINTLazyVaspInputSet, MPINTVaspJob
+from mpinterfaces.tests import stub_potcar
+
+
+TEST_STEP1 = os.path.join(os.path.dirname(__file__), "..",
+                          "test_files", "Wflow_Step1")
+
+
+class CompactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = BlobStore(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_blob_store(self):
+        key = self.store.put({'b': [1, 2], 'a': 'x'})
+        self.assertEqual(self.store.put({'a': 'x', 'b': [1, 2]}), key)
+        self.assertEqual(self.store.get(key), {'a': 'x', 'b': [1, 2]})
+        self.assertEqual(len(os.listdir(self.tmp)), 1)
+
+    def test_job_delta(self):
+        incar = Incar.from_file(os.path.join(TEST_STEP1, 'INCAR'))
+        kpoints = Kpoints.from_file(os.path.join(TEST_STEP1, 'KPOINTS'))
+        poscar = Poscar.from_file(os.path.join(TEST_STEP1, 'POSCAR'))
+        base = incar.as_dict()
+        vis = MPINTLazyVaspInputSet('Test', base, {'ENCUT': 650}, poscar,
+                                    kpoints, test=True)
+        job = MPINTVaspJob(['ls'], name='Test', job_dir='ENCUT/650',
+                           vis=vis)
+        d = get_job_delta(job, base, self.store)
+        self.assertEqual(d['incar'], {'ENCUT': 650})
+        self.assertIn('blob', d['poscar'])
+        new_job = job_from_delta(d, base, self.store)
+        self.assertEqual(new_job.job_dir, 'ENCUT/650')
+        self.assertEqual(new_job.vis.get_incar()['ENCUT'], 650)
+        self.assertEqual(str(new_job.vis.poscar), str(poscar))
+
+    def test_compact_reuse_calibrate(self):
+        from mpinterfaces.calibrate import Calibrate
+        incar = Incar.from_file(os.path.join(TEST_STEP1, 'INCAR'))
+        kpoints = Kpoints.from_file(os.path.join(TEST_STEP1, 'KPOINTS'))
+        poscar = Poscar.from_file(os.path.join(TEST_STEP1, 'POSCAR'))
+        self.addCleanup(stub_potcar(poscar.site_symbols))
+        # reuse mode, the POSCAR knob lists the directories reused
+        reuse_dirs = [os.path.join(self.tmp, 'relax', 'Al'),
+                      os.path.join(self.tmp, 'relax', 'Si')]
+        cal = Calibrate(incar, poscar, None, kpoints, reuse=['CONTCAR'],
+                        turn_knobs={'POSCAR': reuse_dirs})
+        d = cal.as_dict(compact=True, blob_store=self.tmp)
+        self.assertEqual(d['turn_knobs']['POSCAR'], reuse_dirs)
+        new_cal = Calibrate.from_dict(d)
+        self.assertEqual(new_cal.turn_knobs['POSCAR'], reuse_dirs)
+        self.assertEqual(str(new_cal.poscar), str(poscar))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mpinterfaces.data_processor import probe_vasp_run, extract_final_energy
+
+MAT2D_TESTS = os.path.join(os.path.dirname(__file__), "..", "mat2d",
+                           "electronic_structure", "tests")
+
+FULL_KEYS = ['alphaZ', 'ewald', 'hartreedc', 'XCdc', 'pawpsdc', 'pawaedc',
+             'eentropy', 'bandstr', 'atom', 'e_fr_energy', 'e_wo_entrp',
+             'e_0_energy']
+LEPSILON_KEYS = ['e_fr_energy', 'e_wo_entrp', 'e_0_energy']
+
+
+def get_vasprun(steps, nelm, lepsilon):
+    """
+    minimal vasprun.xml with one ionic step and the given electronic
+    steps, each a list of energy names
+    """
+    scsteps = ''
+    for keys in steps:
+        scsteps += '   <scstep>\n    <time name="dav"> 0.1 0.1</time>\n' \
+                   '    <energy>\n'
+        scsteps += ''.join('     <i name="{}"> -1.0 </i>\n'.format(k)
+                           for k in keys)
+        scsteps += '    </energy>\n   </scstep>\n'
+    return '<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n' \
+           ' <incar>\n  <i type="logical" name="LEPSILON"> {} </i>\n' \
+           ' </incar>\n <parameters>\n' \
+           '  <i type="int" name="NELM"> {} </i>\n' \
+           '  <i type="int" name="NSW"> 0 </i>\n </parameters>\n' \
+           ' <calculation>\n{}   <structure>\n   </structure>\n' \
+           '   <energy>\n    <i name="e_wo_entrp"> -5.5 </i>\n' \
+           '   </energy>\n </calculation>\n</modeling>\n'.format(
+               'T' if lepsilon else 'F', nelm, scsteps)
+
+
+class ProbeVaspRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_relaxation(self):
+        shutil.copy(os.path.join(MAT2D_TESTS, 'MoS2', 'vasprun.xml'),
+                    self.tmp)
+        vasprun = os.path.join(self.tmp, 'vasprun.xml')
+        probe = probe_vasp_run(self.tmp)
+        self.assertEqual(probe, extract_final_energy(vasprun))
+        self.assertTrue(probe['converged'])
+        # the ionic steps read from the OUTCAR instead of counted
+        job_dir = os.path.join(self.tmp, 'outcar')
+        os.mkdir(job_dir)
+        shutil.copy(vasprun, job_dir)
+        with open(os.path.join(job_dir, 'OUTCAR'), 'w') as f:
+            f.write('--- Iteration   50(  12)  ---\n')
+        self.assertFalse(probe_vasp_run(job_dir)['converged_ionic'])
+
+    def test_lepsilon(self):
+        # 6 electronic steps with NELM = 4, of which the linear response
+        # steps only have the three energies
+        steps = [FULL_KEYS] + [LEPSILON_KEYS] * 3 + [FULL_KEYS] * 2
+        for lepsilon in (True, False):
+            with open(os.path.join(self.tmp, 'vasprun.xml'), 'w') as f:
+                f.write(get_vasprun(steps, 4, lepsilon))
+            os.utime(os.path.join(self.tmp, 'vasprun.xml'),
+                     (lepsilon, lepsilon))
+            probe = probe_vasp_run(self.tmp)
+            self.assertEqual(probe, extract_final_energy(probe['source']))
+            self.assertEqual(probe['converged_electronic'], lepsilon)
+            self.assertEqual(probe['final_energy'], -5.5)
+
+    def test_truncated(self):
+        with open(os.path.join(MAT2D_TESTS, 'MoS2', 'vasprun.xml')) as f:
+            text = f.read()
+        with open(os.path.join(self.tmp, 'vasprun.xml'), 'w') as f:
+            f.write(text[:len(text) // 2])
+        probe = probe_vasp_run(self.tmp)
+        self.assertFalse(probe['converged'])
+        self.assertFalse(probe['converged_electronic'])
+
+    def test_outcar(self):
+        self.assertIsNone(probe_vasp_run(self.tmp))
+        shutil.copy(os.path.join(MAT2D_TESTS, 'band_structure_control',
+                                 'OUTCAR'), self.tmp)
+        probe = probe_vasp_run(self.tmp)
+        self.assertEqual(probe['source'],
+                         os.path.abspath(os.path.join(self.tmp, 'OUTCAR')))
+        self.assertTrue(probe['converged'])
+        self.assertIsNotNone(probe['final_energy'])
+
+    def test_cache(self):
+        vasprun = os.path.join(self.tmp, 'vasprun.xml')
+        with open(vasprun, 'w') as f:
+            f.write(get_vasprun([FULL_KEYS], 60, False))
+        probe = probe_vasp_run(self.tmp)
+        self.assertIs(probe_vasp_run(self.tmp), probe)
+        # rewritten by a rerun
+        with open(vasprun, 'w') as f:
+            f.write(get_vasprun([FULL_KEYS] * 60, 60, False))
+        self.assertFalse(probe_vasp_run(self.tmp)['converged'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import json
+import zlib
+
+try:
+    import mongomock
+    import mongomock.gridfs
+    mongomock.gridfs.enable_gridfs_integration()
+except ImportError:
+    mongomock = None
+
+import gridfs
+
+from mpinterfaces.database import BulkTaskWriter
+
+
+def get_doc(i, dos=None):
+    d = {'dir_name': 'host:/measure/job_{}'.format(i), 'state': 'successful',
+         'calculations': [{'output': {'final_energy': -1.0 * i}}]}
+    if dos is not None:
+        d['calculations'][0]['dos'] = dos
+    return d
+
+
+@unittest.skipIf(mongomock is None, "mongomock not installed")
+class BulkTaskWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+
+    def test_batches(self):
+        writer = BulkTaskWriter(self.db, 'tasks', batch_size=3,
+                                flush_interval=3600)
+        for i in range(4):
+            writer.add(get_doc(i))
+        # the first batch is written, the last document is buffered
+        self.assertEqual(self.db.tasks.count_documents({}), 3)
+        self.assertEqual(writer.close(), [4])
+        self.assertEqual(sorted(d['task_id'] for d in self.db.tasks.find()),
+                         [1, 2, 3, 4])
+        # duplicates are updated in place, keeping their task id
+        writer = BulkTaskWriter(self.db, 'tasks', batch_size=10,
+                                flush_interval=3600)
+        d = get_doc(1)
+        d['state'] = 'error'
+        writer.add(d)
+        writer.add(get_doc(5))
+        self.assertEqual(sorted(writer.close()), [2, 5])
+        self.assertEqual(self.db.tasks.count_documents({}), 5)
+        self.assertEqual(self.db.tasks.find_one(
+            {'dir_name': d['dir_name']})['state'], 'error')
+
+    def test_dos(self):
+        writer = BulkTaskWriter(self.db, 'tasks', batch_size=2,
+                                flush_interval=3600, parse_dos=True,
+                                compress_dos=6)
+        dos = {'energies': [0.0, 0.1], 'densities': [1.0, 2.0]}
+        writer.add(get_doc(0, dos))
+        writer.add(get_doc(1, dos))
+        writer.close()
+        calc = self.db.tasks.find_one()['calculations'][0]
+        self.assertNotIn('dos', calc)
+        self.assertEqual(calc['dos_compression'], 'zlib')
+        blob = gridfs.GridFS(self.db, 'dos_fs').get(calc['dos_fs_id']).read()
+        self.assertEqual(json.loads(zlib.decompress(blob).decode()), dos)
+
+    def test_skipped_dos(self):
+        writer = BulkTaskWriter(self.db, 'tasks', batch_size=10,
+                                flush_interval=3600, parse_dos=True,
+                                update_duplicates=False)
+        dos = {'energies': [0.0], 'densities': [1.0]}
+        writer.add(get_doc(0, dos))
+        writer.add(get_doc(1, dos))
+        # replaced in the buffer
+        writer.add(get_doc(1, dos))
+        self.assertEqual(writer.flush(), [1, 2])
+        # already in the database, not uploaded
+        writer.add(get_doc(0, dos))
+        self.assertEqual(writer.buffer, [])
+        # written by another writer while buffered
+        writer.add(get_doc(2, dos))
+        other = BulkTaskWriter(self.db, 'tasks')
+        other.add(get_doc(2))
+        other.close()
+        self.assertEqual(writer.close(), [])
+        # no dos left without a document
+        self.assertEqual(
+            sorted(f['_id'] for f in self.db['dos_fs.files'].find()),
+            sorted(d['calculations'][0]['dos_fs_id']
+                   for d in self.db.tasks.find({'task_id': {'$lt': 3}})))
+
+    def test_failed_flush(self):
+        writer = BulkTaskWriter(self.db, 'tasks', batch_size=10,
+                                flush_interval=3600, parse_dos=True)
+        writer.add(get_doc(0, {'energies': [0.0]}))
+        writer.add(get_doc(1))
+        insert_many = writer.collection.insert_many
+        writer.collection.insert_many = FailingInsert()
+        self.assertRaises(IOError, writer.flush)
+        self.assertEqual(len(writer.buffer), 2)
+        writer.collection.insert_many = insert_many
+        self.assertEqual(writer.close(), [1, 2])
+        self.assertEqual(self.db.tasks.count_documents({}), 2)
+        calc = self.db.tasks.find_one({'task_id': 1})['calculations'][0]
+        self.assertTrue(gridfs.GridFS(self.db, 'dos_fs').exists(
+            calc['dos_fs_id']))
+
+
+class FailingInsert(object):
+
+    def __call__(self, docs, ordered=True):
+        raise IOError("connection lost")
+
+
+if __name__ == '__main__':
+    unittest.main()
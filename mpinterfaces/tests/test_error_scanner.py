@@ -0,0 +1,140 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mpinterfaces.error_scanner import ErrorScanner
+from mpinterfaces.instrument import MPINTVaspErrors
+
+
+class ErrorScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.outcar = os.path.join(self.tmp, 'OUTCAR')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, text, mode='a'):
+        with open(self.outcar, mode) as f:
+            f.write(text)
+
+    def test_incremental_scan(self):
+        scanner = ErrorScanner(chunk_size=16)
+        self.assertEqual(scanner.scan(self.tmp), [])
+        self.write(' running on 4 total cores\n WARNING: Sub-Space-')
+        self.assertEqual(scanner.scan(self.tmp), [])
+        # the message completed by the next write, across the chunks
+        self.write('Matrix is not hermitian in DAV\n')
+        events = scanner.scan(self.tmp)
+        self.assertEqual([e['error'] for e in events], ['subspacematrix'])
+        self.assertEqual(events[0]['offset'], 26)
+        self.write(' WARNING: Sub-Space-Matrix is not hermitian in DAV\n'
+                   ' ZBRENT: fatal error in bracketing\n')
+        self.assertEqual([e['error'] for e in scanner.scan(self.tmp)],
+                         ['zbrent'])
+        # rewritten by a rerun
+        self.write(' Routine TETIRR needs special values\n', mode='w')
+        self.assertEqual(sorted(e['error'] for e in scanner.scan(self.tmp)),
+                         ['tet', 'tetirr'])
+        state = ErrorScanner.from_dict(scanner.as_dict())
+        self.assertEqual(state.scan(self.tmp), [])
+
+    def test_walltime_flag(self):
+        scanner = ErrorScanner()
+        with open(os.path.join(self.tmp, 'job.out'), 'w') as f:
+            f.write('slurmstepd: *** JOB 42 CANCELLED AT 2017-03-03T10:00:00 '
+                    'DUE TO TIME LIMIT ***\n')
+        # seen while the job was still reported running
+        self.assertEqual(len(scanner.scan(self.tmp, ['job.out'])), 1)
+        self.assertEqual(scanner.scan(self.tmp, ['job.out']), [])
+        self.assertEqual(scanner.get_errors(self.tmp, ['job.out', 'OUTCAR']),
+                         set(['walltime']))
+        scanner.reset(self.tmp)
+        self.assertEqual(scanner.get_errors(self.tmp, ['job.out']), set())
+
+    def test_walltime_handler(self):
+        handler = MPINTVaspErrors(os.path.join(self.tmp, 'job.out'))
+        # warnings and errors without a correction dont fail the check
+        self.write(' WARNING: Sub-Space-Matrix is not hermitian in DAV\n'
+                   ' ZBRENT: fatal error in bracketing\n')
+        open(os.path.join(self.tmp, 'job.out'), 'w').close()
+        self.assertFalse(handler.check())
+        self.assertEqual(len(handler.events), 2)
+        with open(os.path.join(self.tmp, 'job.out'), 'w') as f:
+            f.write('slurmstepd: *** JOB 42 CANCELLED AT 2017-03-03T10:00:00 '
+                    'DUE TO TIME LIMIT ***\n')
+        with open(os.path.join(self.tmp, 'CONTCAR'), 'w') as f:
+            f.write('Al\n')
+        self.assertTrue(handler.check())
+        d = handler.correct()
+        self.assertEqual(d['errors'], ['walltime'])
+        self.assertEqual(len(d['actions']), 1)
+        with open(os.path.join(self.tmp, 'POSCAR')) as f:
+            self.assertEqual(f.read(), 'Al\n')
+        # nothing new, nothing to correct
+        self.assertFalse(handler.check())
+        self.assertEqual(handler.correct()['actions'], [])
+
+    def test_daemon_walltime_rerun(self):
+        from mpinterfaces import utils
+        job = DaemonJob(self.tmp)
+        out = os.path.join(self.tmp, 'vasp_job-42.out')
+        updates = []
+
+        def update_checkpoint(job_ids=None, jfile=None):
+            updates.append(list(job_ids))
+            if job.job_id in job_ids:
+                job.states = ['R', 'done']
+
+        def get_job_state(j, queue_status):
+            state = j.states.pop(0)
+            if state == 'R':
+                with open(out, 'w') as f:
+                    f.write('slurmstepd: *** JOB 42 CANCELLED AT '
+                            '2017-03-03T10:00:00 DUE TO TIME LIMIT ***\n')
+            elif state == 'done':
+                j.final_energy = -1.0
+            return state, 'vasp_job-42.out'
+
+        patched = {'update_checkpoint': update_checkpoint,
+                   'update_pack_status': lambda jfile: None,
+                   'jobs_from_file': lambda jfile: [job],
+                   'get_job_state': get_job_state}
+        saved = dict((k, getattr(utils, k)) for k in patched)
+        sleep = utils.time.sleep
+        for k, v in patched.items():
+            setattr(utils, k, v)
+        utils.time.sleep = lambda seconds: None
+        try:
+            step = lambda checkpoint_files=None: ['calibrate.json']
+            utils.launch_daemon([step], 0, queue_status=QueueStatus())
+        finally:
+            for k, v in saved.items():
+                setattr(utils, k, v)
+            utils.time.sleep = sleep
+        # the walltime seen while running is rerun at the cycle after
+        # the one where the job failed
+        self.assertEqual(updates, [[], [], [], ['42'], []])
+
+
+class DaemonJob(object):
+
+    def __init__(self, job_dir):
+        self.job_id = '42'
+        self.parent_job_dir = job_dir
+        self.job_dir = '.'
+        self.final_energy = None
+        self.pack_status = None
+        self.states = ['R', 'CD', 'F']
+
+
+class QueueStatus(object):
+
+    def refresh(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,9 @@ from __future__ import unicode_literals
 import unittest
 
 import os
+import shutil
+import tempfile
+import subprocess
 
 import json
 
@@ -38,6 +41,163 @@ class TestInstrument(unittest.TestCase):
         self.assertCountEqual(os.listdir(TEST_STEP2), ['INCAR','KPOINTS','POSCAR','COPY_FILE'])
         cleanup = [os.remove(TEST_STEP2+os.sep+f) for f in os.listdir(TEST_STEP2)]
 
+    def test_lazy_inputset(self):
+        incar = Incar.from_file(TEST_STEP1+os.sep+'INCAR')
+        kpoints = Kpoints.from_file(TEST_STEP1+os.sep+'KPOINTS')
+        poscar = Poscar.from_file(TEST_STEP1+os.sep+'POSCAR')
+        base = incar.as_dict()
+        removed = list(incar.keys())[0]
+        lvis = MPINTLazyVaspInputSet('Test', base, {'ENCUT': 600}, poscar,
+                                     kpoints, test=True,
+                                     incar_removed=[removed])
+        self.assertEqual(base, incar.as_dict())
+        lvis.write_input(job_dir=TEST_STEP2)
+        written = Incar.from_file(TEST_STEP2+os.sep+'INCAR')
+        self.assertEqual(written['ENCUT'], 600)
+        self.assertNotIn(removed, written)
+        self.assertCountEqual(os.listdir(TEST_STEP2), ['INCAR','KPOINTS','POSCAR'])
+        for f in os.listdir(TEST_STEP2):
+            os.remove(TEST_STEP2+os.sep+f)
+
+    def test_shared_inputs(self):
+        incar = Incar.from_file(TEST_STEP1+os.sep+'INCAR')
+        kpoints = Kpoints.from_file(TEST_STEP1+os.sep+'KPOINTS')
+        poscar = Poscar.from_file(TEST_STEP1+os.sep+'POSCAR')
+        vis = MPINTVaspInputSet('Test', incar, poscar, kpoints, test=True)
+        self.assertIs(vis.poscar_init, poscar)
+        self.assertIs(vis.kpoints_init, kpoints)
+        # the calibration updates its incar in place
+        encut = incar['ENCUT']
+        incar['ENCUT'] = encut + 100
+        vis.write_input(job_dir=TEST_STEP2)
+        self.assertEqual(Incar.from_file(TEST_STEP2+os.sep+'INCAR')['ENCUT'],
+                         encut)
+        shutil.rmtree(TEST_STEP2)
+
+    def test_lazy_dictset(self):
+        incar = Incar.from_file(TEST_STEP1+os.sep+'INCAR')
+        kpoints = Kpoints.from_file(TEST_STEP1+os.sep+'KPOINTS')
+        poscar = Poscar.from_file(TEST_STEP1+os.sep+'POSCAR')
+        vis = MPINTVaspInputSet('Test', incar, poscar, kpoints, test=True)
+        # unknown attributes dont initialize the DictSet
+        self.assertFalse(hasattr(vis, 'no_such_attribute'))
+        self.assertNotIn('_dictset_init', vis.__dict__)
+        self.assertEqual(vis.structure, poscar.structure)
+        self.assertEqual(vis.config_dict['INCAR'], incar.as_dict())
+
+    def test_write_job_inputs(self):
+        incar = Incar.from_file(TEST_STEP1+os.sep+'INCAR')
+        kpoints = Kpoints.from_file(TEST_STEP1+os.sep+'KPOINTS')
+        poscar = Poscar.from_file(TEST_STEP1+os.sep+'POSCAR')
+        jobs = []
+        for encut in [400, 500, 600]:
+            vis = MPINTLazyVaspInputSet('Test', incar.as_dict(),
+                                        {'ENCUT': encut}, poscar, kpoints,
+                                        test=True)
+            job_dir = os.path.join(TEST_STEP2, str(encut))
+            jobs.append(MPINTVaspJob(['ls'], job_dir=job_dir, vis=vis))
+        if not os.path.exists(TEST_STEP2):
+            os.makedirs(TEST_STEP2)
+        # job directory below a file, cannot be created
+        open(os.path.join(TEST_STEP2, 'dummy'), 'w').close()
+        jobs.append(MPINTVaspJob(['ls'], vis=jobs[0].vis,
+                                 job_dir=os.path.join(TEST_STEP2, 'dummy',
+                                                      '700')))
+        errors = write_job_inputs(jobs, max_workers=2)
+        self.assertEqual(list(errors.keys()), [jobs[-1].job_dir])
+        self.assertEqual([j.inputs_written for j in jobs],
+                         [True, True, True, False])
+        self.assertEqual(
+            Incar.from_file(os.path.join(TEST_STEP2, '500', 'INCAR'))['ENCUT'],
+            500)
+        shutil.rmtree(TEST_STEP2)
+
+    def test_submit_jobs(self):
+        incar = Incar.from_file(TEST_STEP1+os.sep+'INCAR')
+        kpoints = Kpoints.from_file(TEST_STEP1+os.sep+'KPOINTS')
+        poscar = Poscar.from_file(TEST_STEP1+os.sep+'POSCAR')
+        cwd = os.getcwd()
+        jobs = []
+        for encut in [400, 500, 600]:
+            vis = MPINTLazyVaspInputSet('Test', incar.as_dict(),
+                                        {'ENCUT': encut}, poscar, kpoints,
+                                        test=True)
+            job_dir = os.path.join(TEST_STEP2, str(encut))
+            jobs.append(MPINTVaspJob(['ls'], job_dir=job_dir, vis=vis))
+        errors = submit_jobs(jobs, max_workers=2)
+        self.assertFalse(errors)
+        self.assertEqual(os.getcwd(), cwd)
+        with open(os.path.join(TEST_STEP2, '500', 'job.out')) as f:
+            self.assertIn('INCAR', f.read())
+        shutil.rmtree(TEST_STEP2)
+
+    def test_submit_job_array(self):
+        from fireworks.user_objects.queue_adapters.common_adapter import \
+            CommonAdapter
+        incar = Incar.from_file(TEST_STEP1+os.sep+'INCAR')
+        kpoints = Kpoints.from_file(TEST_STEP1+os.sep+'KPOINTS')
+        poscar = Poscar.from_file(TEST_STEP1+os.sep+'POSCAR')
+        qadapter = CommonAdapter('SLURM', job_name='Test', rocket_launch='ls')
+        jobs = []
+        for encut in [400, 500, 600]:
+            vis = MPINTLazyVaspInputSet('Test', incar.as_dict(),
+                                        {'ENCUT': encut}, poscar, kpoints,
+                                        qadapter=qadapter, test=True)
+            job_dir = os.path.join(TEST_STEP2, str(encut))
+            jobs.append(MPINTVaspJob(['ls'], job_dir=job_dir, vis=vis))
+        # fake sbatch
+        stub_dir = tempfile.mkdtemp()
+        with open(os.path.join(stub_dir, 'sbatch'), 'w') as f:
+            f.write('#!/bin/sh\necho "Submitted batch job 4242"\n')
+        os.chmod(os.path.join(stub_dir, 'sbatch'), 0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = stub_dir + os.pathsep + path
+        try:
+            array_id = submit_job_array(jobs, launch_dir=stub_dir,
+                                        max_running=2)
+        finally:
+            os.environ['PATH'] = path
+        self.assertEqual(array_id, '4242')
+        self.assertEqual([j.job_id for j in jobs],
+                         ['4242_0', '4242_1', '4242_2'])
+        script = os.path.join(stub_dir, 'array_script')
+        with open(script) as f:
+            self.assertIn('#SBATCH --array=0-2%2', f.read())
+        # run the second array task
+        env = dict(os.environ, SLURM_ARRAY_JOB_ID='4242',
+                   SLURM_ARRAY_TASK_ID='1')
+        subprocess.check_call(['bash', script], env=env)
+        with open(os.path.join(TEST_STEP2, '500',
+                               'vasp_job-4242_1.out')) as f:
+            self.assertIn('INCAR', f.read())
+        shutil.rmtree(stub_dir)
+        shutil.rmtree(TEST_STEP2)
+
+    def test_get_final_energy(self):
+        from pymatgen.io.vasp.outputs import Vasprun
+        job_dir = os.path.join(os.path.dirname(__file__), "..", "mat2d",
+                               "electronic_structure", "tests", "MoS2")
+        job = MPINTVaspJob(['ls'], job_dir=job_dir)
+        vasprun = Vasprun(job_dir+os.sep+'vasprun.xml',
+                          parse_potcar_file=False)
+        self.assertTrue(vasprun.converged)
+        self.assertAlmostEqual(job.get_final_energy(),
+                               vasprun.ionic_steps[-1]['e_wo_entrp'])
+        job.job_dir = TEST_STEP1
+        self.assertIsNone(job.get_final_energy())
+
+    def test_potcar_cache(self):
+        from mpinterfaces import instrument
+        calls = []
+        factory = lambda: calls.append(1) or object()
+        potcar = instrument._cached_potcar(('test', 'Al'), factory)
+        self.assertIs(instrument._cached_potcar(('test', 'Al'), factory),
+                      potcar)
+        self.assertEqual(len(calls), 1)
+        for i in range(instrument._POTCAR_CACHE_SIZE):
+            instrument._cached_potcar(('test', i), factory)
+        self.assertNotIn(('test', 'Al'), instrument._POTCAR_CACHE)
+
 if __name__ == '__main__':
     TI = TestInstrument()
     TI.test_write_inputset()
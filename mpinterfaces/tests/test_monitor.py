@@ -0,0 +1,168 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mpinterfaces import monitor, utils
+from mpinterfaces.monitor import WorkflowMonitor
+from mpinterfaces.utils import QueueStatus
+
+
+class FakeJob(object):
+
+    def __init__(self, job_id, states):
+        self.job_id = job_id
+        self.job_dir = job_id
+        self.parent_job_dir = '/scratch'
+        self.final_energy = None
+        self.pack_status = None
+        # queue states of the successive checks, None once finished
+        self.states = list(states)
+
+
+class FakeQueueStatus(object):
+
+    def is_stale(self):
+        return False
+
+
+class WorkflowMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = {'a1': [FakeJob('a1', ['R'])],
+                     'a2': [FakeJob('a2', ['PD', 'R'])],
+                     'b': [FakeJob('b', ['F'])]}
+        self.updates = []
+        self.checked = []
+        self.polls = []
+        self.steps = []
+        # job_dir: pack status of the packed jobs of each checkpoint file
+        self.pack_statuses = {}
+        self.patched = {}
+        for name in ('update_checkpoint', 'jobs_from_file', 'get_job_state',
+                     'check_job_errors', 'update_pack_status'):
+            self.patched[name] = getattr(monitor, name)
+            setattr(monitor, name, getattr(self, name))
+
+    def tearDown(self):
+        for name, func in self.patched.items():
+            setattr(monitor, name, func)
+
+    def update_checkpoint(self, job_ids=None, jfile=None):
+        self.updates.append((jfile, job_ids))
+        for j in self.jobs[jfile]:
+            if j.pack_status and j.job_dir in job_ids:
+                # resubmitted on its own, and done
+                self.pack_statuses[jfile].pop(j.job_dir)
+                j.pack_status = None
+                j.final_energy = -1.0
+            elif j.job_id in job_ids:
+                # resubmitted
+                j.states = ['R']
+
+    def update_pack_status(self, jfile):
+        for j in self.jobs[jfile]:
+            j.pack_status = self.pack_statuses.get(jfile, {}).get(j.job_dir)
+
+    def jobs_from_file(self, jfile):
+        return self.jobs[jfile]
+
+    def get_job_state(self, job, queue_status, refresh=True):
+        if not job.states:
+            job.final_energy = -1.0
+            return '00', None
+        return job.states.pop(0), 'job.out'
+
+    def packed_job_state(self, job, queue_status, refresh=True):
+        # the allocation runs until the jobs are done
+        self.polls.append(job.job_dir)
+        if self.polls.count(job.job_dir) > 5:
+            raise RuntimeError('job {} never done'.format(job.job_dir))
+        return utils.get_job_state(job, queue_status, refresh=refresh)
+
+    def check_job_errors(self, job_dir, ofname, handlers):
+        self.checked.append(job_dir)
+        # the job died before writing its stdout file
+        return None
+
+    def step(self, name):
+        def step(checkpoint_files=None):
+            self.steps.append((name, checkpoint_files))
+            return [name]
+        step.__name__ = name
+        return step
+
+    def test_chains(self):
+        chains = [[self.step('a1'), self.step('a2')], [self.step('b')]]
+        mon = WorkflowMonitor(chains, interval=0, handlers=['handler'],
+                              max_workers=2,
+                              queue_status=FakeQueueStatus())
+        self.assertEqual(mon.run(), [['a2'], ['b']])
+        # each step gets the checkpoint files of the previous one
+        self.assertIn(('a2', ['a1']), self.steps)
+        self.assertIn(('b', None), self.steps)
+        # the failed job is checked and rerun
+        self.assertEqual(self.checked, ['/scratch/b'])
+        self.assertIn(('b', ['b']), self.updates)
+        self.assertEqual([u for u in self.updates if u[0] == 'a2'],
+                         [('a2', [])] * 3)
+
+    def test_packed_jobs(self):
+        # both jobs packed in the running allocation 7, one finished
+        # and one failed
+        done, failed = FakeJob('7', []), FakeJob('7', [])
+        done.job_dir, failed.job_dir = 'p1', 'p2'
+        done.final_energy = -1.0
+        self.jobs = {'p': [done, failed]}
+        self.pack_statuses = {'p': {'p1': {'state': 'D'},
+                                    'p2': {'state': 'F'}}}
+        monitor.get_job_state = self.packed_job_state
+        queue_status = QueueStatus(queue_system='slurm', user='me',
+                                   ttl=3600)
+        queue_status.update('7 R\n')
+        mon = WorkflowMonitor([[self.step('p')]], interval=0,
+                              handlers=['handler'],
+                              queue_status=queue_status)
+        self.assertEqual(mon.run(), [['p']])
+        # only the failed job is rerun, by its job directory
+        self.assertEqual(self.checked, ['/scratch/p2'])
+        self.assertEqual(self.updates, [('p', []), ('p', ['p2'])])
+
+    def test_queue_query(self):
+        tmp = tempfile.mkdtemp()
+        path = os.environ['PATH']
+        try:
+            squeue = os.path.join(tmp, 'squeue')
+            with open(squeue, 'w') as f:
+                f.write('#!/bin/sh\necho "$@" > {}\n'
+                        'echo "42 R"\necho "43_1 PD"\n'
+                        .format(os.path.join(tmp, 'args')))
+            os.chmod(squeue, 0o755)
+            os.environ['PATH'] = tmp + os.pathsep + path
+            queue_status = QueueStatus(queue_system='slurm', user='me',
+                                       ttl=3600)
+            mon = WorkflowMonitor([[self.step('a1')]], interval=0,
+                                  queue_status=queue_status)
+            self.assertEqual(mon.run(), [['a1']])
+            self.assertTrue(queue_status.valid)
+            self.assertEqual(queue_status.states, {'42': 'R', '43_1': 'PD'})
+            with open(os.path.join(tmp, 'args')) as f:
+                self.assertEqual(f.read().split(),
+                                 ['-h', '-r', '-o', '%i', '%t', '-u', 'me'])
+            # a failing query leaves the states unknown
+            with open(squeue, 'w') as f:
+                f.write('#!/bin/sh\nexit 1\n')
+            queue_status.timestamp = None
+            mon = WorkflowMonitor([[self.step('a2')]], interval=0,
+                                  queue_status=queue_status)
+            self.assertEqual(mon.run(), [['a2']])
+            self.assertFalse(queue_status.valid)
+            self.assertEqual(queue_status.get_state('42', refresh=False),
+                             QueueStatus.UNKNOWN)
+        finally:
+            os.environ['PATH'] = path
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
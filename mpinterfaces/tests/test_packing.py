@@ -0,0 +1,87 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from pymatgen.io.vasp.inputs import Incar, Kpoints, Poscar
+
+from mpinterfaces.instrument import MPINTLazyVaspInputSet, MPINTVaspJob
+from mpinterfaces.checkpoint import get_checkpoint
+from mpinterfaces.packing import submit_packed_jobs, get_pack_status, \
+    update_pack_status, get_packed_job_state
+from mpinterfaces.utils import QueueStatus, get_job_state, get_rerun_key
+
+
+TEST_STEP1 = os.path.join(os.path.dirname(__file__), "..",
+                          "test_files", "Wflow_Step1")
+
+
+class PackingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # fake mpirun, fails in the job directories with a FAIL file
+        self.path = os.environ['PATH']
+        with open(os.path.join(self.tmp, 'mpirun'), 'w') as f:
+            f.write('#!/bin/sh\necho "mpirun $@"\n'
+                    '[ ! -e FAIL ]\n')
+        os.chmod(os.path.join(self.tmp, 'mpirun'), 0o755)
+        os.environ['PATH'] = self.tmp + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tmp)
+
+    def test_packed_jobs(self):
+        incar = Incar.from_file(os.path.join(TEST_STEP1, 'INCAR'))
+        kpoints = Kpoints.from_file(os.path.join(TEST_STEP1, 'KPOINTS'))
+        poscar = Poscar.from_file(os.path.join(TEST_STEP1, 'POSCAR'))
+        jobs = []
+        for encut in [400, 500, 600]:
+            vis = MPINTLazyVaspInputSet('Test', incar.as_dict(),
+                                        {'ENCUT': encut}, poscar, kpoints,
+                                        test=True)
+            job_dir = os.path.join(self.tmp, str(encut))
+            jobs.append(MPINTVaspJob(['mpirun', '-np', '2', 'vasp'],
+                                     job_dir=job_dir, vis=vis))
+        jobs[1].write_inputs()
+        jobs[1].inputs_written = True
+        open(os.path.join(self.tmp, '500', 'FAIL'), 'w').close()
+        job_id = submit_packed_jobs(jobs, n_groups=2, launch_dir=self.tmp)
+        self.assertEqual(job_id, 0)
+        with open(os.path.join(self.tmp, '600', 'job.out')) as f:
+            self.assertEqual(f.read().strip(), 'mpirun -np 2 vasp')
+        self.assertEqual(get_pack_status(jobs[0].job_dir)['state'], 'D')
+        self.assertEqual(get_pack_status(jobs[1].job_dir)['returncode'], 1)
+        jfile = os.path.join(self.tmp, 'calibrate.json')
+        store = get_checkpoint(jfile)
+        store.write([{'job': {'job_dir': j.job_dir}, 'job_id': j.job_id,
+                      'corrections': [], 'final_energy': None}
+                     for j in jobs])
+        update_pack_status(jfile)
+        self.assertEqual(
+            [e['pack_status']['state'] for e in store.load()],
+            ['D', 'F', 'D'])
+        # the job states come from the pack status, not from the shared
+        # job id of the allocation
+        queue_status = QueueStatus(queue_system='slurm', ttl=3600)
+        queue_status.update('42 R\n')
+        for j, e in zip(jobs, store.load()):
+            j.job_id = '42'
+            j.pack_status = e['pack_status']
+        self.assertEqual([get_job_state(j, queue_status)[0] for j in jobs],
+                         ['C', 'F', 'C'])
+        self.assertEqual(get_rerun_key(jobs[1]), jobs[1].job_dir)
+
+    def test_packed_job_state(self):
+        for state, allocation, packed in [('Q', 'PD', 'PD'), ('Q', 'R', 'Q'),
+                                          ('R', 'R', 'R'), ('R', '00', 'F'),
+                                          ('Q', '00', 'F'), ('D', '00', 'C'),
+                                          ('F', 'R', 'F'),
+                                          ('R', 'unknown', 'R')]:
+            self.assertEqual(get_packed_job_state({'state': state},
+                                                  allocation), packed)
+
+
+if __name__ == '__main__':
+    unittest.main()
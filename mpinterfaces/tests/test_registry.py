@@ -0,0 +1,57 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from pymatgen.io.vasp.inputs import Incar, Kpoints, Poscar
+
+from mpinterfaces.instrument import MPINTLazyVaspInputSet, MPINTVaspJob
+from mpinterfaces.registry import JobRegistry, get_job_hash
+from mpinterfaces.utils import QueueStatus
+
+
+TEST_STEP1 = os.path.join(os.path.dirname(__file__), "..",
+                          "test_files", "Wflow_Step1")
+CONVERGED = os.path.join(os.path.dirname(__file__), "..", "mat2d",
+                         "stability", "tests", "BiTeCl")
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.incar = Incar.from_file(os.path.join(TEST_STEP1, 'INCAR'))
+        self.kpoints = Kpoints.from_file(os.path.join(TEST_STEP1, 'KPOINTS'))
+        self.poscar = Poscar.from_file(os.path.join(TEST_STEP1, 'POSCAR'))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def get_job(self, job_dir, encut):
+        vis = MPINTLazyVaspInputSet('Test', self.incar.as_dict(),
+                                    {'ENCUT': encut}, self.poscar,
+                                    self.kpoints, test=True)
+        return MPINTVaspJob(['ls'], job_dir=job_dir, vis=vis)
+
+    def test_dedupe(self):
+        shutil.copytree(CONVERGED, 'done')
+        done = self.get_job('done', 500)
+        done.job_id = '1234'
+        self.assertEqual(get_job_hash(done),
+                         get_job_hash(self.get_job('other', 500)))
+        registry = JobRegistry('jobs.db',
+                               queue_status=QueueStatus(queue_system='none'))
+        registry.register_jobs([done])
+        jobs = [self.get_job('new', 500), self.get_job('new2', 600)]
+        to_run, linked = registry.dedupe(jobs)
+        self.assertEqual(to_run, [jobs[1]])
+        self.assertEqual(linked, [jobs[0]])
+        self.assertEqual(jobs[0].job_id, '1234')
+        self.assertEqual(os.path.realpath('new'), os.path.realpath('done'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mpinterfaces import resources
+from mpinterfaces.resources import parse_outcar_resources, \
+    ResourcePredictor, walltime_to_seconds
+from mpinterfaces.utils import write_slurm_runjob
+
+
+OUTCAR = os.path.join(os.path.dirname(__file__), "..", "mat2d",
+                      "electronic_structure", "tests",
+                      "band_structure_control", "OUTCAR")
+
+
+class ResourcesTest(unittest.TestCase):
+
+    def test_parse_outcar(self):
+        d = parse_outcar_resources(OUTCAR)
+        self.assertEqual(d, {'nions': 3, 'encut': 450.0, 'nkpts': 84,
+                             'nbands': 24, 'cores': 64,
+                             'elapsed': 24046.895})
+
+    def test_predictor(self):
+        predictor = get_predictor()
+        self.assertAlmostEqual(predictor.coefficients[-1], -0.8)
+        features = FEATURES
+        self.assertAlmostEqual(predictor.predict(features, 32),
+                               1e-3 * 30 * 90 * 120 ** 2 / 32 ** 0.8)
+        # 61 min with the safety factor on one node, 35 min on two
+        suggestion = predictor.suggest(features, cores_per_node=32,
+                                       max_walltime='1:00:00')
+        self.assertEqual(suggestion['nnodes'], 2)
+        self.assertEqual(suggestion['ntasks'], 64)
+        self.assertEqual(suggestion['walltime'], '0:45:00')
+        small = predictor.suggest(dict(features, nkpts=1),
+                                  cores_per_node=32)
+        self.assertEqual(small, {'nnodes': 1, 'ntasks': 32,
+                                 'walltime': '0:15:00'})
+
+    def test_walltime_to_seconds(self):
+        self.assertEqual(walltime_to_seconds('48:00:00'), 172800)
+        self.assertEqual(walltime_to_seconds('0:45:30'), 2730)
+        self.assertEqual(walltime_to_seconds('1-00:00:00'), 86400)
+        self.assertEqual(walltime_to_seconds('2-12:30:15'), 217815)
+        self.assertEqual(walltime_to_seconds('1-6'), 108000)
+        predictor = ResourcePredictor([0.0] * 6)
+        suggestion = predictor.suggest(
+            {'nions': 1, 'encut': 1, 'nkpts': 1, 'nbands': 1},
+            max_walltime='1-00:00:00', min_walltime=86400)
+        self.assertEqual(suggestion['walltime'], '24:00:00')
+
+    def test_slurm_runjob(self):
+        tmp = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        get_default_predictor = resources.get_default_predictor
+        predictor = get_predictor()
+        resources.get_default_predictor = lambda: predictor
+        try:
+            os.chdir(tmp)
+            # 4 nodes configured, 2 are enough
+            write_slurm_runjob('big', 128, '800mb', '1:00:00', 'vasp',
+                               features=FEATURES)
+            with open('runjob') as f:
+                runjob = f.read()
+            self.assertIn('--nodes=2\n', runjob)
+            self.assertIn('--ntasks=64\n', runjob)
+            self.assertIn('-t 0:45:00\n', runjob)
+            # a single node job keeps its task count
+            write_slurm_runjob('small', 16, '800mb', '6:00:00', 'vasp',
+                               features=dict(FEATURES, nkpts=1))
+            with open('runjob') as f:
+                runjob = f.read()
+            self.assertIn('--nodes=1\n', runjob)
+            self.assertIn('--ntasks=16\n', runjob)
+            self.assertIn('-t 0:15:00\n', runjob)
+        finally:
+            resources.get_default_predictor = get_default_predictor
+            os.chdir(cwd)
+            shutil.rmtree(tmp)
+
+
+FEATURES = {'nions': 30, 'encut': 430, 'nkpts': 90, 'nbands': None}
+
+
+def get_predictor():
+    """
+    predictor fitted on runs timed as
+    t = 1e-3 nions nkpts nbands**2 / cores**0.8
+    """
+    records = []
+    for nions in [2, 8, 30]:
+        for nkpts in [10, 40, 90]:
+            for cores in [16, 64]:
+                nbands = 4 * nions
+                records.append(
+                    {'nions': nions, 'encut': 400 + nions,
+                     'nkpts': nkpts, 'nbands': nbands, 'cores': cores,
+                     'elapsed': 1e-3 * nions * nkpts * nbands ** 2 /
+                     cores ** 0.8})
+    return ResourcePredictor().fit(records)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from mpinterfaces.staging import FileStager, is_link_safe
+
+
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'WAVECAR')
+        with open(self.src, 'w') as f:
+            f.write('wavefunctions')
+        for d in ['job1', 'job2']:
+            os.makedirs(os.path.join(self.tmp, d))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_is_link_safe(self):
+        self.assertFalse(is_link_safe(self.src, {}))
+        self.assertTrue(is_link_safe(self.src, {'LWAVE': False}))
+        self.assertFalse(is_link_safe('CHGCAR', {'LWAVE': False}))
+        self.assertFalse(is_link_safe('INCAR', {}))
+
+    def test_stage(self):
+        stager = FileStager()
+        dst1 = os.path.join(self.tmp, 'job1', 'WAVECAR')
+        dst2 = os.path.join(self.tmp, 'job2', 'WAVECAR')
+        self.assertIn(stager.stage(self.src, os.path.dirname(dst1),
+                                   link=True), ['reflink', 'hardlink'])
+        self.assertIn(stager.stage(self.src, dst2), ['reflink', 'copy'])
+        self.assertFalse(os.path.samefile(self.src, dst2))
+        # the copy is replaced, not written through the link
+        with open(dst2, 'w') as f:
+            f.write('rewritten')
+        stager.stage(dst2, dst1)
+        with open(self.src) as f:
+            self.assertEqual(f.read(), 'wavefunctions')
+        with open(dst1) as f:
+            self.assertEqual(f.read(), 'rewritten')
+
+
+if __name__ == '__main__':
+    unittest.main()
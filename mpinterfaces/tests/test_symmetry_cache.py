@@ -0,0 +1,48 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from pymatgen.core.structure import Structure
+from pymatgen.core.lattice import Lattice
+
+from mpinterfaces.symmetry_cache import SymmetryCache, \
+    get_structure_fingerprint
+
+
+class SymmetryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.structure = Structure(Lattice.cubic(4.05), ['Al', 'Al', 'O'],
+                                   [[0, 0, 0], [0.5, 0.5, 0],
+                                    [0.5, 0, 0.5]])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_fingerprint(self):
+        key = get_structure_fingerprint(self.structure)
+        # other site order and periodic images
+        other = Structure(Lattice.cubic(4.0500001), ['O', 'Al', 'Al'],
+                          [[0.5, 1.0, -0.5], [0.99999999, 0, 1],
+                           [0.5, -0.5, 0]])
+        self.assertEqual(get_structure_fingerprint(other), key)
+        self.assertNotEqual(get_structure_fingerprint(self.structure, 0.01),
+                            key)
+        other.perturb(0.05)
+        self.assertNotEqual(get_structure_fingerprint(other), key)
+
+    def test_cache(self):
+        filename = os.path.join(self.tmp, 'symmetry.db')
+        cache = SymmetryCache(filename)
+        info = {'symbol': 'P4/mmm', 'number': 123}
+        cache.put(get_structure_fingerprint(self.structure), info)
+        # persisted across cache instances
+        cache = SymmetryCache(filename)
+        self.assertEqual(cache.get_spacegroup_info(self.structure), info)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
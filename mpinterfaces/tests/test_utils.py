@@ -1,11 +1,15 @@
 import unittest
 import os
-from collections import defaultdict
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict, OrderedDict
 
 from mpinterfaces.utils import *
 
 from pymatgen import Structure
-from pymatgen.io.vasp.inputs import Kpoints
+from pymatgen.io.vasp.inputs import Kpoints, Potcar
 from pymatgen.symmetry.bandstructure import HighSymmKpath
 
 __author__ = "Michael Ashton"
@@ -16,6 +20,21 @@ __status__ = "Production"
 __date__ = "March 3, 2017"
 
 
+class OutcarErrorHandler(object):
+    """
+    reads the OUTCAR by relative name, as the custodian handlers do
+    """
+
+    def check(self):
+        self.errors = []
+        # long enough for the other threads to run during the check
+        time.sleep(0.05)
+        if os.path.exists('OUTCAR'):
+            with open('OUTCAR') as f:
+                self.errors = [l.strip() for l in f if 'ERROR' in l]
+        return bool(self.errors)
+
+
 ROOT = os.path.abspath(os.path.join(
     os.path.dirname(__file__), "..", "mat2d", "stability", "tests")
 )
@@ -133,6 +152,233 @@ class UtilsTest(unittest.TestCase):
         'ntasks': 16, 'email': None, 'rocket_launch': None}),None)
         self.assertEqual(trial_output, correct_output)
 
+    def test_partition_jobs_by_cost(self):
+        turn_knobs = OrderedDict([('ENCUT', [300, 400, 500, 600, 700, 800]),
+                                  ('KPOINTS', [[k, k, k]
+                                               for k in (4, 6, 8, 10)])])
+        partitions, names, costs = partition_jobs_by_cost(turn_knobs,
+                                                          n_partitions=3)
+        self.assertEqual(len(partitions), 3)
+        # the ENCUT values are split, as by partition_jobs
+        for p in partitions:
+            self.assertEqual(list(p.keys()), ['ENCUT', 'KPOINTS'])
+            self.assertEqual(p['KPOINTS'], turn_knobs['KPOINTS'])
+        self.assertEqual(sorted(e for p in partitions for e in p['ENCUT']),
+                         turn_knobs['ENCUT'])
+        self.assertLess(max(costs) / min(costs), 1.1)
+        # walltime budget of 1 hour at 1e-4 s per unit cost
+        partitions, names, costs = partition_jobs_by_cost(
+            turn_knobs, walltime=3600, seconds_per_cost=1e-4)
+        self.assertEqual(sum(len(p['ENCUT']) for p in partitions), 6)
+        for p, cost in zip(partitions, costs):
+            if len(p['ENCUT']) > 1:
+                self.assertLessEqual(cost, 3600 / 1e-4)
+        self.assertEqual(len(names), len(partitions))
+        self.assertEqual(partition_jobs_by_cost({'ENCUT': []}), ([], [], []))
+
+    def test_get_converged_value(self):
+        values = [300, 400, 500, 600, 700]
+        energies = [-1.1, -1.01, -1.0095, None, -1.0092]
+        self.assertEqual(get_converged_value(values, energies,
+                                             ev_per_atom=0.001), 400)
+        self.assertIsNone(get_converged_value(values[:3], energies[:3],
+                                              ev_per_atom=0.001))
+
+    def test_queue_status_single_query(self):
+        # fake squeue that logs every call
+        stub_dir = tempfile.mkdtemp()
+        calls_file = os.path.join(stub_dir, 'calls')
+        with open(os.path.join(stub_dir, 'squeue'), 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write('echo "$@" >> {}\n'.format(calls_file))
+            f.write('printf "101 R\\n102 PD\\n"\n')
+        os.chmod(os.path.join(stub_dir, 'squeue'), 0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = stub_dir + os.pathsep + path
+        try:
+            queue_status = QueueStatus(queue_system='slurm', user='me',
+                                       ttl=60)
+            self.assertEqual(queue_status.get_state('101'), 'R')
+            self.assertEqual(queue_status.get_state('102'), 'PD')
+            self.assertEqual(queue_status.get_state('103'), '00')
+            with open(calls_file) as f:
+                self.assertEqual(len(f.readlines()), 1)
+        finally:
+            os.environ['PATH'] = path
+            shutil.rmtree(stub_dir)
+
+    def test_queue_status_failed_query(self):
+        stub_dir = tempfile.mkdtemp()
+        calls_file = os.path.join(stub_dir, 'calls')
+
+        def write_squeue(body):
+            with open(os.path.join(stub_dir, 'squeue'), 'w') as f:
+                f.write('#!/bin/sh\n')
+                f.write('echo "$@" >> {}\n'.format(calls_file))
+                f.write(body)
+            os.chmod(os.path.join(stub_dir, 'squeue'), 0o755)
+
+        write_squeue('exit 1\n')
+        path = os.environ['PATH']
+        os.environ['PATH'] = stub_dir + os.pathsep + path
+        try:
+            queue_status = QueueStatus(queue_system='slurm', user='me',
+                                       ttl=60)
+            # no snapshot: the jobs are neither running nor gone
+            for job_id in ('101', '102', '103'):
+                self.assertEqual(queue_status.get_state(job_id),
+                                 QueueStatus.UNKNOWN)
+            # the failed query is not retried before the ttl
+            with open(calls_file) as f:
+                self.assertEqual(len(f.readlines()), 1)
+            write_squeue('printf "101 R\\n"\n')
+            queue_status.timestamp -= 61
+            self.assertEqual(queue_status.get_state('101'), 'R')
+            self.assertEqual(queue_status.get_state('103'), '00')
+            with open(calls_file) as f:
+                self.assertEqual(len(f.readlines()), 2)
+        finally:
+            os.environ['PATH'] = path
+            shutil.rmtree(stub_dir)
+
+    def test_queue_status_parse_pbs(self):
+        output = """
+hipergator.local:
+                                                            Req'd  Req'd   Elap
+Job ID          Username Queue    Jobname    SessID NDS TSK Memory Time  S Time
+--------------- -------- -------- ---------- ------ --- --- ------ ----- - -----
+2001.hipergator me       default  Pt_ENCUT    12345   1  16    --  10:00 R 00:01
+2002.hipergator me       default  Pt_KPTS        --   1  16    --  10:00 Q   --
+"""
+        queue_status = QueueStatus(queue_system='pbs')
+        queue_status.update(output)
+        self.assertEqual(queue_status.get_state('2001.hipergator.local'), 'R')
+        self.assertEqual(queue_status.get_state('2002'), 'Q')
+
+    def test_check_job_errors(self):
+        tmp = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        # the working directories seen by the other threads
+        seen = set()
+        stop = threading.Event()
+
+        def watch():
+            while not stop.is_set():
+                seen.add(os.getcwd())
+                time.sleep(0.001)
+
+        watcher = threading.Thread(target=watch)
+        try:
+            for d, outcar in [('failed', ' ERROR RSPHER\n'),
+                              ('ok', ' General timing\n')]:
+                os.makedirs(os.path.join(tmp, d))
+                with open(os.path.join(tmp, d, 'OUTCAR'), 'w') as f:
+                    f.write(outcar)
+                open(os.path.join(tmp, d, 'job.out'), 'w').close()
+            # the caller's directory has its own failed OUTCAR
+            os.chdir(os.path.join(tmp, 'failed'))
+            caller_cwd = os.getcwd()
+            watcher.start()
+            handlers = [OutcarErrorHandler()]
+            self.assertEqual(
+                check_job_errors(os.path.join(tmp, 'ok'), 'job.out',
+                                 handlers), {})
+            self.assertEqual(
+                check_job_errors(os.path.join(tmp, 'failed'), 'job.out',
+                                 handlers),
+                {'OutcarErrorHandler': ['ERROR RSPHER']})
+            self.assertIsNone(check_job_errors(tmp, 'job.out', handlers))
+            stop.set()
+            watcher.join()
+            self.assertEqual(seen, set([caller_cwd]))
+        finally:
+            stop.set()
+            os.chdir(cwd)
+            shutil.rmtree(tmp)
+
+    def test_convergence_table(self):
+        from mpinterfaces import utils
+        from pymatgen.io.vasp.inputs import Poscar
+        tmp = tempfile.mkdtemp()
+        jobs = []
+        for name in ('BiTeCl', 'FeCl2'):
+            if name == 'BiTeCl':
+                structure = Structure.from_file(
+                    os.path.join(ROOT, 'BiTeCl', 'POSCAR'))
+            else:
+                structure = Structure.from_file(
+                    os.path.join(ROOT, 'POSCAR_FeCl2'))
+            # the species in the order of appearance are the species in
+            # the order of electronegativity
+            structure = structure.get_sorted_structure()
+            for i, encut in enumerate((400, 500, 600)):
+                job_dir = '{0}_{1}'.format(name, encut)
+                os.makedirs(os.path.join(tmp, job_dir))
+                Poscar(structure, comment=name).write_file(
+                    os.path.join(tmp, job_dir, 'POSCAR'))
+                jobs.append(ConvergenceJob(
+                    tmp, job_dir, {'ENCUT': encut}, [[4 + i] * 3],
+                    -3.0 * len(structure) - i * 0.01))
+        jobs_from_file = utils.jobs_from_file
+        utils.jobs_from_file = lambda jfile: jobs
+        try:
+            data = get_convergence_data('calibrate.json')
+            table = get_convergence_table('calibrate.json', nprocs=2)
+        finally:
+            utils.jobs_from_file = jobs_from_file
+            shutil.rmtree(tmp)
+        self.assertEqual(len(table), 12)
+        self.assertEqual(sorted(set(table.species)), sorted(data.keys()))
+        for species in data:
+            for param in ('ENCUT', 'KPOINTS'):
+                idx = [i for i in range(len(table))
+                       if table.species[i] == species and
+                       table.param[i] == param]
+                # get_convergence_data skips the first job of a species
+                rows = [[table.value[i], table.energy_per_atom[i]]
+                        for i in idx[1:]]
+                self.assertEqual(len(rows), len(data[species][param]))
+                for row, serial in zip(rows, data[species][param]):
+                    self.assertEqual(row[0], serial[0])
+                    self.assertAlmostEqual(row[1], serial[1])
+
+    def test_prepare_slabs(self):
+        structures = [Structure.from_file(os.path.join(ROOT, f))
+                      for f in ('POSCAR_SiP', 'POSCAR_FeCl2', 'POSCAR_SF6')]
+        slabs = prepare_slabs(structures, [15, 20, 12])
+        for structure, slab, vacuum in zip(structures, slabs, [15, 20, 12]):
+            # the steps of ensure_vacuum before the batch version
+            control = align_axis(structure.copy())
+            spacing = get_spacing(control)
+            control = center_slab(add_vacuum(control, vacuum - spacing))
+            for v, control_v in zip(slab.lattice.matrix,
+                                    control.lattice.matrix):
+                for x, control_x in zip(v, control_v):
+                    self.assertAlmostEqual(x, control_x)
+            for site, control_site in zip(slab, control):
+                self.assertEqual(site.specie, control_site.specie)
+                self.assertLess(site.distance(control_site), 1e-6)
+        self.assertAlmostEqual(get_spacing(slabs[0]), 15.0)
+
+
+class ConvergenceJob(object):
+    """
+    job as read from the checkpoint file
+    """
+
+    def __init__(self, parent_job_dir, job_dir, incar, kpts, final_energy):
+        self.parent_job_dir = parent_job_dir
+        self.job_dir = job_dir
+        self.final_energy = final_energy
+        self.vis = ConvergenceInputs(incar, kpts)
+
+
+class ConvergenceInputs(object):
+
+    def __init__(self, incar, kpts):
+        self.incar = incar
+        self.kpoints = Kpoints(kpts=kpts)
+        self.potcar = Potcar(functional='PBE')
 
 
 if __name__ == '__main__':
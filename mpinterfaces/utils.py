@@ -23,12 +23,12 @@ import time
 import subprocess as sp
 import logging
 from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import yaml
 
 import numpy as np
 
-from monty.json import MontyEncoder, MontyDecoder
-from monty.serialization import loadfn, dumpfn
+from monty.serialization import loadfn
 
 from pymatgen.core.sites import PeriodicSite
 from pymatgen import Structure, Lattice, Element
@@ -38,7 +38,6 @@ from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.core.composition import Composition
 from pymatgen.core.operations import SymmOp
 from pymatgen.core.periodic_table import _pt_data
-from pymatgen.io.vasp.outputs import Vasprun
 from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 
 from custodian.custodian import Custodian
@@ -47,9 +46,17 @@ from fireworks.user_objects.queue_adapters.common_adapter import CommonAdapter
 
 from ase.lattice.surface import surface
 
+from mpinterfaces.data_processor import probe_vasp_run
+from mpinterfaces.instrument import get_potcar_from_file
+from mpinterfaces.packing import update_pack_status, clear_pack_status, \
+    get_packed_job_state
+from mpinterfaces.error_scanner import ErrorScanner, RESTARTABLE_ERRORS
+from mpinterfaces.resources import suggest_resources
+from mpinterfaces.checkpoint import get_checkpoint, get_entry_key, \
+    decode_entry
 from mpinterfaces.default_logger import get_default_logger
 from mpinterfaces import VASP_STD_BIN, QUEUE_SYSTEM, QUEUE_TEMPLATE, VASP_PSP,\
- PACKAGE_PATH
+ PACKAGE_PATH, USERNAME
 
 __author__ = "Kiran Mathew, Joshua J. Gabriel, Michael Ashton"
 __copyright__ = "Copyright 2017, Henniggroup"
@@ -195,16 +202,29 @@ def get_magmom_afm(poscar, database=None):
 
 
 def get_run_cmmnd(nnodes=1, ntasks=16, walltime='10:00:00', job_bin=None,
-                  job_name=None, mem=None):
+                  job_name=None, mem=None, features=None):
     """
     returns the fireworks CommonAdapter based on the queue
     system specified by mpint_config.yaml and the submit
     file template also specified in mpint_config.yaml
     NOTE: for the job_bin, please specify the mpi command as well:
           Eg: mpiexec /path/to/binary
+
+    If the job features are given (see resources.get_job_features)
+    and a resource model is configured, the number of nodes and tasks
+    and the walltime are the ones suggested by the model, walltime
+    being the limit.
     """
     d = {}
     job_cmd = None
+    if features is not None:
+        suggestion = suggest_resources(
+            features, cores_per_node=max(ntasks // nnodes, 1),
+            max_walltime=walltime)
+        if suggestion:
+            nnodes = suggestion['nnodes']
+            ntasks = suggestion['ntasks']
+            walltime = suggestion['walltime']
     try:
        qtemp_file = open(QUEUE_TEMPLATE+'qtemplate.yaml')
        qtemp = yaml.load(qtemp_file)
@@ -241,61 +261,271 @@ def get_run_cmmnd(nnodes=1, ntasks=16, walltime='10:00:00', job_bin=None,
         return (None, job_cmd)
 
 
-def get_job_state(job):
+class QueueStatus(object):
+    """
+    Snapshot of the states of all the jobs in the batch system queue,
+    obtained with a single squeue/qstat call and cached for ttl
+    seconds. All the jobs checked within a polling cycle share the
+    same query instead of spawning one subprocess per job.
+
+    Args:
+        queue_system (str): 'slurm' or 'pbs', defaults to the
+            queue_system in mpint_config.yaml
+        user (str): restrict the query to the jobs of this user,
+            defaults to the username in mpint_config.yaml
+        ttl (float): time in seconds for which a snapshot is reused
+    """
+
+    # state of all the jobs while there is no valid snapshot
+    UNKNOWN = 'unknown'
+
+    def __init__(self, queue_system=None, user=None, ttl=30):
+        self.queue_system = queue_system or QUEUE_SYSTEM
+        self.user = user or USERNAME
+        self.ttl = ttl
+        self.states = {}
+        self.timestamp = None
+        self.valid = False
+
+    def get_command(self):
+        """
+        returns the command that lists all the jobs in the queue,
+        None if there is no batch system. Job arrays are expanded so
+        that every array task is listed with its own id,
+        <array id>_<index> for slurm and <array id>[<index>] for pbs
+        """
+        if self.queue_system == 'slurm':
+            cmd = ['squeue', '-h', '-r', '-o', '%i %t']
+        elif self.queue_system == 'pbs':
+            cmd = ['qstat', '-t']
+        else:
+            return None
+        if self.user:
+            cmd += ['-u', self.user]
+        return cmd
+
+    @staticmethod
+    def normalize_id(job_id):
+        """
+        strip the server name from pbs job ids so that the ids
+        returned by qsub match the ones listed by qstat
+        """
+        return str(job_id).strip().split('.')[0]
+
+    def parse(self, output):
+        """
+        parse the output of the queue query into a dict of
+        job id: state
+        """
+        states = {}
+        for line in output.splitlines():
+            tokens = line.split()
+            # skip the pbs headers and separator lines
+            if len(tokens) < 2 or not tokens[0][0].isdigit():
+                continue
+            if self.queue_system == 'slurm':
+                states[self.normalize_id(tokens[0])] = tokens[1]
+            else:
+                states[self.normalize_id(tokens[0])] = tokens[-2]
+        return states
+
+    def update(self, output):
+        """
+        set the snapshot from the output of the queue query
+        """
+        self.states = self.parse(output)
+        self.timestamp = time.time()
+        self.valid = True
+
+    def set_failed(self):
+        """
+        record a failed queue query: the states of all the jobs are
+        unknown and the query is not retried before ttl seconds
+        """
+        self.states = {}
+        self.timestamp = time.time()
+        self.valid = False
+
+    def refresh(self):
+        """
+        query the batch system. If the query fails, the states are
+        unknown until the next successful query, which is attempted
+        once the snapshot is stale again
+        """
+        cmd = self.get_command()
+        if cmd is None:
+            return self.states
+        try:
+            output = sp.check_output(cmd, universal_newlines=True)
+        except (OSError, sp.CalledProcessError) as ex:
+            logger.warn('queue query {0} failed: {1}'.format(' '.join(cmd),
+                                                             ex))
+            self.set_failed()
+            return self.states
+        self.update(output)
+        return self.states
+
+    def is_stale(self):
+        return self.timestamp is None or \
+            time.time() - self.timestamp > self.ttl
+
+    def get_state(self, job_id, refresh=True):
+        """
+        returns the state of the job, "00" if it is not in the queue
+        and QueueStatus.UNKNOWN if the queue could not be queried.
+        With refresh=False a stale snapshot is not re-queried
+        """
+        if refresh and self.is_stale():
+            self.refresh()
+        # without a batch system no job is ever in the queue
+        if not self.valid and self.get_command() is not None:
+            return self.UNKNOWN
+        return self.states.get(self.normalize_id(job_id), "00")
+
+
+_QUEUE_STATUS = None
+
+
+def get_queue_status():
+    """
+    returns the process wide QueueStatus for the configured
+    queue system
+    """
+    global _QUEUE_STATUS
+    if _QUEUE_STATUS is None:
+        _QUEUE_STATUS = QueueStatus()
+    return _QUEUE_STATUS
+
+
+def get_job_state(job, queue_status=None, refresh=True):
     """
     Args:
         job: job
+        queue_status: QueueStatus to look up the job in, defaults
+            to the process wide one
+        refresh: whether a stale queue snapshot may be re-queried
 
     Returns:
-           the job state and the job output file name
+           the job state and the job output file name. The state is
+           QueueStatus.UNKNOWN if the queue could not be queried. The
+           state of a packed job is derived from its pack status and
+           the state of its allocation
     """
     ofname = None
+    if queue_status is None:
+        queue_status = get_queue_status()
 
     # pbs
-    if QUEUE_SYSTEM == 'pbs':# in hostname:
-        try:
-            output = sp.check_output(['qstat', '-i', job.job_id])
-            state = output.rstrip('\n').split('\n')[-1].split()[-2]
-        except:
+    if queue_status.queue_system == 'pbs':
+        state = queue_status.get_state(job.job_id, refresh=refresh)
+        if state == "00":
             logger.info('Job {} not in the que'.format(job.job_id))
-            state = "00"
         ofname = "FW_job.out"
 
     # slurm
-    elif QUEUE_SYSTEM == 'slurm':
-        try:
-            output = sp.check_output(['squeue', '--job', job.job_id])
-            state = output.rstrip('\n').split('\n')[-1].split()[-4]
-        except:
+    elif queue_status.queue_system == 'slurm':
+        state = queue_status.get_state(job.job_id, refresh=refresh)
+        if state == "00":
             logger.info('Job {} not in the que.'.format(job.job_id))
             logger.info(
                 'This could mean either the batchsystem crashed(highly unlikely) or the job completed a long time ago')
-            state = "00"
         ofname = "vasp_job-" + str(job.job_id) + ".out"
 
     # no batch system
     else:
         state = 'XX'
+    if getattr(job, 'pack_status', None):
+        state = get_packed_job_state(job.pack_status, state)
     return state, ofname
 
 
+def get_rerun_key(job):
+    """
+    key of the job in the job_ids passed to update_checkpoint: the
+    job directory for the packed jobs, which share their job id with
+    the other jobs of the pack, the job id otherwise
+    """
+    if getattr(job, 'pack_status', None):
+        return job.job_dir
+    return job.job_id
+
+
+def _check_handlers(job_dir, output_file, handlers):
+    """
+    run in a child process by check_job_errors, so that changing to
+    job_dir does not change the working directory of the caller
+    """
+    os.chdir(job_dir)
+    errors = {}
+    for h in handlers:
+        h.output_filename = output_file
+        if h.check():
+            errors[h.__class__.__name__] = list(getattr(h, 'errors', []))
+    return errors
+
+
+def check_job_errors(job_dir, ofname, handlers):
+    """
+    run the check of the given error handlers on the stdout redirect
+    file, ofname, of the job in job_dir. The handlers read the other
+    vasp files(OUTCAR, INCAR, ...) by relative name, so the checks are
+    run in a child process working in job_dir: the working directory
+    of this process, shared by all its threads, is left alone. The
+    handlers are pickled to the child, so the same handlers can be
+    used for several jobs concurrently.
+
+    Args:
+        job_dir: job directory
+        ofname: name of the stdout redirect file in job_dir
+        handlers: list of custodian error handlers
+
+    Returns:
+        dict of handler name: detected errors, None if the stdout
+        redirect file doesnt exist
+    """
+    job_dir = os.path.abspath(job_dir)
+    output_file = os.path.join(job_dir, ofname)
+    if not os.path.exists(output_file):
+        return None
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_check_handlers, job_dir, output_file,
+                               handlers).result()
+
+
+def get_file_signature(filename):
+    """
+    returns the [mtime, size] signature of the file, used to detect
+    whether the file changed since it was last processed.
+    None if the file doesnt exist
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
 def update_checkpoint(job_ids=None, jfile=None, **kwargs):
     """
     rerun the jobs with job ids in the job_ids list. The jobs are
-    read from the json checkpoint file, jfile.
+    read from the checkpoint file, jfile.
     If no job_ids are given then the checkpoint file will
     be updated with corresponding final energy
 
+    The (mtime, size) signature of each job's vasprun.xml is recorded
+    in the checkpoint, only the jobs whose vasprun.xml changed since
+    the last update are deserialized and re-parsed, and only their
+    entries are updated in the checkpoint store.
+
     Args:
         job_ids: list of job ids to update or q resolve
-        jfile: check point file
+        jfile: check point file, see checkpoint.get_checkpoint for the
+            supported formats
     """
-    cal_log = loadfn(jfile, cls=MontyDecoder)
-    cal_log_new = []
-    all_jobs = []
+    store = get_checkpoint(jfile)
+    cal_log = store.load()
     run_jobs = []
     handlers = []
-    final_energy = None
     incar = None
     kpoints = None
     qadapter = None
@@ -308,50 +538,67 @@ def update_checkpoint(job_ids=None, jfile=None, **kwargs):
         if k == 'que':
             qadapter = v
     for j in cal_log:
-        job = j["job"]
+        job_dir = get_entry_key(j)
+        if not (job_ids and (j['job_id'] in job_ids or job_dir in job_ids)):
+            continue
+        job = decode_entry(j)['job']
         job.job_id = j['job_id']
-        all_jobs.append(job)
-        if job_ids and (j['job_id'] in job_ids or job.job_dir in job_ids):
-            logger.info('setting job {0} in {1} to rerun'.format(j['job_id'],
-                                                                 job.job_dir))
-            contcar_file = job.job_dir + os.sep + 'CONTCAR'
-            poscar_file = job.job_dir + os.sep + 'POSCAR'
-            if os.path.isfile(contcar_file) and len(
-                    open(contcar_file).readlines()) != 0:
-                logger.info('setting poscar file from {}'
-                            .format(contcar_file))
-                job.vis.poscar = Poscar.from_file(contcar_file)
-            else:
-                logger.info('setting poscar file from {}'
-                            .format(poscar_file))
-                job.vis.poscar = Poscar.from_file(poscar_file)
-            if incar:
-                logger.info('incar overridden')
-                job.vis.incar = incar
-            if kpoints:
-                logger.info('kpoints overridden')
-                job.vis.kpoints = kpoints
-            if qadapter:
-                logger.info('qadapter overridden')
-                job.vis.qadapter = qadapter
-            run_jobs.append(job)
+        logger.info('setting job {0} in {1} to rerun'.format(j['job_id'],
+                                                             job.job_dir))
+        # rerun on its own, out of the pack
+        clear_pack_status(job.job_dir)
+        contcar_file = job.job_dir + os.sep + 'CONTCAR'
+        poscar_file = job.job_dir + os.sep + 'POSCAR'
+        if os.path.isfile(contcar_file) and len(
+                open(contcar_file).readlines()) != 0:
+            logger.info('setting poscar file from {}'
+                        .format(contcar_file))
+            job.vis.poscar = Poscar.from_file(contcar_file)
+        else:
+            logger.info('setting poscar file from {}'
+                        .format(poscar_file))
+            job.vis.poscar = Poscar.from_file(poscar_file)
+        if incar:
+            logger.info('incar overridden')
+            job.vis.incar = incar
+        if kpoints:
+            logger.info('kpoints overridden')
+            job.vis.kpoints = kpoints
+        if qadapter:
+            logger.info('qadapter overridden')
+            job.vis.qadapter = qadapter
+        run_jobs.append(job)
     if run_jobs:
         c = Custodian(handlers, run_jobs, max_errors=5)
         c.run()
-    for j in all_jobs:
-        final_energy = j.get_final_energy()
-        cal_log_new.append({"job": j.as_dict(),
-                            'job_id': j.job_id,
-                            "corrections": [],
-                            'final_energy': final_energy})
-    dumpfn(cal_log_new, jfile, cls=MontyEncoder, indent=4)
+    reruns = dict((j.job_dir, j) for j in run_jobs)
+    updates = OrderedDict()
+    for j in cal_log:
+        job_dir = get_entry_key(j)
+        output_stat = get_file_signature(
+            os.path.join(job_dir, 'vasprun.xml'))
+        if job_dir in reruns:
+            job = reruns[job_dir]
+            updates[job_dir] = {'job': job.as_dict(),
+                                'job_id': job.job_id,
+                                'final_energy': job.get_final_energy(),
+                                'output_stat': output_stat,
+                                'pack_status': None}
+        elif 'final_energy' not in j or \
+                j.get('output_stat') != output_stat:
+            job = decode_entry(j)['job']
+            job.job_id = j['job_id']
+            updates[job_dir] = {'final_energy': job.get_final_energy(),
+                                'output_stat': output_stat}
+    if updates:
+        store.update(updates)
 
 
 def jobs_from_file(filename='calibrate.json'):
     """
-    read in json file of format caibrate.json(the default logfile
-    created when jobs are run through calibrate) and return the
-    list of job objects.
+    read in the checkpoint file (the default logfile
+    created when jobs are run through calibrate is calibrate.json)
+    and return the list of job objects.
 
     Args:
         filename: checkpoint file name
@@ -359,71 +606,98 @@ def jobs_from_file(filename='calibrate.json'):
     Returns:
            list of all jobs
     """
-    caljobs = loadfn(filename, cls=MontyDecoder)
     all_jobs = []
-    for j in caljobs:
-        job = j["job"]
+    for j in get_checkpoint(filename).load():
+        job = decode_entry(j)['job']
         job.job_id = j['job_id']
-        job.final_energy = j['final_energy']
+        job.final_energy = j.get('final_energy')
+        job.pack_status = j.get('pack_status')
         all_jobs.append(job)
     return all_jobs
 
 
-def launch_daemon(steps, interval, handlers=None, ld_logger=None):
+def launch_daemon(steps, interval, handlers=None, ld_logger=None,
+                  queue_status=None, scanner=None):
     """
     run all the 'steps' in daemon mode
     checks job status every 'interval' seconds
     also runs all the error handlers
+    the queue is queried once per cycle through queue_status
+    the stdout file and OUTCAR of the running and failed jobs are
+    scanned incrementally for vasp errors by scanner, the failed jobs
+    killed at the walltime are rerun
     """
     if ld_logger:
         global logger
         logger = ld_logger
+    if queue_status is None:
+        queue_status = QueueStatus(ttl=interval)
+    if scanner is None:
+        scanner = ErrorScanner()
     chkpt_files_prev = None
     for step in steps:
         chkpt_files = step(checkpoint_files=chkpt_files_prev)
         chkpt_files_prev = chkpt_files
         if not chkpt_files:
             return None
+        # jobs to rerun, per checkpoint file, at the next cycle
+        reruns = {}
         while True:
             done = []
-            reruns = []
+            queue_status.refresh()
             for cf in chkpt_files:
-                time.sleep(3)
-                update_checkpoint(job_ids=reruns, jfile=cf)
+                update_checkpoint(job_ids=reruns.pop(cf, []), jfile=cf)
+                update_pack_status(cf)
                 all_jobs = jobs_from_file(cf)
                 for j in all_jobs:
-                    state, ofname = get_job_state(j)
+                    state, ofname = get_job_state(j, queue_status)
+                    job_dir = os.path.join(j.parent_job_dir, j.job_dir)
+                    log_files = [ofname, 'OUTCAR'] if ofname else ['OUTCAR']
                     if j.final_energy:
                         done = done + [True]
                     elif state == 'R':
                         logger.info('job {} running'.format(j.job_id))
                         done = done + [False]
+                        for e in scanner.scan(job_dir, log_files):
+                            logger.warn('job {0} running with {1} error: {2}'
+                                        .format(j.job_id, e['error'],
+                                                e['message']))
                     elif state in ['C', 'CF', 'F', '00']:
                         logger.error(
                             'Job {0} in {1} cancelled or failed. State = {2}'.
                             format(j.job_id, j.job_dir, state))
                         done = done + [False]
+                        # the errors found while the job was running count
+                        scanner.scan(job_dir, log_files)
+                        errors = scanner.get_errors(job_dir, log_files)
+                        if errors.intersection(RESTARTABLE_ERRORS):
+                            logger.info(
+                                'job {} killed at the walltime, will be rerun'
+                                .format(j.job_id))
+                            reruns.setdefault(cf, []).append(
+                                get_rerun_key(j))
+                            # the rerun rewrites the log files
+                            scanner.reset(job_dir)
+                        elif errors:
+                            logger.error('Detected vasp errors {}'.format(
+                                sorted(errors)))
                         if handlers:
                             logger.info('Investigating ... ')
-                            os.chdir(j.job_dir)
                             if ofname:
-                                if os.path.exists(ofname):
-                                    for h in handlers:
-                                        h.output_filename = ofname
-                                        if h.check():
-                                            logger.error(
-                                                'Detected vasp errors {}'.format(
-                                                    h.errors))
-                                            # TODO: correct the error and mark the job for rerun
-                                            # all error handling must done using proper errorhandlers
-                                            # h.correct()
-                                            # reruns.append(j.job_id)
-                                else:
+                                errors = check_job_errors(
+                                    job_dir, ofname, handlers)
+                                if errors is None:
                                     logger.error(
                                         'stdout redirect file not generated, job {} will be rerun'.format(
                                             j.job_id))
-                                    reruns.append(j.job_id)
-                            os.chdir(j.parent_job_dir)
+                                    reruns.setdefault(cf, []).append(
+                                        get_rerun_key(j))
+                                elif errors:
+                                    # TODO: correct the error and mark the job for rerun
+                                    # all error handling must done using proper errorhandlers
+                                    logger.error(
+                                        'Detected vasp errors {}'.format(
+                                            errors))
                     else:
                         logger.info(
                             'Job {0} pending. State = {1}'.format(j.job_id,
@@ -484,7 +758,17 @@ def get_opt_params(data, species, param='ENCUT', ev_per_atom=0.001):
     """
     return optimum parameter
     default: 1 meV/atom
+
+    data can also be a ConvergenceTable, in which case species is
+    matched against its species column
     """
+    if isinstance(data, ConvergenceTable):
+        values, energies, job_dirs = data.get_series(species, param,
+                                                     key='species')
+        order = np.argsort(energies, kind='mergesort')
+        consecutive_diff = np.abs(
+            energies[order][:-1] - energies[order][1:] - ev_per_atom)
+        return values[order][np.argmin(consecutive_diff)]
     sorted_list = sorted(data[species][param], key=lambda x: x[1])
     sorted_array = np.array(sorted_list)
     consecutive_diff = np.abs(
@@ -557,7 +841,20 @@ def get_opt_params_custom(data, tag, param='ENCUT', ev_per_atom=1.0):
         param
 
     default criterion: 1 meV/atom
-    """
+
+    data can also be a ConvergenceTable, the potcar and poscar objects
+    are then read from the directory of the optimum job
+    """
+    if isinstance(data, ConvergenceTable):
+        values, t, job_dirs = data.get_series(tag, param)
+        consecutive_diff = t[1:] - t[:-1] - ev_per_atom
+        min_index = np.argmin(consecutive_diff)
+        potcar, poscar = None, None
+        potcar_file = os.path.join(job_dirs[min_index], 'POTCAR')
+        if os.path.exists(potcar_file):
+            potcar = get_potcar_from_file(potcar_file)
+        poscar = Poscar.from_file(os.path.join(job_dirs[min_index], 'POSCAR'))
+        return [tag, potcar, poscar, values[min_index], t]
     sorted_list = sorted(data[tag][param], key=lambda x: x[0])
     # sorted array data
     t = np.array(sorted_list)[:, 1]
@@ -572,6 +869,160 @@ def get_opt_params_custom(data, tag, param='ENCUT', ev_per_atom=1.0):
             data[tag][param][min_index][3], sorted_list[min_index][0], t]
 
 
+def get_converged_value(values, energies, ev_per_atom=0.001,
+                        n_converged=2):
+    """
+    early stopping criterion for the adaptive calibration: returns
+    the first of the values, in the given increasing order, from which
+    on the energy per atom changes by less than ev_per_atom for
+    n_converged consecutive points. None if the criterion is not met
+    yet.
+
+    Args:
+        values: knob values in increasing order
+        energies: the corresponding energies per atom, None for the
+            failed jobs which are skipped
+        ev_per_atom: convergence criterion
+        n_converged: number of consecutive converged differences
+    """
+    points = [(v, e) for v, e in zip(values, energies) if e is not None]
+    if len(points) < n_converged + 1:
+        return None
+    diffs = np.abs(np.diff([e for v, e in points])) < ev_per_atom
+    for i in range(len(diffs) - n_converged + 1):
+        if diffs[i:i + n_converged].all():
+            return points[i][0]
+    return None
+
+
+def read_poscar_header(poscar_file):
+    """
+    reads the comment line, the element symbols and the total number
+    of atoms from the header of a POSCAR file without parsing the
+    lattice and the coordinates. Falls back to a full parse for
+    POSCAR files without the element symbols line.
+
+    Args:
+        poscar_file: path to the POSCAR file
+
+    Returns:
+        comment, list of unique element symbols in the order of
+        appearance, number of atoms
+    """
+    with open(poscar_file) as f:
+        lines = [f.readline() for _ in range(7)]
+    comment = lines[0].strip()
+    symbols = lines[5].split()
+    try:
+        natoms = sum(int(n) for n in lines[6].split())
+    except ValueError:
+        # vasp4 format, no symbols line
+        poscar = Poscar.from_file(poscar_file)
+        symbols = poscar.site_symbols
+        natoms = len(poscar.structure)
+    return comment, list(OrderedDict.fromkeys(symbols)), natoms
+
+
+class ConvergenceTable(object):
+    """
+    Compact columnar table of calibration results, one row per job
+    and calibrated parameter with the columns:
+
+        tag: species_poscarcomment_functional
+        species: concatenated element symbols
+        param: name of the calibrated parameter, eg: ENCUT
+        value: value of the parameter
+        order: numerical sort key of the value, the value itself or
+            the number of kpoints for KPOINTS
+        energy_per_atom: final energy per atom, nan if not done
+        job_dir: job directory
+
+    Args:
+        rows: iterable of tuples in the column order
+    """
+
+    columns = ('tag', 'species', 'param', 'value', 'order',
+               'energy_per_atom', 'job_dir')
+
+    def __init__(self, rows=()):
+        cols = list(zip(*rows)) or [()] * len(self.columns)
+        for name, col in zip(self.columns, cols):
+            if name in ('order', 'energy_per_atom'):
+                arr = np.array(col, dtype=float)
+            else:
+                arr = np.empty(len(col), dtype=object)
+                arr[:] = list(col)
+            setattr(self, name, arr)
+
+    def __len__(self):
+        return len(self.tag)
+
+    def get_tags(self):
+        return list(OrderedDict.fromkeys(self.tag))
+
+    def get_series(self, name, param, key='tag'):
+        """
+        returns the values, energies per atom and job directories of
+        the finished jobs for the given tag(or species) and parameter,
+        sorted by the parameter value
+        """
+        mask = (getattr(self, key) == name) & (self.param == param) & \
+            ~np.isnan(self.energy_per_atom)
+        idx = np.flatnonzero(mask)
+        idx = idx[np.argsort(self.order[idx], kind='mergesort')]
+        return self.value[idx], self.energy_per_atom[idx], self.job_dir[idx]
+
+
+def _get_convergence_rows(job, params):
+    """
+    convergence table rows of a single job
+    """
+    jdir = os.path.join(job.parent_job_dir, job.job_dir)
+    comment, symbols, natoms = read_poscar_header(
+        os.path.join(jdir, 'POSCAR'))
+    species = ''.join(symbols)
+    tag = '_'.join([species, comment, job.vis.potcar.functional])
+    if job.final_energy is None:
+        energy = np.nan
+    else:
+        energy = job.final_energy / natoms
+    rows = []
+    for p in params:
+        if job.vis.incar.get(p):
+            value = job.vis.incar[p]
+            order = float(value)
+        elif p == 'KPOINTS':
+            value = job.vis.kpoints.kpts
+            order = float(np.prod(value[0]))
+        else:
+            logger.warn('dont know how to parse the parameter {}'.format(p))
+            continue
+        rows.append((tag, species, p, value, order, energy, jdir))
+    return rows
+
+
+def get_convergence_table(jfile, params=('ENCUT', 'KPOINTS'), nprocs=8):
+    """
+    parallel, columnar alternative to get_convergence_data(_custom):
+    the job metadata is read from the POSCAR headers in a thread pool
+    and collected in a ConvergenceTable that can be passed to
+    get_opt_params and get_opt_params_custom
+
+    Args:
+        jfile: checkpoint file
+        params: parameters to be extracted
+        nprocs: number of threads reading the job directories
+
+    Returns:
+        ConvergenceTable
+    """
+    jobs = jobs_from_file(jfile)
+    with ThreadPoolExecutor(max_workers=nprocs) as executor:
+        job_rows = list(executor.map(
+            lambda j: _get_convergence_rows(j, params), jobs))
+    return ConvergenceTable([r for rows in job_rows for r in rows])
+
+
 def partition_jobs(turn_knobs, max_jobs):
     """
     divide turn_knobs into smaller turn_knobs so that each one of
@@ -603,6 +1054,153 @@ def partition_jobs(turn_knobs, max_jobs):
     return turn_knobs_list, name_list
 
 
+def estimate_job_cost(encut=None, kpoints=None, natoms=1, volume=None):
+    """
+    relative cost of a vasp job modelled as
+    number of plane waves x number of kpoints x natoms^3,
+    where the number of plane waves scales as volume * ENCUT^1.5
+
+    Args:
+        encut: plane wave cutoff in eV, cost independent of it if None
+        kpoints: kpoint mesh, eg: [8, 8, 8] or [[8, 8, 8]], or the
+            scalar length/density parameter of the automatic grids
+        natoms: number of atoms
+        volume: cell volume in A^3, natoms is used as a proxy if None
+
+    Returns:
+        float
+    """
+    if volume is None:
+        volume = natoms
+    npw = volume * (encut ** 1.5 if encut else 1.0)
+    if kpoints is None:
+        nkpts = 1.0
+    elif np.isscalar(kpoints):
+        nkpts = float(kpoints) ** 3
+    else:
+        nkpts = float(np.prod(np.array(kpoints, dtype=float).ravel()[:3]))
+    return npw * nkpts * natoms ** 3
+
+
+def get_knob_cost(knobs, natoms=1, volume=None, encut=None, kpoints=None):
+    """
+    relative cost of a single combination of knob values
+
+    Args:
+        knobs: dict of knob name: value
+        natoms, volume, encut, kpoints: values used for the knobs
+            that are not calibrated
+    """
+    if knobs.get('POSCAR') is not None:
+        structure = knobs['POSCAR'].structure
+        natoms, volume = len(structure), structure.volume
+    if knobs.get('VOLUME') is not None:
+        volume = (volume or natoms) * knobs['VOLUME']
+    return estimate_job_cost(encut=knobs.get('ENCUT', encut),
+                             kpoints=knobs.get('KPOINTS', kpoints),
+                             natoms=natoms, volume=volume)
+
+
+def partition_jobs_by_cost(turn_knobs, n_partitions=1, walltime=None,
+                           seconds_per_cost=None, natoms=1, volume=None,
+                           encut=None, kpoints=None):
+    """
+    cost aware alternative to partition_jobs: as in partition_jobs,
+    the knob with the most values is split, but its values are
+    bin-packed into partitions with balanced total cost instead of
+    being sliced into equal chunks. The cost of a value is the
+    estimated cost(see estimate_job_cost) of all the combinations of
+    the knob values it is part of. Values are assigned largest first
+    to the least loaded partition.
+
+    If a walltime budget is given, the number of partitions is
+    increased until the estimated cost of every partition fits in it.
+
+    Args:
+        turn_knobs: ordered dict of knobs
+        n_partitions: (minimum) number of partitions
+        walltime: per partition walltime budget in seconds
+        seconds_per_cost: seconds of walltime per unit of the
+            estimated cost, eg: measured walltime of a reference job
+            divided by its estimated cost
+        natoms, volume, encut, kpoints: values used for the knobs
+            that are not calibrated, see get_knob_cost
+
+    Returns:
+        list of turn_knobs, one per partition, with a subset of the
+        values of the split knob and all the values of the other
+        knobs, list of partition names and list of the estimated
+        partition costs
+    """
+    keys = list(turn_knobs.keys())
+    if not any(len(v) for v in turn_knobs.values()):
+        # nothing to partition
+        return [], [], []
+    split_key = keys[int(np.argmax([len(v) for v in turn_knobs.values()]))]
+    others = [k for k in keys if k != split_key]
+    values = list(turn_knobs[split_key])
+    costs = []
+    for v in values:
+        cost = 0.0
+        for vals in it.product(*[turn_knobs[k] for k in others]):
+            knobs = dict(zip(others, vals))
+            knobs[split_key] = v
+            cost += get_knob_cost(knobs, natoms=natoms, volume=volume,
+                                  encut=encut, kpoints=kpoints)
+        costs.append(cost)
+    costs = np.array(costs)
+    max_cost = None
+    if walltime is not None and seconds_per_cost:
+        max_cost = walltime / float(seconds_per_cost)
+    order = np.argsort(-costs, kind='mergesort')
+    members = []
+    loads = []
+    if max_cost is not None:
+        oversized = [i for i in order if costs[i] > max_cost]
+        if oversized:
+            logger.warn('{0} values of {1} exceed the walltime budget '
+                        'on their own'.format(len(oversized), split_key))
+        # oversized values get partitions of their own
+        members = [[i] for i in oversized]
+        loads = [costs[i] for i in oversized]
+        order = np.array([i for i in order if costs[i] <= max_cost],
+                         dtype=int)
+    n_parts = max(1, n_partitions - len(members))
+    if max_cost is not None:
+        # lower bound for the number of partitions
+        n_parts = max(n_parts, int(np.ceil(costs[order].sum() / max_cost)))
+    n_parts = min(n_parts, len(order))
+    while n_parts:
+        part_loads = np.zeros(n_parts)
+        part_members = [[] for _ in range(n_parts)]
+        for i in order:
+            p = np.argmin(part_loads)
+            part_loads[p] += costs[i]
+            part_members[p].append(i)
+        if max_cost is None or n_parts >= len(order) or \
+                part_loads.max() <= max_cost:
+            break
+        n_parts += 1
+    if n_parts:
+        members += part_members
+        loads += list(part_loads)
+    turn_knobs_list = []
+    for m in members:
+        if not m:
+            continue
+        turn_knobs_list.append(OrderedDict(
+            (k, [values[i] for i in sorted(m)] if k == split_key
+             else turn_knobs[k]) for k in keys))
+    part_costs = [float(l) for l, m in zip(loads, members) if m]
+    name_list = ['part_{}'.format(i) for i in range(len(turn_knobs_list))]
+    logger.info(
+        '{0} list of length {1} partitioned into {2} partitions, '
+        'max/min partition cost = {3:.3f}'.format(
+            split_key, len(values), len(turn_knobs_list),
+            max(part_costs) / max(min(part_costs), 1e-300)))
+    return turn_knobs_list, name_list, part_costs
+
+
 def get_logger(log_file_name):
     """
     writes out logging file.
@@ -675,12 +1273,18 @@ def is_converged(directory):
 
     Returns:
         boolean. Whether or not the job is converged.
+
+    Uses the lightweight probe_vasp_run instead of parsing the
+    complete vasprun.xml, falls back to OUTCAR if there is no
+    vasprun.xml
     """
 
     try:
-        return Vasprun('{}/vasprun.xml'.format(directory)).converged
-    except:
+        probe = probe_vasp_run(directory)
+    except (IOError, OSError, ValueError) as ex:
+        logger.warn('could not probe {0}: {1}'.format(directory, ex))
         return False
+    return bool(probe and probe['converged'])
 
 
 def get_spacing(structure):
@@ -751,10 +1355,96 @@ def ensure_vacuum(structure, vacuum):
         Structure object with vacuum added.
     """
 
-    structure = align_axis(structure)
-    spacing = get_spacing(structure)
-    structure = add_vacuum(structure, vacuum - spacing)
-    return center_slab(structure)
+    return prepare_slabs([structure], vacuum)[0]
+
+
+def get_c_alignment(lattice, direction=(0, 0, 1)):
+    """
+    Returns the rotation matrix that brings the c vector of the
+    lattice along direction, the same rotation as applied by
+    align_axis, or None if c is already along direction.
+
+    Args:
+        lattice (array): 3x3 lattice matrix, lattice vectors as rows
+        direction (vector): final direction of the c vector
+    """
+    axis = lattice[2]
+    proj_axis = np.cross(axis, direction)
+    if proj_axis[0] == 0 and proj_axis[1] == 0:
+        return None
+    theta = np.arccos(np.dot(axis, direction)
+                      / (np.linalg.norm(axis) * np.linalg.norm(direction)))
+    return get_rotation_matrix(proj_axis, theta)
+
+
+def center_frac_coords(frac_coords):
+    """
+    Array counterpart of center_slab: shifts the fractional
+    coordinates so that the average z is 0.5 and wraps them back
+    into the unit cell.
+
+    Args:
+        frac_coords (array): Nx3 fractional coordinates
+    Returns:
+        array of centered fractional coordinates
+    """
+    frac_coords = np.array(frac_coords, dtype=float)
+    frac_coords[:, 2] += 0.5 - np.average(frac_coords[:, 2])
+    return np.mod(frac_coords, 1.0)
+
+
+def prepare_slab_arrays(lattice, frac_coords, vacuum):
+    """
+    Rotates the c axis along z, measures the slab thickness and sets
+    the vacuum padding to the given value, working on the lattice and
+    coordinate arrays only. The result is the same as ensure_vacuum.
+
+    Args:
+        lattice (array): 3x3 lattice matrix
+        frac_coords (array): Nx3 fractional coordinates
+        vacuum (float): final vacuum thickness in Angstroms
+    Returns:
+        (lattice, frac_coords) arrays of the padded and centered slab
+    """
+    lattice = np.array(lattice, dtype=float)
+    R = get_c_alignment(lattice)
+    if R is not None:
+        # fractional coordinates are invariant under the rotation
+        lattice = np.dot(lattice, R.T)
+    frac_coords = center_frac_coords(frac_coords)
+    cart_z = np.dot(frac_coords, lattice[:, 2])
+    thickness = cart_z.max() - cart_z.min()
+    spacing = np.linalg.norm(lattice[2]) - thickness
+    cart_coords = np.dot(frac_coords, lattice)
+    lattice[2][2] += vacuum - spacing
+    frac_coords = np.linalg.solve(lattice.T, cart_coords.T).T
+    return lattice, center_frac_coords(frac_coords)
+
+
+def prepare_slabs(structures, vacuum):
+    """
+    Batch version of ensure_vacuum. The alignment, thickness
+    measurement, vacuum padding and centering are done on arrays and
+    the Structure objects are only built for the output. The input
+    structures are not modified.
+
+    Args:
+        structures (list): list of Structure objects of 2D materials
+            or slabs
+        vacuum (float or list): final vacuum thickness in Angstroms,
+            either one value for all the structures or one per
+            structure
+    Returns:
+        list of Structure objects with vacuum added
+    """
+    vacuums = np.broadcast_to(vacuum, (len(structures),))
+    slabs = []
+    for structure, vac in zip(structures, vacuums):
+        lattice, frac_coords = prepare_slab_arrays(
+            structure.lattice.matrix, structure.frac_coords, vac)
+        slabs.append(Structure(lattice, structure.species, frac_coords,
+                               site_properties=structure.site_properties))
+    return slabs
 
 
 def get_rotation_matrix(axis, theta):
@@ -1116,7 +1806,8 @@ def update_submission_template(default_template, qtemplate):
     """
     pass
 
-def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary):
+def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary,
+                     features=None):
     """
     writes a runjob based on a name, nnodes, nprocessors, walltime,
     and binary. Designed for runjobs on the Hennig group_list on
@@ -1129,7 +1820,16 @@ def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary):
         pmem (str): requested memory including units, e.g. '1600mb'.
         walltime (str): requested wall time, hh:mm:ss e.g. '2:00:00'.
         binary (str): absolute path to binary to run.
-    """
+        features (dict): job features, read from the input files in
+            the current directory if not given. If a resource model is
+            configured, nnodes and walltime are the ones suggested by
+            the model, walltime being the limit.
+    """
+    suggestion = suggest_resources(features, cores_per_node=nprocessors,
+                                   max_walltime=walltime, job_dir='.')
+    if suggestion:
+        nnodes = suggestion['nnodes']
+        walltime = suggestion['walltime']
     runjob = open('runjob', 'w')
     runjob.write('#!/bin/sh\n')
     runjob.write('#PBS -N {}\n'.format(name))
@@ -1146,7 +1846,7 @@ def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary):
     runjob.close()
 
 
-def write_slurm_runjob(name, ntasks, pmem, walltime, binary):
+def write_slurm_runjob(name, ntasks, pmem, walltime, binary, features=None):
     """
     writes a runjob based on a name, nnodes, nprocessors, walltime, and
     binary. Designed for runjobs on the Hennig group_list on HiperGator
@@ -1158,9 +1858,21 @@ def write_slurm_runjob(name, ntasks, pmem, walltime, binary):
         pmem (str): requested memory including units, e.g. '1600mb'.
         walltime (str): requested wall time, hh:mm:ss e.g. '2:00:00'.
         binary (str): absolute path to binary to run.
+        features (dict): job features, read from the input files in
+            the current directory if not given. If a resource model is
+            configured, the number of nodes, at most the one needed
+            for ntasks, and walltime are the ones suggested by the
+            model, walltime being the limit. ntasks is then the
+            number of cores of the suggested nodes.
     """
-
     nnodes = int(np.ceil(float(ntasks) / 32.0))
+    suggestion = suggest_resources(features, cores_per_node=min(ntasks, 32),
+                                   max_nodes=nnodes, max_walltime=walltime,
+                                   job_dir='.')
+    if suggestion:
+        nnodes = suggestion['nnodes']
+        ntasks = suggestion['ntasks']
+        walltime = suggestion['walltime']
 
     runjob = open('runjob', 'w')
     runjob.write('#!/bin/bash\n')
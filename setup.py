@@ -11,7 +11,8 @@ setup(
     install_requires=["FireWorks>=1.4.0",
                       "custodian>=1.0.1", "pymatgen-db>=0.5.1",
                       "ase>=3.11.0", "six", "pyhull>=1.5.3",
-		      "seaborn","pyyaml"],
+		      "seaborn","pyyaml",
+                      "futures; python_version<'3'"],
     extras_require={"babel": ["openbabel", "pybel"],
                     "remote": ["fabric"],
                     "doc": ["sphinx>=1.3.1", "sphinx-rtd-theme>=0.1.8"]